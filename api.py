@@ -1,12 +1,156 @@
+import os
+import time
 import uvicorn
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from controllers.cache_controller import ContentCacheController
+from controllers.chunk_store_controller import ChunkStoreController
+from controllers.query_cache_controller import QueryCacheController
+from controllers.registry_controller import ControllerRegistry
+from controllers.ingestion_job_controller import IngestionJobController
 from routes.chat_routes import router as chat_router
 from routes.context_routes import router as context_router
-from routes.ingest_routes import router as ingestion_router
+from routes.ingest_routes import router as ingestion_router, build_ingestion_pipeline
 
+load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
 
-app = FastAPI()
+PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL_NAME")
+LLM_MODEL = os.getenv("LLM_MODEL_NAME")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+LLM_KEEP_ALIVE = os.getenv("LLM_KEEP_ALIVE", "30m")
+LLM_NUM_CTX = int(os.getenv("LLM_NUM_CTX", "8192"))
+# Threads running the blocking calls (Ollama, Pinecone, index queries) of the request handlers
+REQUEST_THREADS = int(os.getenv("REQUEST_THREADS", "32"))
+
+# Persistent cache of chunk contexts and embeddings (empty path disables it)
+CONTENT_CACHE_PATH = os.getenv("CONTENT_CACHE_PATH", ".cache/content_cache.sqlite")
+CONTENT_CACHE_MAX_MB = int(os.getenv("CONTENT_CACHE_MAX_MB", "1024"))
+
+# Chunk texts, sources and pages, vectors and lexical indexes then only keep ids (empty path keeps the texts inline)
+CHUNK_STORE_PATH = os.getenv("CHUNK_STORE_PATH", ".cache/chunk_store.sqlite")
+
+# Cache of retrieval results for repeated / near-identical questions (0 entries disables it)
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1024"))
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "600"))
+QUERY_CACHE_SIMILARITY = float(os.getenv("QUERY_CACHE_SIMILARITY", "0.97"))
+
+# Dense retrieval backend: "pinecone" or "local" (memory-mapped IVF index, index names become directories under LOCAL_VECTOR_DIR)
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pinecone")
+LOCAL_VECTOR_DIR = os.getenv("LOCAL_VECTOR_DIR", ".vectors")
+LOCAL_VECTOR_NPROBE = int(os.getenv("LOCAL_VECTOR_NPROBE", "16"))
+
+# Stored embeddings: leading dimensions kept (empty = all 768), precision of the local vectors scanned by
+# queries (float32, float16 or int8) and candidates per result rescored at full precision (0 disables)
+EMBEDDING_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION") or 0) or None
+LOCAL_VECTOR_PRECISION = os.getenv("LOCAL_VECTOR_PRECISION", "float32")
+LOCAL_VECTOR_RESCORE = int(os.getenv("LOCAL_VECTOR_RESCORE", "4"))
+
+# Pinecone upserts: vectors per request and requests sent in parallel
+PINECONE_UPSERT_BATCH_SIZE = int(os.getenv("PINECONE_UPSERT_BATCH_SIZE", "100"))
+PINECONE_UPSERT_THREADS = int(os.getenv("PINECONE_UPSERT_THREADS", "4"))
+
+# Reranking: fused candidates scored per question (top_k of them are returned), documents per
+# cross-encoder batch, characters kept per document and (question, chunk) scores kept in memory
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+RERANK_MAX_CHARS = int(os.getenv("RERANK_MAX_CHARS", "2048"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "10000"))
+
+# Questions accepted by one /retrieve/batch request, and its vector store queries in flight at most
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "256"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "64"))
+
+# Background ingestion jobs
+INGESTION_QUEUE_PATH = os.getenv("INGESTION_QUEUE_PATH", ".cache/ingestion_jobs.sqlite")
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "1"))
+
+# Comma separated index names to load at startup (optional)
+WARM_PINECONE_INDEX_NAMES = os.getenv("WARM_PINECONE_INDEX_NAMES", "")
+WARM_TFIDF_INDEX_NAMES = os.getenv("WARM_TFIDF_INDEX_NAMES", "")
+WARM_BM25_INDEX_NAMES = os.getenv("WARM_BM25_INDEX_NAMES", "")
+WARM_RERANKER = os.getenv("WARM_RERANKER", "true").lower() == "true"
+
+
+def split_names(value: str) -> list:
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    content_cache = None
+    if CONTENT_CACHE_PATH:
+        content_cache = ContentCacheController(CONTENT_CACHE_PATH, max_bytes=CONTENT_CACHE_MAX_MB * 1024 * 1024)
+
+    chunk_store = ChunkStoreController(CHUNK_STORE_PATH) if CHUNK_STORE_PATH else None
+
+    query_cache = None
+    if QUERY_CACHE_MAX_ENTRIES > 0:
+        query_cache = QueryCacheController(
+            max_entries=QUERY_CACHE_MAX_ENTRIES,
+            ttl_seconds=QUERY_CACHE_TTL_SECONDS,
+            similarity_threshold=QUERY_CACHE_SIMILARITY
+        )
+
+    registry = ControllerRegistry(
+        pinecone_api_key=PINECONE_API_KEY,
+        embedding_batch_size=EMBEDDING_BATCH_SIZE,
+        llm_concurrency=LLM_CONCURRENCY,
+        content_cache=content_cache,
+        chunk_store=chunk_store,
+        llm_keep_alive=LLM_KEEP_ALIVE,
+        llm_num_ctx=LLM_NUM_CTX,
+        request_threads=REQUEST_THREADS,
+        query_cache=query_cache,
+        vector_store=VECTOR_STORE,
+        local_vector_dir=LOCAL_VECTOR_DIR,
+        local_vector_nprobe=LOCAL_VECTOR_NPROBE,
+        vector_dimension=EMBEDDING_DIMENSION,
+        local_vector_precision=LOCAL_VECTOR_PRECISION,
+        local_vector_rescore=LOCAL_VECTOR_RESCORE,
+        pinecone_upsert_batch_size=PINECONE_UPSERT_BATCH_SIZE,
+        pinecone_upsert_threads=PINECONE_UPSERT_THREADS,
+        rerank_candidates=RERANK_CANDIDATES,
+        rerank_batch_size=RERANK_BATCH_SIZE,
+        rerank_max_chars=RERANK_MAX_CHARS,
+        rerank_cache_size=RERANK_CACHE_SIZE,
+        batch_max_queries=BATCH_MAX_QUERIES,
+        batch_max_concurrency=BATCH_MAX_CONCURRENCY
+    )
+    app.state.registry = registry
+
+    try:
+        registry.warm(
+            pinecone_index_names=split_names(WARM_PINECONE_INDEX_NAMES),
+            tfidf_index_names=split_names(WARM_TFIDF_INDEX_NAMES),
+            bm25_index_names=split_names(WARM_BM25_INDEX_NAMES),
+            embedding_models=[EMBEDDING_MODEL] if EMBEDDING_MODEL else [],
+            llm_models=[LLM_MODEL] if LLM_MODEL else [],
+            reranker_models=[('flashrank', 'en')] if WARM_RERANKER else []
+        )
+    except Exception as e:
+        print(f"Error when trying to warm the controller registry: {e}")
+
+    # Ingestion runs on background workers so it never blocks the event loop serving /chat
+    ingestion_jobs = IngestionJobController(
+        INGESTION_QUEUE_PATH,
+        pipeline_factory=lambda params: build_ingestion_pipeline(registry, params),
+        workers=INGESTION_WORKERS
+    )
+    ingestion_jobs.start()
+    app.state.ingestion_jobs = ingestion_jobs
+
+    yield
+
+    ingestion_jobs.stop(timeout=30)
+    registry.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",
@@ -22,9 +166,40 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def observe_request_duration(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Labelled by route template (/documents/{document_id}), not by raw path
+    route = request.scope.get("route")
+    registry = getattr(request.app.state, "registry", None)
+    if registry is not None:
+        registry.metrics.observe(
+            'http_request_duration_seconds', time.perf_counter() - start,
+            help_text="Duration of the HTTP requests",
+            method=request.method, route=route.path if route else "unmatched", status=response.status_code
+        )
+    return response
+
+
 app.include_router(context_router)
 app.include_router(ingestion_router)
 app.include_router(chat_router)
 
+
+@app.get("/registry-stats")
+async def registry_stats(request: Request):
+    registry = request.app.state.registry
+    return await registry.run_blocking(registry.stats)
+
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    # Prometheus text format: stage / request duration histograms and cache counters
+    registry = request.app.state.registry
+    counters = await registry.run_blocking(registry.metric_counters)
+    return PlainTextResponse(registry.metrics.render(extra_counters=counters), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
-    uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True)
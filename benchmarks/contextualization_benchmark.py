@@ -0,0 +1,61 @@
+import os, sys
+import time
+import argparse
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+from controllers.llm_controller import LLMController
+from controllers.document_reading_controller import DocumentExtractionController
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
+
+LLM_MODEL = os.getenv("LLM_MODEL_NAME")
+
+
+def run_mode(mode, text, chunks, model_name, workers, num_ctx):
+    # No content cache here: every chunk has to reach Ollama
+    llm_admin = LLMController(model_name=model_name, num_ctx=num_ctx)
+
+    start = time.perf_counter()
+    if mode == "document":
+        llm_admin.generate_chunk_contexts(main_idea=None, chunks=chunks, max_workers=workers, document=text)
+    else:
+        main_idea = llm_admin.generate_main_text_idea(text=text)
+        llm_admin.generate_chunk_contexts(main_idea=main_idea, chunks=chunks, max_workers=workers)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'mode': mode,
+        'seconds': elapsed,
+        'requests': llm_admin.usage['requests'],
+        'prompt_tokens_evaluated': llm_admin.usage['prompt_eval_count'],
+        'generated_tokens': llm_admin.usage['eval_count']
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunk contextualization: main idea prompt vs cached document prefix (needs a running Ollama)")
+    parser.add_argument("--pdf", required=True)
+    parser.add_argument("--start-page", type=int, default=0)
+    parser.add_argument("--end-page", type=int, default=None)
+    parser.add_argument("--max-chunks", type=int, default=20)
+    parser.add_argument("--model", default=LLM_MODEL)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--num-ctx", type=int, default=8192)
+    args = parser.parse_args()
+
+    reading = DocumentExtractionController(args.pdf)
+    text = reading.extract_text_from_pdf(start_page=args.start_page, end_page=args.end_page)
+    chunks = reading.generate_chunks(text=text)[:args.max_chunks]
+
+    # Loads the model once so neither mode pays for it
+    LLMController(model_name=args.model, num_ctx=args.num_ctx).generate_chunk_context(main_idea="warm up", chunk="warm up")
+
+    print(f"{'mode':>10} {'seconds':>9} {'requests':>9} {'prompt tokens':>14} {'per chunk':>10} {'generated':>10}")
+    for mode in ("main_idea", "document"):
+        result = run_mode(mode, text, chunks, args.model, args.workers, args.num_ctx)
+        print(
+            f"{result['mode']:>10} {result['seconds']:>9.1f} {result['requests']:>9} "
+            f"{result['prompt_tokens_evaluated']:>14} {result['prompt_tokens_evaluated'] / max(1, len(chunks)):>10.0f} "
+            f"{result['generated_tokens']:>10}"
+        )
@@ -0,0 +1,75 @@
+import time
+import asyncio
+import argparse
+import httpx
+import numpy as np
+
+
+async def run_level(client, url, payload, concurrency, requests_per_worker):
+    latencies, errors = [], 0
+
+    async def worker():
+        nonlocal errors
+        for _ in range(requests_per_worker):
+            start = time.perf_counter()
+            try:
+                response = await client.post(url, json=payload)
+                if response.status_code != 200 or "error" in response.json():
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': np.percentile(latencies, 50) * 1000,
+        'p95_ms': np.percentile(latencies, 95) * 1000
+    }
+
+
+async def main(args):
+    payload = {
+        "query": args.query,
+        "pinecone_index_name": args.pinecone_index_name,
+        "tfidf_index_name": args.tfidf_index_name,
+        "bm25_index_name": args.bm25_index_name,
+        "lexical_retriever": args.lexical_retriever,
+        "top_k": args.top_k
+    }
+    url = f"{args.base_url.rstrip('/')}{args.endpoint}"
+
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        # One request first so model loading and index warm-up are not measured
+        await client.post(url, json=payload)
+
+        print(f"{'concurrency':>12} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50':>10} {'p95':>10}")
+        for concurrency in args.concurrency:
+            result = await run_level(client, url, payload, concurrency, args.requests_per_worker)
+            print(
+                f"{result['concurrency']:>12} {result['requests']:>9} {result['errors']:>7} "
+                f"{result['requests_per_second']:>8.1f} {result['p50_ms']:>8.0f}ms {result['p95_ms']:>8.0f}ms"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Requests/sec of a running API at increasing concurrency")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--endpoint", default="/rank-fusion", help="/chat, /rank-fusion, /context-tfidf, ...")
+    parser.add_argument("--query", default="What is the main topic of the document?")
+    parser.add_argument("--pinecone-index-name")
+    parser.add_argument("--tfidf-index-name")
+    parser.add_argument("--bm25-index-name")
+    parser.add_argument("--lexical-retriever", default="tfidf")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--requests-per-worker", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    asyncio.run(main(parser.parse_args()))
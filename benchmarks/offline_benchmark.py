@@ -0,0 +1,363 @@
+import os, sys
+import json
+import time
+import glob
+import asyncio
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+# Read by the routes when they are imported, the stub server accepts any model name
+EMBEDDING_MODEL = os.environ["EMBEDDING_MODEL_NAME"] = "offline-embed"
+LLM_MODEL = os.environ["LLM_MODEL_NAME"] = "offline-llm"
+
+from offline_stubs import StubOllamaServer, InMemoryVectorStore, StubRanker
+from synthetic_corpus import generate_corpus
+from controllers.metrics_controller import MetricsController
+from controllers.registry_controller import ControllerRegistry
+from controllers.chunk_store_controller import ChunkStoreController
+from controllers.custom_rerank_controller import CustomRerankController
+from controllers.document_reading_controller import DocumentExtractionController
+from controllers.ingestion_pipeline_controller import IngestionPipelineController
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+# Compared between runs, higher is better for the throughputs
+COMPARED_METRICS = ("chunks_per_second", "requests_per_second", "p50_ms", "p95_ms", "p99_ms", "peak_rss_mb")
+
+
+class RecordingMetrics(MetricsController):
+    # Keeps every observation as well, the histograms alone can't give exact percentiles
+    def __init__(self):
+        super().__init__()
+        self.samples = {}
+
+    def observe(self, name, seconds, help_text="", **labels):
+        super().observe(name, seconds, help_text, **labels)
+        with self._lock:
+            self.samples.setdefault((name, labels.get('stage')), []).append(seconds)
+
+
+class OfflineRegistry(ControllerRegistry):
+    """
+    ControllerRegistry with Pinecone replaced by InMemoryVectorStore and the reranker model by
+    StubRanker. Ollama is the stub server given by OLLAMA_HOST, so the embedding and LLM
+    controllers are the real ones.
+    """
+
+    def __init__(self, rerank_delay, **kwargs):
+        super().__init__(**kwargs)
+        self.rerank_delay = rerank_delay
+
+    def get_pinecone(self, index_name):
+        return self._get_or_create('pinecone', index_name, InMemoryVectorStore)
+
+    def get_reranker(self, model_name='flashrank', language_code='en'):
+        return self._get_or_create(
+            'reranker', (model_name, language_code),
+            lambda: CustomRerankController(
+                model_name=model_name, language_code=language_code, batch_size=self.rerank_batch_size,
+                max_chars=self.rerank_max_chars, cache_size=self.rerank_cache_size,
+                ranker=StubRanker(self.rerank_delay)
+            )
+        )
+
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # No procfs: peak of the whole process so far (kilobytes on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class PeakRSS:
+    # Samples the resident set size in the background while a phase runs
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss_bytes()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes())
+
+    @property
+    def peak_mb(self):
+        return self.peak / (1024 * 1024)
+
+
+def percentiles_ms(seconds):
+    if not seconds:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+    p50, p95, p99 = np.percentile(np.asarray(seconds) * 1000, [50, 95, 99])
+    return {'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99)}
+
+
+def run_ingestion(registry, pdf_paths, index_names, args):
+    # Same pipeline as ingestion_data_manual.main_ingestion_process, one run per document
+    vector_admin = registry.get_vector_store(index_names['pinecone_index_name'])
+    lexical_admins = [registry.get_tfidf(index_names['tfidf_index_name']), registry.get_bm25(index_names['bm25_index_name'])]
+
+    chunks, stages = 0, {}
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        for pdf_path in pdf_paths:
+            pipeline = IngestionPipelineController(
+                reading=DocumentExtractionController(pdf_path),
+                llm_admin=registry.get_llm(LLM_MODEL),
+                embedding_admin=registry.get_embedding(EMBEDDING_MODEL),
+                vector_admin=vector_admin,
+                lexical_admins=lexical_admins,
+                chunk_store=registry.get_chunk_store(None, **index_names),
+                context_mode=args.context_mode,
+                llm_concurrency=args.llm_concurrency,
+                batch_size=registry.embedding_batch_size,
+                metrics=registry.metrics
+            )
+            pipeline_stats = pipeline.run()
+            chunks += pipeline_stats['chunks']
+            for stage, stats in pipeline_stats['stages'].items():
+                totals = stages.setdefault(stage, {'items': 0, 'seconds': 0.0})
+                totals['items'] += stats['items']
+                totals['seconds'] += stats['seconds']
+        elapsed = time.perf_counter() - start
+
+    for stage, totals in stages.items():
+        # Stages overlap, so items_per_second is per second spent in the stage, not of wall time
+        totals['items_per_second'] = totals['items'] / totals['seconds'] if totals['seconds'] > 0 else None
+        totals.update(percentiles_ms(registry.metrics.samples.get(('rag_ingestion_stage_duration_seconds', stage), [])))
+
+    return {
+        'documents': len(pdf_paths),
+        'chunks': chunks,
+        'seconds': elapsed,
+        'chunks_per_second': chunks / elapsed if elapsed > 0 else 0.0,
+        'peak_rss_mb': rss.peak_mb,
+        'stages': stages
+    }
+
+
+async def run_queries(app, endpoint, payloads, concurrency):
+    # Requests go through the FastAPI app in process (routes, middleware, thread pool), without a socket
+    import httpx
+
+    latencies, stage_timings, errors = [], {}, 0
+    pending = iter(payloads)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://offline", timeout=None) as client:
+        # Controllers are loaded by the first request, it is not measured
+        await client.post(endpoint, json=payloads[0])
+
+        async def worker():
+            nonlocal errors
+            for payload in pending:
+                start = time.perf_counter()
+                response = await client.post(endpoint, json=payload)
+                latencies.append(time.perf_counter() - start)
+                body = response.json()
+                if response.status_code != 200 or "error" in body:
+                    errors += 1
+                    continue
+                for stage, milliseconds in body.get("timings", {}).items():
+                    if stage != "total":
+                        stage_timings.setdefault(stage, []).append(milliseconds / 1000)
+
+        with PeakRSS() as rss:
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - start
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'concurrency': concurrency,
+        'requests_per_second': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'peak_rss_mb': rss.peak_mb,
+        **percentiles_ms(latencies),
+        'stages': {stage: percentiles_ms(seconds) for stage, seconds in sorted(stage_timings.items())}
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten_metrics(results):
+    # {"ingestion.stages.embed.p95_ms": 12.3, "queries./chat.requests_per_second": 4.5, ...}
+    flat = {}
+
+    def visit(prefix, value):
+        if isinstance(value, dict):
+            for key, child in value.items():
+                visit(f"{prefix}.{key}" if prefix else key, child)
+        elif prefix.rsplit(".", 1)[-1] in COMPARED_METRICS and value is not None:
+            flat[prefix] = value
+
+    visit("", {'ingestion': results['ingestion'], 'queries': results['queries']})
+    return flat
+
+
+def compare(previous, current):
+    if previous['config'] != current['config']:
+        print("(the previous run used a different configuration)")
+    before, after = flatten_metrics(previous), flatten_metrics(current)
+    print(f"\nCompared to {previous['label']} ({previous.get('git_commit') or 'unknown commit'}):")
+    for name, value in after.items():
+        if name in before and before[name]:
+            change = (value - before[name]) / before[name] * 100
+            print(f"  {name:<55} {before[name]:>10.2f} -> {value:>10.2f} ({change:+.1f}%)")
+
+
+def print_results(results):
+    ingestion = results['ingestion']
+    print(
+        f"\nIngestion: {ingestion['chunks']} chunks from {ingestion['documents']} documents in {ingestion['seconds']:.1f}s "
+        f"({ingestion['chunks_per_second']:.1f} chunks/sec, peak RSS {ingestion['peak_rss_mb']:.0f} MB)"
+    )
+    print(f"{'stage':>14} {'items':>7} {'items/s':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for stage, stats in ingestion['stages'].items():
+        if not stats['items']:
+            continue
+        print(
+            f"{stage:>14} {stats['items']:>7} {stats['items_per_second'] or 0:>9.1f} "
+            f"{stats['p50_ms']:>7.1f}ms {stats['p95_ms']:>7.1f}ms {stats['p99_ms']:>7.1f}ms"
+        )
+
+    for endpoint, stats in results['queries'].items():
+        print(
+            f"\n{endpoint}: {stats['requests']} requests ({stats['errors']} errors) at concurrency {stats['concurrency']}, "
+            f"{stats['requests_per_second']:.1f} req/s, peak RSS {stats['peak_rss_mb']:.0f} MB"
+        )
+        print(f"{'stage':>14} {'p50':>9} {'p95':>9} {'p99':>9}")
+        for stage, stage_stats in [('request', stats), *stats['stages'].items()]:
+            print(f"{stage:>14} {stage_stats['p50_ms']:>7.1f}ms {stage_stats['p95_ms']:>7.1f}ms {stage_stats['p99_ms']:>7.1f}ms")
+
+
+def main(args):
+    work_dir = tempfile.mkdtemp(prefix="offline-benchmark-")
+    pdf_paths, queries = generate_corpus(
+        os.path.join(work_dir, "corpus"), n_documents=args.documents, pages_per_document=args.pages,
+        words_per_page=args.words_per_page, n_queries=args.queries, seed=args.seed
+    )
+
+    with StubOllamaServer(
+        dim=args.dim, llm_delay=args.llm_delay_ms / 1000, token_delay=args.token_delay_ms / 1000,
+        embed_delay=args.embed_delay_ms / 1000, answer_tokens=args.answer_tokens, llm_parallel=args.llm_parallel
+    ) as ollama_stub:
+        os.environ["OLLAMA_HOST"] = ollama_stub.url
+
+        registry = OfflineRegistry(
+            rerank_delay=args.rerank_delay_ms / 1000,
+            pinecone_api_key=None,
+            embedding_batch_size=args.embedding_batch_size,
+            llm_concurrency=args.llm_concurrency,
+            vector_store=args.vector_store,
+            local_vector_dir=os.path.join(work_dir, "vectors"),
+            chunk_store=None if args.no_chunk_store else ChunkStoreController(os.path.join(work_dir, "chunk_store.sqlite")),
+            rerank_candidates=args.rerank_candidates,
+            metrics=RecordingMetrics()
+        )
+        index_names = {
+            "pinecone_index_name": "offline-benchmark",
+            "tfidf_index_name": os.path.join(work_dir, "offline-benchmark.pkl"),
+            "bm25_index_name": os.path.join(work_dir, "offline-benchmark-bm25")
+        }
+
+        try:
+            ingestion = run_ingestion(registry, pdf_paths, index_names, args)
+
+            # Imported once the environment is set, the routes read the model names at import time
+            from api import app
+            app.state.registry = registry
+
+            query_results = {}
+            for endpoint in args.endpoints:
+                payloads = [
+                    {**index_names, "query": query, "top_k": args.top_k, "lexical_retriever": "bm25", "include_timings": True}
+                    for query in queries
+                ]
+                query_results[endpoint] = asyncio.run(run_queries(app, endpoint, payloads, args.concurrency))
+        finally:
+            registry.shutdown()
+
+    results = {
+        'label': args.label or time.strftime("%Y%m%d-%H%M%S"),
+        'created': time.time(),
+        'git_commit': git_commit(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('label', 'results_dir', 'compare_to')},
+        'stub_calls': ollama_stub.calls,
+        'ingestion': ingestion,
+        'queries': query_results
+    }
+    print_results(results)
+
+    previous_path = args.compare_to
+    if previous_path is None:
+        previous_runs = sorted(glob.glob(os.path.join(args.results_dir, "*.json")), key=os.path.getmtime)
+        previous_path = previous_runs[-1] if previous_runs else None
+    if previous_path:
+        with open(previous_path) as f:
+            compare(json.load(f), results)
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    result_path = os.path.join(args.results_dir, f"{results['label']}.json")
+    with open(result_path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {result_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Ingestion throughput and /chat, /rank-fusion latency on a synthetic corpus, with Ollama, Pinecone and the reranker stubbed in process"
+    )
+    parser.add_argument("--documents", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=20, help="Pages per document")
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--queries", type=int, default=100, help="Requests per endpoint")
+    parser.add_argument("--endpoints", nargs="+", default=["/rank-fusion", "/chat"])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--vector-store", choices=["pinecone", "local"], default="pinecone",
+                        help="pinecone: in-memory stand-in for Pinecone, local: the memory-mapped IVF index")
+    parser.add_argument("--no-chunk-store", action="store_true", help="Keep the chunk texts in the vector store and indexes")
+    parser.add_argument("--context-mode", choices=["main_idea", "document"], default="main_idea")
+    parser.add_argument("--llm-concurrency", type=int, default=4)
+    parser.add_argument("--embedding-batch-size", type=int, default=32)
+    parser.add_argument("--rerank-candidates", type=int, default=50)
+    parser.add_argument("--dim", type=int, default=768, help="Embedding dimension of the stub embedder")
+    parser.add_argument("--llm-delay-ms", type=float, default=50, help="Stub LLM latency before the first token")
+    parser.add_argument("--token-delay-ms", type=float, default=2, help="Stub LLM latency per generated token")
+    parser.add_argument("--answer-tokens", type=int, default=40)
+    parser.add_argument("--llm-parallel", type=int, default=4, help="LLM calls served at once by the stub (OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--embed-delay-ms", type=float, default=5, help="Stub latency per embedding request")
+    parser.add_argument("--rerank-delay-ms", type=float, default=0.5, help="Stub reranker latency per scored chunk")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", help="Name of the saved result (default: timestamp)")
+    parser.add_argument("--results-dir", default=RESULTS_DIR)
+    parser.add_argument("--compare-to", help="Result file to compare with (default: the latest one in --results-dir)")
+    main(parser.parse_args())
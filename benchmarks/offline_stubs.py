@@ -0,0 +1,246 @@
+import os, sys
+import re
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+from controllers.document_processing_controller import stored_chunk_ids
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def hashed_embedding(text, dim=768):
+    # Feature hashing of the words: deterministic, and texts sharing words get similar vectors
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        vector[int.from_bytes(digest[:4], "little") % dim] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _between(text, start, end):
+    if start not in text:
+        return text
+    return text.split(start, 1)[1].split(end, 1)[0]
+
+
+class StubOllamaServer:
+    """
+    In-process HTTP server answering the Ollama endpoints used by the controllers (/api/embed and
+    /api/chat, streamed or not), so EmbedingController and LLMController run unchanged against it
+    through OLLAMA_HOST.
+
+    Embeddings are hashed bags of words. Answers echo words of the prompt after `llm_delay` seconds
+    (time to first token when streaming) plus `token_delay` per generated token. At most
+    `llm_parallel` LLM calls run at once, like the parallel slots of an Ollama server.
+    """
+
+    def __init__(self, dim=768, llm_delay=0.05, token_delay=0.002, embed_delay=0.005, answer_tokens=40, llm_parallel=4):
+        self.dim = dim
+        self.llm_delay = llm_delay
+        self.token_delay = token_delay
+        self.embed_delay = embed_delay
+        self.answer_tokens = answer_tokens
+        self.llm_slots = threading.Semaphore(llm_parallel)
+        self.calls = {'embed': 0, 'embedded_texts': 0, 'chat': 0}
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if self.path.endswith('/api/embed'):
+                    self.send_json(stub.embed(body))
+                elif self.path.endswith('/api/chat') and body.get('stream'):
+                    self.send_stream(stub.chat_stream(body))
+                elif self.path.endswith('/api/chat'):
+                    self.send_json(stub.chat(body))
+                else:
+                    self.send_json({"error": f"{self.path} is not stubbed"}, status=404)
+
+            def send_json(self, payload, status=200):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_stream(self, payloads):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for payload in payloads:
+                    line = json.dumps(payload).encode("utf-8") + b"\n"
+                    self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.calls[name] += value
+
+    def embed(self, body):
+        texts = body['input'] if isinstance(body['input'], list) else [body['input']]
+        self._count('embed')
+        self._count('embedded_texts', len(texts))
+        time.sleep(self.embed_delay)
+        return {"model": body['model'], "embeddings": [hashed_embedding(text, self.dim).tolist() for text in texts]}
+
+    def answer_words(self, prompt):
+        # Chunk contexts repeat the chunk's first words, main ideas and chat answers the document / context's
+        source = _between(prompt, "<chunk>", "</chunk>")
+        if source is prompt:
+            source = _between(_between(prompt, "<document>", "</document>"), "<context>", "</context>")
+        words = source.split()
+        return (words * (self.answer_tokens // max(len(words), 1) + 1))[:self.answer_tokens] or ["empty"]
+
+    def _message(self, body, content, done, **counters):
+        return {
+            "model": body['model'], "created_at": "2024-01-01T00:00:00Z",
+            "message": {"role": "assistant", "content": content}, "done": done, **counters
+        }
+
+    def chat(self, body):
+        self._count('chat')
+        prompt = body['messages'][-1]['content']
+        words = self.answer_words(prompt)
+        with self.llm_slots:
+            time.sleep(self.llm_delay + self.token_delay * len(words))
+        return self._message(body, " ".join(words), True, prompt_eval_count=len(prompt) // 4, eval_count=len(words))
+
+    def chat_stream(self, body):
+        self._count('chat')
+        prompt = body['messages'][-1]['content']
+        words = self.answer_words(prompt)
+        start = time.perf_counter()
+        with self.llm_slots:
+            time.sleep(self.llm_delay)
+            for word in words:
+                time.sleep(self.token_delay)
+                yield self._message(body, word + " ", False)
+        yield self._message(
+            body, "", True, prompt_eval_count=len(prompt) // 4, eval_count=len(words),
+            eval_duration=int((time.perf_counter() - start) * 1e9)
+        )
+
+
+class InMemoryVectorStore:
+    """
+    Vector store with the interface of PineconeController (collections, upserts by id, id listing
+    and deletes), kept in process and searched exactly. Namespaces share `collections`, like the
+    namespaces of one Pinecone index.
+    """
+
+    def __init__(self, collections=None, namespace=None):
+        self.collections = collections if collections is not None else {}
+        self.namespace = namespace
+        self._lock = threading.Lock()
+
+    def with_namespace(self, namespace):
+        return InMemoryVectorStore(self.collections, namespace)
+
+    def _collection(self):
+        return self.collections.setdefault(self.namespace, {'records': {}, 'matrix': None, 'ids': []})
+
+    def store_embeddings(self, embeddings, chunks, chunk_metadata=None, chunk_ids=None, store_text=True):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        chunk_ids = stored_chunk_ids(chunks, chunk_ids)
+        with self._lock:
+            collection = self._collection()
+            for i, (chunk_id, embedding, chunk) in enumerate(zip(chunk_ids, embeddings, chunks)):
+                metadata = {'text': chunk} if store_text else {}
+                metadata.update(chunk_metadata[i] if chunk_metadata else {})
+                collection['records'][chunk_id] = (embedding / (np.linalg.norm(embedding) or 1.0), metadata)
+            collection['matrix'] = None
+
+    def start_ingestion_process_vectors(self, chunks, embeddings, chunk_metadata=None, chunk_ids=None, store_text=True):
+        self.store_embeddings(embeddings, chunks, chunk_metadata, chunk_ids, store_text)
+
+    def load_and_query_vectors(self, query_embedding, top_k=5):
+        with self._lock:
+            collection = self._collection()
+            if collection['matrix'] is None and collection['records']:
+                # Rebuilt on the first query after a write, cosine similarity like the Pinecone indexes
+                collection['ids'] = list(collection['records'])
+                collection['matrix'] = np.stack([collection['records'][chunk_id][0] for chunk_id in collection['ids']])
+            matrix, ids, records = collection['matrix'], collection['ids'], collection['records']
+
+        if matrix is None:
+            return {'matches': []}
+
+        scores = matrix @ np.asarray(query_embedding, dtype=np.float32)
+        top = np.argsort(-scores)[:top_k]
+        return {'matches': [{'id': ids[i], 'score': float(scores[i]), 'metadata': records[ids[i]][1]} for i in top]}
+
+    def existing_ids(self, chunk_ids):
+        with self._lock:
+            records = self._collection()['records']
+            return {chunk_id for chunk_id in chunk_ids if chunk_id in records}
+
+    def ids_with_prefix(self, prefix):
+        with self._lock:
+            return [chunk_id for chunk_id in self._collection()['records'] if chunk_id.startswith(prefix)]
+
+    def delete_ids(self, chunk_ids):
+        with self._lock:
+            collection = self._collection()
+            for chunk_id in chunk_ids:
+                collection['records'].pop(chunk_id, None)
+            collection['matrix'] = None
+        return len(chunk_ids)
+
+
+class StubRanker:
+    """
+    Stand-in for the rerankers models: scores are the share of query words found in the document,
+    after `delay_per_document` seconds per scored document (the cost of a cross-encoder pass).
+    """
+
+    def __init__(self, delay_per_document=0.0005):
+        self.delay_per_document = delay_per_document
+
+    def rank(self, query, docs, doc_ids):
+        query_words = set(TOKEN_PATTERN.findall(query.lower()))
+        time.sleep(self.delay_per_document * len(docs))
+        results = []
+        for doc_id, doc in zip(doc_ids, docs):
+            words = set(TOKEN_PATTERN.findall(doc.lower()))
+            score = len(query_words & words) / max(len(query_words), 1)
+            results.append(SimpleNamespace(document=SimpleNamespace(doc_id=doc_id, text=doc), score=score))
+        return SimpleNamespace(results=sorted(results, key=lambda result: -result.score))
@@ -0,0 +1,99 @@
+import os, sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+from controllers.custom_rerank_controller import CustomRerankController
+from controllers.document_processing_controller import TFIDFController, BM25Controller
+
+
+DEFAULT_QUERIES = [
+    "What is the main topic of the document?",
+    "Which methods are described?",
+    "What are the conclusions?",
+    "Who are the main people mentioned?",
+    "What problems are discussed?",
+]
+
+
+def percentile_ms(latencies, percentile):
+    return np.percentile(latencies, percentile) * 1000
+
+
+def run_benchmark(search, queries, depths, top_k, batch_size, max_chars, model_name):
+    # The deepest candidate list reranked is the reference: recall@k of a depth is how many of its
+    # top_k chunks are found when only the first `depth` candidates are reranked
+    max_depth = max(depths)
+    candidates = {query: search(query, max_depth) for query in queries}
+
+    reranker = CustomRerankController(model_name=model_name, language_code='en', batch_size=batch_size, max_chars=max_chars, cache_size=0)
+    reference = {
+        query: {item['text'] for item in reranker.rerank(query, candidates[query], top_k)}
+        for query in queries
+    }
+
+    results = []
+    for depth in depths:
+        reranker.cache_size = 0
+        reranker.clear_cache()
+        cold_latencies, recalls = [], []
+        for query in queries:
+            start = time.perf_counter()
+            reranked = reranker.rerank(query, candidates[query][:depth], top_k)
+            cold_latencies.append(time.perf_counter() - start)
+            found = {item['text'] for item in reranked}
+            recalls.append(len(found & reference[query]) / max(len(reference[query]), 1))
+
+        # Same questions again with the score cache on
+        reranker.cache_size = len(queries) * max_depth
+        for query in queries:
+            reranker.rerank(query, candidates[query][:depth], top_k)
+        warm_latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            reranker.rerank(query, candidates[query][:depth], top_k)
+            warm_latencies.append(time.perf_counter() - start)
+
+        results.append({
+            'depth': depth,
+            'recall': float(np.mean(recalls)),
+            'p50_ms': percentile_ms(cold_latencies, 50),
+            'p95_ms': percentile_ms(cold_latencies, 95),
+            'cached_p50_ms': percentile_ms(warm_latencies, 50)
+        })
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reranker latency and recall@k versus the number of candidates reranked")
+    parser.add_argument("--tfidf-index-name")
+    parser.add_argument("--bm25-index-name")
+    parser.add_argument("--queries-file", help="One question per line")
+    parser.add_argument("--depths", type=int, nargs="+", default=[5, 10, 20, 50, 100])
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-chars", type=int, default=2048)
+    parser.add_argument("--model-name", default="flashrank")
+    args = parser.parse_args()
+
+    # Candidates come from a lexical index so the benchmark doesn't need Ollama or Pinecone
+    if args.bm25_index_name:
+        search = BM25Controller(args.bm25_index_name).load_and_query_bm25
+    elif args.tfidf_index_name:
+        search = TFIDFController(args.tfidf_index_name).load_and_query_tfidf
+    else:
+        parser.error("--tfidf-index-name or --bm25-index-name is required")
+
+    queries = DEFAULT_QUERIES
+    if args.queries_file:
+        with open(args.queries_file) as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    print(f"{'depth':>6} {'recall@k':>9} {'p50':>10} {'p95':>10} {'cached p50':>11}")
+    for result in run_benchmark(search, queries, args.depths, args.top_k, args.batch_size, args.max_chars, args.model_name):
+        print(
+            f"{result['depth']:>6} {result['recall']:>9.3f} {result['p50_ms']:>8.1f}ms {result['p95_ms']:>8.1f}ms "
+            f"{result['cached_p50_ms']:>9.1f}ms"
+        )
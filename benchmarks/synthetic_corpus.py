@@ -0,0 +1,77 @@
+import os
+import textwrap
+import numpy as np
+
+SYLLABLES = ["ka", "lo", "mi", "ra", "te", "su", "no", "vi", "da", "pe", "zo", "ri", "ba", "ne", "tu", "ga", "fi", "ho", "me", "xa"]
+
+
+def make_vocabulary(n_words, rng):
+    # Pronounceable made-up words, so the tokenizers and the text splitter see word-like text
+    words = set()
+    while len(words) < n_words:
+        words.add("".join(rng.choice(SYLLABLES, size=rng.integers(2, 5))))
+    return sorted(words)
+
+
+def write_pdf(path, pages):
+    # Minimal PDF (one Helvetica text block per page) that PyPDF2 extracts back to the same words
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(" ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages))), len(pages)),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    ]
+    for i, text in enumerate(pages):
+        lines = textwrap.wrap(text, 90)
+        content = "BT /F1 9 Tf 30 810 Td 11 TL " + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+
+    output = "%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n"
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n" + "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+
+    with open(path, "w", encoding="latin-1") as f:
+        f.write(output)
+
+
+def generate_corpus(output_dir, n_documents=4, pages_per_document=20, words_per_page=400, n_topics=50,
+                    vocabulary_size=5000, n_queries=100, seed=0):
+    """
+    Writes `n_documents` PDFs of synthetic text and returns (pdf paths, queries).
+
+    Every page is about one topic: most of its words come from the topic's words, the rest from the
+    whole vocabulary with a Zipf-like distribution, so lexical and hashed embeddings find the pages
+    of the topic a query was drawn from. Same seed, same corpus and queries.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = make_vocabulary(vocabulary_size, rng)
+    topics = [rng.choice(vocabulary, size=40, replace=False) for _ in range(n_topics)]
+    frequencies = 1.0 / np.arange(1, len(vocabulary) + 1)
+    frequencies /= frequencies.sum()
+
+    os.makedirs(output_dir, exist_ok=True)
+    pdf_paths = []
+    for document in range(n_documents):
+        pages = []
+        for _ in range(pages_per_document):
+            topic = topics[rng.integers(n_topics)]
+            from_topic = rng.random(words_per_page) < 0.4
+            words = np.where(
+                from_topic,
+                rng.choice(topic, size=words_per_page),
+                rng.choice(vocabulary, size=words_per_page, p=frequencies)
+            )
+            sentences = [" ".join(words[i:i + 12]).capitalize() + "." for i in range(0, words_per_page, 12)]
+            pages.append(" ".join(sentences))
+
+        pdf_path = os.path.join(output_dir, f"document_{document:03d}.pdf")
+        write_pdf(pdf_path, pages)
+        pdf_paths.append(pdf_path)
+
+    queries = [" ".join(rng.choice(topics[rng.integers(n_topics)], size=6)) + "?" for _ in range(n_queries)]
+    return pdf_paths, queries
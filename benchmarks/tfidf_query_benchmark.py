@@ -0,0 +1,115 @@
+import os, sys
+import time
+import argparse
+import tempfile
+import numpy as np
+from scipy import sparse
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+from controllers.document_processing_controller import TFIDFController, BM25Controller
+
+
+def synthetic_counts(n_chunks, n_terms, terms_per_chunk, rng):
+    # Zipf-like term distribution, similar to natural language chunks
+    rows = np.repeat(np.arange(n_chunks), terms_per_chunk)
+    cols = np.minimum(rng.zipf(1.3, size=n_chunks * terms_per_chunk) - 1, n_terms - 1)
+    counts = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(n_chunks, n_terms))
+    counts.sum_duplicates()
+    return counts
+
+
+def full_scan_query(tfidf, index_data, term_ids, term_counts, top_k):
+    # Previous query path: score every chunk, then sort all the scores
+    stats = tfidf.collection_stats(index_data)
+    idf = tfidf.idf({'n_chunks': stats['n_chunks'], 'df': stats['df'][term_ids]})
+    query_weights = term_counts * idf
+    query_weights = query_weights * idf / np.linalg.norm(query_weights)
+
+    scores = []
+    for segment in index_data['segments']:
+        query_vector = np.zeros(segment['tf'].shape[1], dtype=np.float32)
+        query_vector[term_ids] = query_weights
+        scores.append((segment['tf'] @ query_vector) / segment['norms'])
+
+    scores = np.concatenate(scores)
+    return np.argsort(scores)[-top_k:][::-1]
+
+
+def percentile_ms(latencies, percentile):
+    return np.percentile(latencies, percentile) * 1000
+
+
+def run_benchmark(n_chunks, n_terms, terms_per_chunk, segment_size, n_queries, top_k, seed):
+    rng = np.random.default_rng(seed)
+    terms = np.array([f"w{i}" for i in range(n_terms)])
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tfidf = TFIDFController(os.path.join(tmp_dir, "benchmark.pkl"), merge_threshold=10 ** 9)
+        bm25 = BM25Controller(os.path.join(tmp_dir, "benchmark.pkl"), merge_threshold=10 ** 9)
+
+        start = time.perf_counter()
+        for segment_start in range(0, n_chunks, segment_size):
+            size = min(segment_size, n_chunks - segment_start)
+            counts = synthetic_counts(size, n_terms, terms_per_chunk, rng)
+            chunks = [f"chunk {segment_start + i}" for i in range(size)]
+            tfidf.add_counted_chunks(chunks, counts, terms)
+            bm25.add_counted_chunks(chunks, counts, terms)
+        build_time = time.perf_counter() - start
+
+        index_data = tfidf.load_tfidf_index()
+        bm25_data = bm25.load_bm25_index()
+        vocabulary = tfidf.load_vocabulary()
+
+        # Queries of 2-4 terms, avoiding the handful of stop-word like head terms
+        queries = [
+            " ".join(terms[np.minimum(rng.zipf(1.3, size=rng.integers(2, 5)) + 10, n_terms - 1)])
+            for _ in range(n_queries)
+        ]
+
+        postings_latencies, full_scan_latencies, bm25_latencies = [], [], []
+        for query in queries:
+            start = time.perf_counter()
+            bm25.search(query, top_k, index_data=bm25_data)
+            bm25_latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            tfidf.search(query, top_k, index_data=index_data)
+            postings_latencies.append(time.perf_counter() - start)
+
+            term_ids, term_counts = tfidf.query_terms(query, vocabulary)
+            start = time.perf_counter()
+            full_scan_query(tfidf, index_data, term_ids, term_counts, top_k)
+            full_scan_latencies.append(time.perf_counter() - start)
+
+    return {
+        'n_chunks': n_chunks,
+        'build_seconds': build_time,
+        'postings_p50_ms': percentile_ms(postings_latencies, 50),
+        'postings_p95_ms': percentile_ms(postings_latencies, 95),
+        'full_scan_p50_ms': percentile_ms(full_scan_latencies, 50),
+        'full_scan_p95_ms': percentile_ms(full_scan_latencies, 95),
+        'bm25_p50_ms': percentile_ms(bm25_latencies, 50),
+        'bm25_p95_ms': percentile_ms(bm25_latencies, 95)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lexical query latency: TF-IDF inverted index, TF-IDF full scan and BM25 impact postings")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--terms", type=int, default=50_000)
+    parser.add_argument("--terms-per-chunk", type=int, default=40)
+    parser.add_argument("--segment-size", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'chunks':>10} {'build s':>9} {'postings p50':>13} {'postings p95':>13} {'full scan p50':>14} {'full scan p95':>14} {'bm25 p50':>10} {'bm25 p95':>10}")
+    for n_chunks in args.sizes:
+        result = run_benchmark(n_chunks, args.terms, args.terms_per_chunk, args.segment_size, args.queries, args.top_k, args.seed)
+        print(
+            f"{result['n_chunks']:>10} {result['build_seconds']:>9.1f} "
+            f"{result['postings_p50_ms']:>11.2f}ms {result['postings_p95_ms']:>11.2f}ms "
+            f"{result['full_scan_p50_ms']:>12.2f}ms {result['full_scan_p95_ms']:>12.2f}ms "
+            f"{result['bm25_p50_ms']:>8.2f}ms {result['bm25_p95_ms']:>8.2f}ms"
+        )
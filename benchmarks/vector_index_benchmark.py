@@ -0,0 +1,87 @@
+import os, sys
+import time
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+from controllers.local_vector_controller import LocalVectorController
+
+
+def synthetic_embeddings(n_vectors, dim, n_topics, rng):
+    # Embeddings of chunks cluster around topics, a uniform random cloud would make any ANN index look bad
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    labels = rng.integers(0, n_topics, size=n_vectors)
+    return topics[labels] + 0.6 * rng.standard_normal((n_vectors, dim)).astype(np.float32), topics
+
+
+def percentile_ms(latencies, percentile):
+    return np.percentile(latencies, percentile) * 1000
+
+
+def run_benchmark(n_vectors, dim, n_topics, n_queries, top_k, nprobes, batch_size, seed):
+    rng = np.random.default_rng(seed)
+    embeddings, topics = synthetic_embeddings(n_vectors, dim, n_topics, rng)
+    queries = topics[rng.integers(0, n_topics, size=n_queries)] + 0.8 * rng.standard_normal((n_queries, dim)).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        vectors = LocalVectorController(os.path.join(tmp_dir, "benchmark"))
+
+        start = time.perf_counter()
+        for batch_start in range(0, n_vectors, batch_size):
+            batch = embeddings[batch_start:batch_start + batch_size]
+            vectors.store_embeddings(batch, [f"chunk {batch_start + i}" for i in range(len(batch))])
+        build_time = time.perf_counter() - start
+
+        index_data = vectors.load_index()
+
+        exact_results, exact_latencies = [], []
+        for query in queries:
+            start = time.perf_counter()
+            exact_results.append({idx for idx, _ in vectors.search(query, top_k, index_data=index_data, exact=True)})
+            exact_latencies.append(time.perf_counter() - start)
+
+        results = [{
+            'n_vectors': n_vectors, 'method': 'exact', 'build_seconds': build_time, 'recall': 1.0,
+            'p50_ms': percentile_ms(exact_latencies, 50), 'p95_ms': percentile_ms(exact_latencies, 95)
+        }]
+
+        for nprobe in nprobes:
+            recalls, latencies = [], []
+            for query, expected in zip(queries, exact_results):
+                start = time.perf_counter()
+                found = {idx for idx, _ in vectors.search(query, top_k, index_data=index_data, nprobe=nprobe)}
+                latencies.append(time.perf_counter() - start)
+                recalls.append(len(found & expected) / len(expected))
+
+            results.append({
+                'n_vectors': n_vectors, 'method': f"ivf nprobe={nprobe}", 'build_seconds': build_time,
+                'recall': float(np.mean(recalls)),
+                'p50_ms': percentile_ms(latencies, 50), 'p95_ms': percentile_ms(latencies, 95)
+            })
+
+        results[0]['n_lists'] = index_data['meta']['n_lists']
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local vector index: recall@k and latency of the IVF lists versus exact search")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--nprobes", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'vectors':>9} {'lists':>6} {'method':>14} {'build s':>8} {'recall@k':>9} {'p50':>9} {'p95':>9}")
+    for n_vectors in args.sizes:
+        results = run_benchmark(n_vectors, args.dim, args.topics, args.queries, args.top_k, args.nprobes, args.batch_size, args.seed)
+        n_lists = results[0]['n_lists']
+        for result in results:
+            print(
+                f"{result['n_vectors']:>9} {n_lists:>6} {result['method']:>14} {result['build_seconds']:>8.1f} "
+                f"{result['recall']:>9.3f} {result['p50_ms']:>7.2f}ms {result['p95_ms']:>7.2f}ms"
+            )
@@ -0,0 +1,104 @@
+import os, sys
+import time
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+from controllers.local_vector_controller import LocalVectorController
+
+
+def matryoshka_like_embeddings(n_vectors, dim, n_topics, rng):
+    # Topic clusters whose signal decays along the dimensions, like Matryoshka embeddings where the
+    # leading dimensions carry most of the meaning (isotropic noise would make any truncation look useless)
+    decay = (1 + np.arange(dim, dtype=np.float32)) ** -0.5
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32) * decay
+    labels = rng.integers(0, n_topics, size=n_vectors + 2 * n_topics)
+    noise = rng.standard_normal((len(labels), dim)).astype(np.float32) * (0.6 * decay)
+    return topics[labels] + noise
+
+
+def percentile_ms(latencies, percentile):
+    return np.percentile(latencies, percentile) * 1000
+
+
+def run_benchmark(embeddings, queries, top_k, configs, batch_size, train_min, nprobe):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index_name = os.path.join(tmp_dir, "benchmark")
+        vectors = LocalVectorController(index_name, train_min=train_min, nprobe=nprobe)
+        for batch_start in range(0, len(embeddings), batch_size):
+            batch = embeddings[batch_start:batch_start + batch_size]
+            vectors.store_embeddings(batch, [""] * len(batch), store_text=False)
+
+        index_data = vectors.load_index()
+        exact_results = [{idx for idx, _ in vectors.search(query, top_k, index_data=index_data, exact=True)} for query in queries]
+
+        results = []
+        for precision, dimension, rescore in configs:
+            # Same directory opened with other settings: the scanned vectors are converted on load
+            vectors = LocalVectorController(index_name, train_min=train_min, nprobe=nprobe, precision=precision, dimension=dimension, rescore=rescore)
+            start = time.perf_counter()
+            index_data = vectors.load_index()
+            convert_time = time.perf_counter() - start
+
+            recalls, latencies = [], []
+            for query, expected in zip(queries, exact_results):
+                start = time.perf_counter()
+                found = {idx for idx, _ in vectors.search(query, top_k, index_data=index_data)}
+                latencies.append(time.perf_counter() - start)
+                recalls.append(len(found & expected) / len(expected))
+
+            storage = vectors.storage_stats()
+            results.append({
+                'precision': precision, 'dimension': storage['scan_dim'], 'rescore': rescore,
+                'scan_mb': storage['scan_bytes'] / (1024 * 1024), 'bytes_per_vector': storage['scan_bytes'] / storage['vectors'],
+                'convert_seconds': convert_time, 'recall': float(np.mean(recalls)),
+                'p50_ms': percentile_ms(latencies, 50), 'p95_ms': percentile_ms(latencies, 95)
+            })
+
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Local vector index: recall@k, memory and latency of float32 / float16 / int8 storage and Matryoshka truncation"
+    )
+    parser.add_argument("--vectors", type=int, default=50_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--embeddings", help="Real embeddings (.npy, e.g. nomic-embed-text vectors of a corpus) instead of synthetic ones; the last --queries rows are the queries")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--precisions", nargs="+", default=["float32", "float16", "int8"])
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[768, 512, 256, 128])
+    parser.add_argument("--rescores", type=int, nargs="+", default=[0, 4], help="Candidates per result rescored at full precision")
+    parser.add_argument("--train-min", type=int, default=10**9, help="Vectors before the IVF lists are trained (default: exhaustive search, recall only reflects the storage)")
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.embeddings:
+        all_embeddings = np.load(args.embeddings).astype(np.float32)
+        embeddings, queries = all_embeddings[:-args.queries], all_embeddings[-args.queries:]
+    else:
+        all_embeddings = matryoshka_like_embeddings(args.vectors + args.queries, args.dim, args.topics, rng)
+        embeddings, queries = all_embeddings[:args.vectors], all_embeddings[args.vectors:args.vectors + args.queries]
+
+    configs = [
+        (precision, dimension, rescore)
+        for dimension in args.dimensions for precision in args.precisions for rescore in args.rescores
+        # float32 at full dimension is the exact scan, rescoring it changes nothing
+        if not (precision == "float32" and dimension >= embeddings.shape[1] and rescore)
+    ]
+    results = run_benchmark(embeddings, queries, args.top_k, configs, args.batch_size, args.train_min, args.nprobe)
+
+    print(f"{len(embeddings)} vectors of dimension {embeddings.shape[1]}, recall@{args.top_k} against exact float32 search")
+    print(f"{'precision':>9} {'dim':>5} {'rescore':>7} {'scan MB':>8} {'B/vector':>9} {'convert s':>9} {'recall@k':>9} {'p50':>9} {'p95':>9}")
+    for result in results:
+        print(
+            f"{result['precision']:>9} {result['dimension']:>5} {result['rescore']:>7} {result['scan_mb']:>8.1f} "
+            f"{result['bytes_per_vector']:>9.0f} {result['convert_seconds']:>9.2f} {result['recall']:>9.3f} "
+            f"{result['p50_ms']:>7.2f}ms {result['p95_ms']:>7.2f}ms"
+        )
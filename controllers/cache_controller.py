@@ -0,0 +1,134 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class ContentCacheController:
+    """
+    Persistent content-addressed cache (SQLite) for LLM chunk contexts and embeddings.
+
+    Keys are the SHA-256 of everything that determines the value (model name, prompt template,
+    inputs), so re-ingesting the same PDF or an overlapping page range reuses previous results.
+    The cache is bounded in bytes and evicts the least recently used entries first.
+    """
+
+    def __init__(self, path, max_bytes=1024 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._connection.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self._connection.commit()
+
+        self._total_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        self._stats = {}
+        self._evictions = 0
+
+    @staticmethod
+    def make_key(*parts):
+        digest = hashlib.sha256()
+        for part in parts:
+            encoded = str(part).encode('utf-8')
+            # Length prefix so ("ab", "c") and ("a", "bc") never collide
+            digest.update(len(encoded).to_bytes(8, 'little'))
+            digest.update(encoded)
+        return digest.hexdigest()
+
+    def _record(self, namespace, hits, misses):
+        stats = self._stats.setdefault(namespace, {'hits': 0, 'misses': 0})
+        stats['hits'] += hits
+        stats['misses'] += misses
+
+    def get(self, namespace, key):
+        return self.get_many(namespace, [key])[0]
+
+    def get_many(self, namespace, keys):
+        # Returns the cached values in the order of `keys` (None for misses)
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, value FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                now = time.time()
+                self._connection.executemany(
+                    "UPDATE entries SET last_access = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._connection.commit()
+
+            self._record(namespace, hits=len(found), misses=len(keys) - len(found))
+
+        return [found.get(key) for key in keys]
+
+    def set(self, namespace, key, value):
+        self.set_many(namespace, [(key, value)])
+
+    def set_many(self, namespace, items):
+        now = time.time()
+        with self._lock:
+            for key, value in items:
+                previous = self._connection.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+                if previous:
+                    self._total_bytes -= previous[0]
+
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO entries (key, namespace, value, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, namespace, value, len(value), now)
+                )
+                self._total_bytes += len(value)
+
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes:
+            rows = self._connection.execute(
+                "SELECT key, size FROM entries ORDER BY last_access LIMIT 256"
+            ).fetchall()
+            if not rows:
+                break
+
+            for key, size in rows:
+                self._connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self._evictions += 1
+                if self._total_bytes <= self.max_bytes:
+                    break
+
+    def stats(self):
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            namespaces = {}
+            for namespace, stats in self._stats.items():
+                lookups = stats['hits'] + stats['misses']
+                namespaces[namespace] = {**stats, 'hit_rate': stats['hits'] / lookups if lookups else 0.0}
+
+            return {
+                'path': self.path,
+                'entries': entries,
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self._evictions,
+                'namespaces': namespaces
+            }
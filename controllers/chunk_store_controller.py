@@ -0,0 +1,210 @@
+import os
+import copy
+import sqlite3
+import threading
+
+
+def chunk_index_refs(vector_store=None, vector_index_name=None, tfidf_index_name=None, bm25_index_name=None):
+    # Names of the indexes an ingestion writes to or a deletion removes from, as recorded with the chunks
+    refs = []
+    if vector_index_name:
+        refs.append(f"{vector_store or 'pinecone'}:{vector_index_name}")
+    if tfidf_index_name:
+        refs.append(f"tfidf:{tfidf_index_name}")
+    if bm25_index_name:
+        refs.append(f"bm25:{bm25_index_name}")
+    return tuple(refs)
+
+
+class ChunkStoreController:
+    """
+    Local document store of the ingested chunks (SQLite): chunk id -> original chunk, generated
+    context (the text that is embedded and indexed), source PDF and page span.
+
+    When it is used, the vector store and the lexical indexes only keep ids, so a vector hit
+    doesn't ship the chunk text, and the text of the final results is read here in one batch.
+    Like a Pinecone namespace, `with_namespace` scopes writes to one collection; chunk ids are
+    only unique inside a collection.
+
+    Several indexes can hold the same chunk ids, so every row records which indexes reference it
+    (`with_indexes`): deleting ids from some indexes drops their references, and a chunk is only
+    removed once no index holds it anymore.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Collection written by this controller (None is the default one), see with_namespace
+        self.namespace = None
+        # Indexes the writes of this controller belong to (see chunk_index_refs and with_indexes)
+        self.index_refs = ()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                namespace TEXT NOT NULL,
+                id TEXT NOT NULL,
+                chunk TEXT NOT NULL,
+                context TEXT NOT NULL,
+                source TEXT,
+                start_page INTEGER,
+                end_page INTEGER,
+                PRIMARY KEY (namespace, id)
+            ) WITHOUT ROWID
+        """)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_indexes (
+                namespace TEXT NOT NULL,
+                id TEXT NOT NULL,
+                index_ref TEXT NOT NULL,
+                PRIMARY KEY (namespace, id, index_ref)
+            ) WITHOUT ROWID
+        """)
+        self._connection.commit()
+
+    def with_namespace(self, namespace):
+        # Same database and connection, writes scoped to one collection
+        controller = copy.copy(self)
+        controller.namespace = namespace
+        return controller
+
+    def with_indexes(self, index_refs):
+        # Same database and connection, writes and deletions scoped to the given indexes
+        controller = copy.copy(self)
+        controller.index_refs = tuple(index_refs)
+        return controller
+
+    def _ref_filter(self):
+        # SQL condition (and its parameters) of the chunk ids referenced by one of this controller's indexes
+        if not self.index_refs:
+            return "", []
+        return (
+            f" AND id IN (SELECT id FROM chunk_indexes WHERE namespace = ? AND index_ref IN ({','.join('?' * len(self.index_refs))}))",
+            [self._namespace_key(self.namespace), *self.index_refs]
+        )
+
+    def _namespace_key(self, namespace):
+        return namespace or ''
+
+    # === WRITE PATH ===
+    def put_chunks(self, chunk_ids, chunks, contexts, source=None, page_spans=None):
+        # page_spans: (first page, last page) of every chunk, 0-based
+        page_spans = page_spans or [(None, None)] * len(chunk_ids)
+        namespace = self._namespace_key(self.namespace)
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO chunks (namespace, id, chunk, context, source, start_page, end_page) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (namespace, chunk_id, chunk, context, source, start_page, end_page)
+                    for chunk_id, chunk, context, (start_page, end_page) in zip(chunk_ids, chunks, contexts, page_spans)
+                ]
+            )
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO chunk_indexes (namespace, id, index_ref) VALUES (?, ?, ?)",
+                [(namespace, chunk_id, index_ref) for chunk_id in chunk_ids for index_ref in self.index_refs]
+            )
+            self._connection.commit()
+
+    def delete_ids(self, chunk_ids):
+        # Drops the references of this controller's indexes (all of them without with_indexes), then
+        # the chunks no index references anymore; returns the number of chunks removed
+        chunk_ids = list(chunk_ids)
+        namespace = self._namespace_key(self.namespace)
+        with self._lock:
+            deleted = 0
+            for i in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[i:i + 500]
+                placeholders = ','.join('?' * len(batch))
+                if self.index_refs:
+                    self._connection.execute(
+                        f"DELETE FROM chunk_indexes WHERE namespace = ? AND id IN ({placeholders}) "
+                        f"AND index_ref IN ({','.join('?' * len(self.index_refs))})",
+                        [namespace, *batch, *self.index_refs]
+                    )
+                else:
+                    self._connection.execute(
+                        f"DELETE FROM chunk_indexes WHERE namespace = ? AND id IN ({placeholders})", [namespace, *batch]
+                    )
+                deleted += self._connection.execute(
+                    f"DELETE FROM chunks WHERE namespace = ? AND id IN ({placeholders}) AND NOT EXISTS "
+                    "(SELECT 1 FROM chunk_indexes WHERE chunk_indexes.namespace = chunks.namespace AND chunk_indexes.id = chunks.id)",
+                    [namespace, *batch]
+                ).rowcount
+            self._connection.commit()
+        return deleted
+
+    # === READ PATH ===
+    def _select(self, namespace, chunk_ids, columns):
+        rows = []
+        with self._lock:
+            for i in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[i:i + 500]
+                rows.extend(self._connection.execute(
+                    f"SELECT {columns} FROM chunks WHERE namespace = ? AND id IN ({','.join('?' * len(batch))})",
+                    [self._namespace_key(namespace), *batch]
+                ).fetchall())
+        return rows
+
+    def get_records(self, keys):
+        # {(namespace, chunk id): record} of the (namespace, chunk id) keys found, one query per collection
+        by_namespace = {}
+        for namespace, chunk_id in keys:
+            by_namespace.setdefault(namespace, set()).add(chunk_id)
+
+        records = {}
+        for namespace, chunk_ids in by_namespace.items():
+            for chunk_id, chunk, context, source, start_page, end_page in self._select(
+                namespace, list(chunk_ids), "id, chunk, context, source, start_page, end_page"
+            ):
+                records[(namespace, chunk_id)] = {
+                    'id': chunk_id,
+                    'chunk': chunk,
+                    'context': context,
+                    'source': source,
+                    'start_page': start_page,
+                    'end_page': end_page
+                }
+        return records
+
+    # Same interface as the vector stores and lexical indexes (skipped and stale chunks of the ingestion pipeline),
+    # restricted to the chunks referenced by this controller's indexes
+    def existing_ids(self, chunk_ids):
+        chunk_ids = list(chunk_ids)
+        if not self.index_refs:
+            return {chunk_id for (chunk_id,) in self._select(self.namespace, chunk_ids, "id")}
+        # A chunk is only complete for an ingestion when every index it writes to references it
+        counts = {}
+        namespace = self._namespace_key(self.namespace)
+        with self._lock:
+            for i in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[i:i + 500]
+                counts.update(self._connection.execute(
+                    f"SELECT id, COUNT(*) FROM chunk_indexes WHERE namespace = ? AND id IN ({','.join('?' * len(batch))}) "
+                    f"AND index_ref IN ({','.join('?' * len(self.index_refs))}) GROUP BY id",
+                    [namespace, *batch, *self.index_refs]
+                ).fetchall())
+        return {chunk_id for chunk_id, count in counts.items() if count == len(self.index_refs)}
+
+    def ids_with_prefix(self, prefix):
+        condition, parameters = self._ref_filter()
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT id FROM chunks WHERE namespace = ? AND substr(id, 1, ?) = ?{condition}",
+                (self._namespace_key(self.namespace), len(prefix), prefix, *parameters)
+            ).fetchall()
+        return [chunk_id for (chunk_id,) in rows]
+
+    def stats(self):
+        with self._lock:
+            rows = self._connection.execute("SELECT namespace, COUNT(*) FROM chunks GROUP BY namespace").fetchall()
+        return {
+            'path': self.path,
+            'chunks': sum(count for _, count in rows),
+            # '' is the default collection
+            'namespaces': dict(rows)
+        }
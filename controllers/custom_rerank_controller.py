@@ -1,17 +1,90 @@
+import hashlib
+import threading
+from collections import OrderedDict
 from rerankers import Reranker
 
 class CustomRerankController:
-    def __init__(self, model_name: str, language_code: str):
-        self.ranker = Reranker(model_name, lang=language_code, verbose=0)
+    def __init__(self, model_name: str, language_code: str, batch_size: int = 32, max_chars: int = 2048,
+                 cache_size: int = 10000, ranker=None):
+        # `ranker` replaces the model with any object having the rank() of rerankers (e.g. a benchmark stub)
+        self.ranker = ranker or Reranker(model_name, lang=language_code, verbose=0)
+        # Documents scored per cross-encoder call, and characters of each document kept (the model truncates anyway)
+        self.batch_size = batch_size
+        self.max_chars = max_chars
 
-    def format_responses(self, responses: list) -> list:
-        formatted_responses = [item['metadata']['text'][0] for item in responses]
-        return formatted_responses
+        # LRU of (query, chunk) -> score, so a repeated question or overlapping candidates are not scored again
+        self.cache_size = cache_size
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'scored': 0, 'cache_hits': 0}
 
-    def rerank(self, query: str, responses: list):
-        formatted_responses = self.format_responses(responses)
-        rank_result = self.ranker.rank(query, docs=formatted_responses)
+    def _cache_key(self, query, text):
+        # Keyed by the chunk text digest: ids of indexes ingested before deterministic ids are not unique
+        return (query, hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest())
 
-        final_results = [result.document.text for result in rank_result.results]
-        return final_results
-        
\ No newline at end of file
+    def score(self, query: str, texts: list) -> list:
+        keys = [self._cache_key(query, text) for text in texts]
+        scores = [None] * len(texts)
+        with self._lock:
+            for position, key in enumerate(keys):
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[position] = self._scores[key]
+
+        missing = [position for position, value in enumerate(scores) if value is None]
+        for i in range(0, len(missing), self.batch_size):
+            positions = missing[i:i + self.batch_size]
+            # Pointwise scores, so batches don't change them
+            rank_result = self.ranker.rank(
+                query, docs=[texts[position][:self.max_chars] for position in positions], doc_ids=list(range(len(positions)))
+            )
+            for result in rank_result.results:
+                scores[positions[result.document.doc_id]] = float(result.score)
+
+        with self._lock:
+            self._stats['scored'] += len(missing)
+            self._stats['cache_hits'] += len(texts) - len(missing)
+            if self.cache_size:
+                for position in missing:
+                    self._scores[keys[position]] = scores[position]
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+
+        return scores
+
+    def _sort_by_scores(self, responses: list, scores: list, top_k: int = None) -> list:
+        reranked = [
+            {**item, 'rerank_score': score}
+            for score, _, item in sorted(zip(scores, range(len(responses)), responses), key=lambda entry: (-entry[0], entry[1]))
+        ]
+        return reranked[:top_k] if top_k else reranked
+
+    def rerank(self, query: str, responses: list, top_k: int = None) -> list:
+        # Fused results (dicts with 'text') sorted by reranker score, each with its 'rerank_score'
+        return self._sort_by_scores(responses, self.score(query, [item['text'] for item in responses]), top_k)
+
+    def rerank_many(self, queries: list, response_lists: list, top_k: int = None) -> list:
+        # rerank() of several questions: the distinct chunks of each question are scored together
+        # (batches never mix questions, the model scores one question per call), and a question
+        # asked twice or a chunk retrieved twice for it is scored once
+        texts_by_query = {}
+        for query, responses in zip(queries, response_lists):
+            texts = texts_by_query.setdefault(query, {})
+            for item in responses:
+                texts.setdefault(item['text'], None)
+
+        for query, texts in texts_by_query.items():
+            texts.update(zip(texts, self.score(query, list(texts))))
+
+        return [
+            self._sort_by_scores(responses, [texts_by_query[query][item['text']] for item in responses], top_k)
+            for query, responses in zip(queries, response_lists)
+        ]
+
+    def clear_cache(self):
+        with self._lock:
+            self._scores.clear()
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'cached_scores': len(self._scores), 'cache_size': self.cache_size}
@@ -1,135 +1,281 @@
 import os
-import uuid
+import copy
 import pickle
+import hashlib
 import numpy as np
 from pinecone import Pinecone, ServerlessSpec
-from sklearn.feature_extraction.text import TfidfVectorizer
+from controllers.segment_index_controller import SegmentIndexController
+from controllers.embedding_controller import truncate_embeddings
+
+def make_chunk_id(document_id, chunk_offset, text):
+    # Same document, position and text -> same id, so re-ingesting a PDF overwrites instead of duplicating
+    text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+    return f"{document_id}#{chunk_offset}#{text_hash}"
+
+
+def stored_chunk_ids(chunks, chunk_ids=None):
+    # Vector stores fall back to the text hash without explicit ids, so storing the same chunk twice never duplicates it
+    if chunk_ids is not None:
+        return chunk_ids
+    return [hashlib.sha256(chunk.encode('utf-8')).hexdigest() for chunk in chunks]
+
+
+def is_chunk_id(chunk_id):
+    # Ids of make_chunk_id; indexes ingested before them use the text sha256 (Pinecone) or chunk_{idx} (TF-IDF/BM25)
+    return isinstance(chunk_id, str) and chunk_id.count('#') >= 2
+
+
+def document_id_prefix(document_id):
+    return f"{document_id}#"
+
+
+def check_document_id(document_id):
+    # '#' separates the parts of a chunk id: the prefix of document "a" would also match document "a#b"
+    if '#' in document_id:
+        raise ValueError(f"Invalid document id {document_id!r}: '#' is reserved as the chunk id separator")
+    return document_id
+
+
+def default_document_id(pdf_path):
+    # PDF file name and a digest of its full path: two report.pdf of different folders get different ids,
+    # and a new version of a file at the same path keeps its id (so `replace` finds the previous one)
+    name = os.path.splitext(os.path.basename(pdf_path))[0].replace('#', '_')
+    path_hash = hashlib.sha256(os.path.abspath(pdf_path).encode('utf-8')).hexdigest()[:8]
+    return f"{name}-{path_hash}"
+
 
 class PineconeController:
-    def __init__(self, pinecone_api_key, index_name):
+    def __init__(self, pinecone_api_key, index_name, upsert_batch_size=100, upsert_threads=4, dimension=768):
         self.pc = Pinecone(api_key=pinecone_api_key)
+        self.upsert_batch_size = upsert_batch_size
+        # Collection inside the index (None is Pinecone's default namespace), see with_namespace
+        self.namespace = None
 
         # Initialize Pinecone index if it doesn't exist
         if index_name not in self.pc.list_indexes().names():
             self.pc.create_index(
                 name=index_name,
-                dimension=768,  # Assuming using Ollama embeddings
+                dimension=dimension,  # nomic-embed-text gives 768, fewer keeps its leading (Matryoshka) dimensions
                 metric="cosine",
                 spec=ServerlessSpec(
                     cloud="aws",
                     region="us-east-1"
                 )
             )
-        self.index = self.pc.Index(index_name)
+            self.dimension = dimension
+        else:
+            # Existing indexes keep the dimension they were created with
+            self.dimension = self.pc.describe_index(index_name).dimension
+        # pool_threads lets upsert batches be sent in parallel (async_req)
+        self.index = self.pc.Index(index_name, pool_threads=upsert_threads)
 
+    def with_namespace(self, namespace):
+        # Same index and connection pool, reads and writes scoped to one namespace
+        controller = copy.copy(self)
+        controller.namespace = namespace
+        return controller
 
-    def store_embeddings(self, embeddings, chunks, chunk_metadata=None):
+    def store_embeddings(self, embeddings, chunks, chunk_metadata=None, chunk_ids=None, store_text=True):
         # Prepare vectors for upsert
+        # Accepts a float32 matrix (generate_embeddings_batch) or a list of lists
+        # Without store_text the text stays in the chunk store, queries then only return ids and scores
+        embeddings = truncate_embeddings(embeddings, self.dimension)
+
+        chunk_ids = stored_chunk_ids(chunks, chunk_ids)
+
         vectors_to_upsert = []
-        for embedding, chunk in zip(embeddings, chunks):
+        for i, (embedding, chunk) in enumerate(zip(embeddings, chunks)):
             vector_data = {
-                'id': str(uuid.uuid4()), # -> to prevent overwriting
-                'values': embedding,
+                'id': chunk_ids[i],
+                'values': embedding.tolist(),
                 'metadata': {
                     'text': chunk,
-                }
+                } if store_text else {}
             }
             
             # Add additional metadata if provided
             if chunk_metadata:
-                vector_data['metadata'].update(chunk_metadata.pop(0))
+                vector_data['metadata'].update(chunk_metadata[i])
+
+            if not vector_data['metadata']:
+                del vector_data['metadata']
                 
             vectors_to_upsert.append(vector_data)
         
-        # Upsert vectors in batches of 100
-        batch_size = 100
-        for i in range(0, len(vectors_to_upsert), batch_size):
-            batch = vectors_to_upsert[i:i + batch_size]
-            self.index.upsert(vectors=batch)
+        # Upsert vectors in batches, sent in parallel over the index's pool threads
+        batch_size = self.upsert_batch_size
+        async_results = [
+            self.index.upsert(vectors=vectors_to_upsert[i:i + batch_size], namespace=self.namespace, async_req=True)
+            for i in range(0, len(vectors_to_upsert), batch_size)
+        ]
+        for async_result in async_results:
+            async_result.get()
 
-    def start_ingestion_process_pinecone(self, chunks, embeddings, chunk_metadata=None):
+    def start_ingestion_process_pinecone(self, chunks, embeddings, chunk_metadata=None, chunk_ids=None, store_text=True):
         # Store embeddings in Pinecone
-        self.store_embeddings(embeddings, chunks, chunk_metadata)
+        self.store_embeddings(embeddings, chunks, chunk_metadata, chunk_ids, store_text)
 
     def load_and_query_pinecone(self, query_embedding: list, top_k: int = 5): 
         # -> you have to pass the embedding of the query as parameter.
         results = self.index.query(
-            vector=query_embedding,
+            vector=truncate_embeddings(query_embedding, self.dimension).tolist(),
             top_k=top_k,
+            namespace=self.namespace,
             include_metadata=True
         )
 
         return results
 
+    def existing_ids(self, chunk_ids):
+        existing = set()
+        for i in range(0, len(chunk_ids), 100):
+            response = self.index.fetch(ids=list(chunk_ids[i:i + 100]), namespace=self.namespace)
+            existing.update(response.vectors.keys())
+        return existing
 
-class TFIDFController:
-    def __init__(self, index_name):
-        self.tfidf_vectorizer = None
-        self.index_name = index_name
+    def ids_with_prefix(self, prefix):
+        # Listing by id prefix is only available on serverless indexes
+        return [chunk_id for page in self.index.list(prefix=prefix, namespace=self.namespace) for chunk_id in page]
 
-    def create_tfidf_index(self, chunks):
-        if os.path.exists(self.index_name):
-            existing_data = self.load_tfidf_index()
-            self.tfidf_vectorizer = existing_data['vectorizer']
-            tfidf_vectors = self.tfidf_vectorizer.transform(chunks)
-        else:
-            self.tfidf_vectorizer = TfidfVectorizer()
-            tfidf_vectors = self.tfidf_vectorizer.fit_transform(chunks)
-
-        return tfidf_vectors
-    
-    def store_tfidf_index(self, tfidf_vectors, chunks):
-        if os.path.exists(self.index_name):
-            # Load existing data
-            existing_data = self.load_tfidf_index()
-            existing_vectors = existing_data['vectors']
-            existing_chunks = existing_data['chunks']
-
-            # Combine existing and new data
-            combined_vectors = np.vstack([existing_vectors, tfidf_vectors])
-            combined_chunks = existing_chunks + chunks
+    def delete_ids(self, chunk_ids):
+        chunk_ids = list(chunk_ids)
+        for i in range(0, len(chunk_ids), 1000):
+            self.index.delete(ids=chunk_ids[i:i + 1000], namespace=self.namespace)
+        return len(chunk_ids)
+
+    # Vector store interface shared with LocalVectorController
+    def start_ingestion_process_vectors(self, chunks, embeddings, chunk_metadata=None, chunk_ids=None, store_text=True):
+        self.start_ingestion_process_pinecone(chunks, embeddings, chunk_metadata, chunk_ids, store_text)
+
+    def load_and_query_vectors(self, query_embedding, top_k: int = 5):
+        return self.load_and_query_pinecone(query_embedding, top_k)
+
+
+class TFIDFController(SegmentIndexController):
+    index_suffix = '.tfidf'
+
+    def __init__(self, index_name, merge_threshold=None):
+        super().__init__(index_name, merge_threshold=merge_threshold)
+
+    # === LEGACY FORMATS ===
+    def _legacy_chunks_available(self):
+        # Single pickle (vectorizer + matrix + chunks) or the flat mmap directory without segments
+        return os.path.isfile(self.index_name) or os.path.exists(self._path('offsets.npy'))
+
+    def _legacy_chunks(self):
+        # Old formats froze the vocabulary of the first document, so chunks are re-indexed from their text
+        if os.path.exists(self._path('offsets.npy')):
+            offsets = np.load(self._path('offsets.npy'))
+            with open(self._path('chunks.bin'), 'rb') as f:
+                data = f.read()
+            chunks = [data[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+
+            for file_name in ('data.npy', 'indices.npy', 'indptr.npy', 'offsets.npy', 'chunks.bin', 'vectorizer.pkl', 'meta.json'):
+                if os.path.exists(self._path(file_name)):
+                    os.remove(self._path(file_name))
+            return chunks
 
-        else:
-            combined_vectors = tfidf_vectors
-            combined_chunks = chunks
-
-        # Save both the vectorizer and the vectors
-        with open(self.index_name, 'wb') as f:
-            pickle.dump({
-                'vectorizer': self.tfidf_vectorizer,
-                'vectors': combined_vectors,
-                'chunks': combined_chunks
-            }, f)
-            
-    def load_tfidf_index(self):
         with open(self.index_name, 'rb') as f:
-            return pickle.load(f)
-        
-    def start_ingestion_process_tfidf(self, chunks):
-        # Create and store TF-IDF index
-        tfidf_vectors = self.create_tfidf_index(chunks)
-        self.store_tfidf_index(tfidf_vectors, chunks)
+            return pickle.load(f)['chunks']
+
+    # === WEIGHTING ===
+    def idf(self, stats):
+        # Smoothed IDF, same formula as sklearn's TfidfVectorizer
+        n_chunks = stats['n_chunks']
+        return (np.log((1 + n_chunks) / (1 + np.asarray(stats['df'], dtype=np.float64))) + 1).astype(np.float32)
+
+    def _write_segment_weights(self, segment_dir, counts, postings, doc_lengths, stats):
+        # L2 norms of the TF-IDF rows with the IDF known when the segment is written (refreshed on merge)
+        idf = self.idf(stats)
+        weights = counts.data * idf[counts.indices]
+        rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=counts.shape[0]))
+        norms[norms == 0] = 1.0
+        self._write_array(os.path.join(segment_dir, 'norms.npy'), norms.astype(np.float32))
+
+    def _open_segment_weights(self, segment_dir):
+        return {'norms': np.load(os.path.join(segment_dir, 'norms.npy'), mmap_mode='r')}
+
+    def _query_term_weights(self, term_ids, term_counts, stats):
+        idf = self.idf({'n_chunks': stats['n_chunks'], 'df': stats['df'][term_ids]})
+
+        query_weights = term_counts * idf
+        query_norm = np.linalg.norm(query_weights)
+        if query_norm == 0:
+            return np.zeros(len(term_ids), dtype=np.float32)
+
+        # Document weight is tf * idf, so the query side carries idf twice
+        return query_weights * idf / query_norm
+
+    def _scale_scores(self, segment, doc_ids, scores):
+        return scores / segment['norms'][doc_ids]
+
+    # === PUBLIC API ===
+    def load_tfidf_index(self):
+        return self.load_index()
+
+    def start_ingestion_process_tfidf(self, chunks, chunk_ids=None):
+        # Each ingestion is written as a new segment
+        self.add_chunks(chunks, chunk_ids)
         
     def load_and_query_tfidf(self, query: str, top_k: int = 5):
         tfidf_data = self.load_tfidf_index()
-        vectorizer = tfidf_data['vectorizer']
-        tfidf_vectors = tfidf_data['vectors']
-        chunks = tfidf_data['chunks']
+        return self.format_results(tfidf_data, self.search(query, top_k, index_data=tfidf_data))
 
-        query_vector = vectorizer.transform([query])
-        similarities = (query_vector * tfidf_vectors.T).toarray()[0]
+    def load_and_query_tfidf_batch(self, queries: list, top_k: int = 5):
+        tfidf_data = self.load_tfidf_index()
+        return [self.format_results(tfidf_data, top_results) for top_results in self.search_batch(queries, top_k, index_data=tfidf_data)]
 
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
-        top_scores = similarities[top_indices]
 
-        results = [
-            {
-                'id': f'chunk_{idx}',
-                'score': float(score),
-                'text': chunks[idx]
-            }
-            for idx, score in zip(top_indices, top_scores)
-        ]
+class BM25Controller(SegmentIndexController):
+    index_suffix = '.bm25'
 
-        return results
-    
\ No newline at end of file
+    # Impacts are stored as uint8, 255 being the BM25 saturation limit k1 + 1
+    impact_levels = 255
+    postings_values = 'post_impacts'
+
+    def __init__(self, index_name, k1: float = 1.2, b: float = 0.75, merge_threshold=None):
+        super().__init__(index_name, merge_threshold=merge_threshold)
+        self.k1 = k1
+        self.b = b
+
+    # === WEIGHTING ===
+    def idf(self, stats):
+        # BM25 IDF (Lucene variant, never negative)
+        n_chunks = stats['n_chunks']
+        df = np.asarray(stats['df'], dtype=np.float64)
+        return np.log(1 + (n_chunks - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    def _write_segment_weights(self, segment_dir, counts, postings, doc_lengths, stats):
+        # Precomputed impact of each posting: the tf/length part of BM25, with the average
+        # length known when the segment is written (refreshed on merge). IDF is applied per query.
+        avg_length = stats['avg_length'] or 1.0
+        tf = postings.data
+        lengths = doc_lengths[postings.indices]
+        impacts = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * lengths / avg_length))
+
+        quantized = np.clip(np.rint(impacts / (self.k1 + 1) * self.impact_levels), 1, self.impact_levels)
+        self._write_array(os.path.join(segment_dir, 'post_impacts.npy'), quantized.astype(np.uint8))
+
+    def _open_segment_weights(self, segment_dir):
+        return {'post_impacts': np.load(os.path.join(segment_dir, 'post_impacts.npy'), mmap_mode='r')}
+
+    def _query_term_weights(self, term_ids, term_counts, stats):
+        idf = self.idf({'n_chunks': stats['n_chunks'], 'df': stats['df'][term_ids]})
+        return term_counts * idf * (self.k1 + 1) / self.impact_levels
+
+    # === PUBLIC API ===
+    def load_bm25_index(self):
+        return self.load_index()
+
+    def start_ingestion_process_bm25(self, chunks, chunk_ids=None):
+        # Each ingestion is written as a new segment
+        self.add_chunks(chunks, chunk_ids)
+
+    def load_and_query_bm25(self, query: str, top_k: int = 5):
+        bm25_data = self.load_bm25_index()
+        return self.format_results(bm25_data, self.search(query, top_k, index_data=bm25_data))
+
+    def load_and_query_bm25_batch(self, queries: list, top_k: int = 5):
+        bm25_data = self.load_bm25_index()
+        return [self.format_results(bm25_data, top_results) for top_results in self.search_batch(queries, top_k, index_data=bm25_data)]
@@ -1,39 +1,109 @@
+import time
+import bisect
 import PyPDF2
+from concurrent.futures import ProcessPoolExecutor
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 
+def extract_page_range(pdf_path: str, start_page: int, end_page: int):
+    # Runs in a worker process: opens the PDF on its own and returns [(page number, text, seconds)]
+    pages = []
+    with open(pdf_path, 'rb') as pdf_file_obj:
+        pdf_reader = PyPDF2.PdfReader(pdf_file_obj)
+        for page_num in range(start_page, end_page):
+            start = time.perf_counter()
+            page_text = pdf_reader.pages[page_num].extract_text()
+            pages.append((page_num, page_text, time.perf_counter() - start))
+    return pages
+
+
 class DocumentExtractionController:
-    def __init__(self, pdf_path: str):
+    def __init__(self, pdf_path: str, chunk_size: int = 1000, chunk_overlap: int = 200,
+                 workers: int = 1, parallel_min_pages: int = 64, pages_per_task: int = 16):
         self.pdf_path = pdf_path
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+        # Page extraction is CPU bound pure Python, so large documents are split in page ranges
+        # across `workers` processes. Documents under `parallel_min_pages` stay serial.
+        self.workers = workers
+        self.parallel_min_pages = parallel_min_pages
+        self.pages_per_task = pages_per_task
+
+        # (page number, seconds) of the last extraction
+        self.page_timings = []
+
+    def _iter_serial_pages(self, pdf_reader, page_range):
+        for page_num in page_range:
+            start = time.perf_counter()
+            page_text = pdf_reader.pages[page_num].extract_text()
+            yield page_num, page_text, time.perf_counter() - start
+
+    def _iter_parallel_pages(self, page_range):
+        # Keeps at most 2 tasks per worker in flight and yields them in submission order,
+        # so pages come out in order and memory does not grow with the document
+        ranges = [
+            (range_start, min(range_start + self.pages_per_task, page_range.stop))
+            for range_start in range(page_range.start, page_range.stop, self.pages_per_task)
+        ]
+        max_in_flight = self.workers * 2
+
+        executor = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            futures = [
+                executor.submit(extract_page_range, self.pdf_path, range_start, range_end)
+                for range_start, range_end in ranges[:max_in_flight]
+            ]
+            next_range = len(futures)
+
+            for i in range(len(ranges)):
+                pages = futures[i].result()
+                futures[i] = None
+                if next_range < len(ranges):
+                    futures.append(executor.submit(extract_page_range, self.pdf_path, *ranges[next_range]))
+                    next_range += 1
+
+                yield from pages
+
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def iter_pages(self, start_page: int = 0, end_page: int = None):
+        # Yields (page number, text) one page at a time, pages without text are skipped
+        self.page_timings = []
+
+        with open(self.pdf_path, 'rb') as pdf_file_obj:
+            pdf_reader = PyPDF2.PdfReader(pdf_file_obj)
+            num_pages = len(pdf_reader.pages)
+
+            if end_page is None or end_page > num_pages:
+                end_page = num_pages
+
+            page_range = range(start_page, end_page)
+
+            if start_page >= num_pages:
+                raise ValueError(f"Start page {start_page} exceeds PDF length of {num_pages} pages")
+
+            if start_page > end_page:
+                raise ValueError("Start page number cannot be greater than end page number.")
+
+            if self.workers > 1 and len(page_range) >= self.parallel_min_pages:
+                pages = self._iter_parallel_pages(page_range)
+            else:
+                pages = self._iter_serial_pages(pdf_reader, page_range)
+
+            for page_num, page_text, seconds in pages:
+                self.page_timings.append((page_num, seconds))
+                if page_text.strip():
+                    yield page_num, page_text
+                else:
+                    print(f"Unable to extract text from page {page_num + 1} of {self.pdf_path}.")
+
+            print(f"Text extracted from {num_pages} pages")
 
     def extract_text_from_pdf(self, start_page: int = 0, end_page: int = None):
         try:
-            with open(self.pdf_path, 'rb') as pdf_file_obj:
-                pdf_reader = PyPDF2.PdfReader(pdf_file_obj)
-                num_pages = len(pdf_reader.pages)
-                text = []
-
-                if end_page is None or end_page > num_pages:
-                    end_page = num_pages
-
-                page_range = range(start_page, end_page)
-
-                if start_page >= num_pages:
-                    raise ValueError(f"Start page {start_page} exceeds PDF length of {num_pages} pages")
-
-                if start_page > end_page:
-                    raise ValueError("Start page number cannot be greater than end page number.")
-                
-                for page_num in page_range:
-                    page_obj = pdf_reader.pages[page_num]
-                    page_text = page_obj.extract_text()
-                    if page_text.strip():
-                        text.append(page_text)
-                    else:
-                        print(f"Unable to extract text from page {page_num + 1} of {self.pdf_path}.")
-
-                print(f"Text extracted from {num_pages} pages")
-                
+            text = [page_text for _, page_text in self.iter_pages(start_page=start_page, end_page=end_page)]
             return "\n\n".join(text)
         
         except Exception as e:
@@ -41,12 +111,72 @@ class DocumentExtractionController:
             return []
         
 
+    def get_text_splitter(self):
+        return RecursiveCharacterTextSplitter(
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap
+        )
+
     def generate_chunks(self, text: str)-> list[str]:
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
-        )   
+        text_splitter = self.get_text_splitter()
 
         chunks = text_splitter.split_text(text)
         return chunks
-    
\ No newline at end of file
+
+    def iter_chunks(self, page_texts, window_size: int = None):
+        # Streaming version of generate_chunks over page texts
+        for chunk, _, _ in self.iter_page_chunks(enumerate(page_texts), window_size):
+            yield chunk
+
+    def iter_page_chunks(self, pages, window_size: int = None):
+        # Streaming version of generate_chunks: pages ((page number, text)) are buffered until
+        # `window_size` characters, split, and every chunk but the last is emitted with the first
+        # and last page it spans. The last one may continue on the next page, so it starts the next window.
+        text_splitter = self.get_text_splitter()
+        window_size = window_size or self.chunk_size * 8
+        buffer = ""
+        # Offset in the buffer where each buffered page starts, and its page number
+        page_starts, page_numbers = [], []
+
+        def page_at(offset):
+            return page_numbers[max(bisect.bisect_right(page_starts, offset) - 1, 0)]
+
+        def split_buffer():
+            # Chunks are substrings of the buffer in order, consecutive ones overlapping by at most chunk_overlap
+            located, search_from = [], 0
+            for chunk in text_splitter.split_text(buffer):
+                start = buffer.find(chunk, search_from)
+                if start < 0:
+                    start = search_from
+                search_from = start + 1
+                located.append((chunk, start))
+            return located
+
+        for page_number, page_text in pages:
+            page_starts.append(len(buffer) + 2 if buffer else 0)
+            page_numbers.append(page_number)
+            buffer = f"{buffer}\n\n{page_text}" if buffer else page_text
+            if len(buffer) < window_size:
+                continue
+
+            chunks = split_buffer()
+            for chunk, start in chunks[:-1]:
+                yield chunk, page_at(start), page_at(start + len(chunk) - 1)
+
+            if not chunks:
+                buffer, page_starts, page_numbers = "", [], []
+                continue
+
+            # The last chunk becomes the buffer, page offsets are moved to its start
+            buffer, tail_start = chunks[-1]
+            first = max(bisect.bisect_right(page_starts, tail_start) - 1, 0)
+            kept = [
+                (max(page_start - tail_start, 0), page_number)
+                for page_start, page_number in zip(page_starts[first:], page_numbers[first:])
+                if page_start - tail_start < len(buffer)
+            ]
+            page_starts, page_numbers = [page_start for page_start, _ in kept], [page_number for _, page_number in kept]
+
+        if buffer:
+            for chunk, start in split_buffer():
+                yield chunk, page_at(start), page_at(start + len(chunk) - 1)
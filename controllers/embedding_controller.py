@@ -1,9 +1,73 @@
+import time
 import ollama
+import numpy as np
+
+def truncate_embeddings(embeddings, dimension=None):
+    # Matryoshka truncation: nomic-embed-text v1.5 is trained so its leading 512/256/128 dimensions
+    # still embed the text, the kept components are renormalized for cosine similarity
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if dimension and dimension < embeddings.shape[-1]:
+        embeddings = embeddings[..., :dimension]
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.where(norms > 0, norms, 1)
+
 
 class EmbedingController:
-    def __init__(self, model_name="nomic-embed-text"):
+    def __init__(self, model_name="nomic-embed-text", batch_size=32, host=None, cache=None):
         self.model_name = model_name
+        self.batch_size = batch_size
+
+        # Optional ContentCacheController, vectors are stored as float32 bytes keyed by (model, text)
+        self.cache = cache
+
+        # host=None uses OLLAMA_HOST (or the local default)
+        self.client = ollama.Client(host=host)
+
+        # Throughput of the last generate_embeddings_batch call
+        self.last_batch_stats = None
         
     def generate_embeddings(self, words):
-        response = ollama.embed(model=self.model_name, input=words)
-        return response["embeddings"][0]
\ No newline at end of file
+        # Query path: one SQLite read and write per question would cost more than the cache saves
+        # (repeated questions are served by the query cache of the routes)
+        embeddings, _ = self.embed_texts([words], self.batch_size, use_cache=False)
+        return embeddings[0].tolist()
+
+    def embed_texts(self, texts, batch_size, use_cache=True):
+        # Cached vectors are reused, the rest go to ollama.embed `batch_size` texts per request
+        cache = self.cache if use_cache else None
+        keys, cached = [None] * len(texts), [None] * len(texts)
+        if cache:
+            keys = [cache.make_key(self.model_name, text) for text in texts]
+            cached = cache.get_many('embedding', keys)
+
+        missing = [position for position, value in enumerate(cached) if value is None]
+        vectors = [np.frombuffer(value, dtype=np.float32) if value is not None else None for value in cached]
+
+        for i in range(0, len(missing), batch_size):
+            positions = missing[i:i + batch_size]
+            response = self.client.embed(model=self.model_name, input=[texts[position] for position in positions])
+            batch = np.asarray(response["embeddings"], dtype=np.float32)
+
+            for position, vector in zip(positions, batch):
+                vectors[position] = vector
+
+            if cache:
+                cache.set_many('embedding', [(keys[position], vector.tobytes()) for position, vector in zip(positions, batch)])
+
+        embeddings = np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+        return embeddings, len(texts) - len(missing)
+
+    def generate_embeddings_batch(self, texts, batch_size=None):
+        # One ollama.embed request per batch instead of one per text, rows keep the order of `texts`
+        start = time.perf_counter()
+        embeddings, cached_count = self.embed_texts(texts, batch_size or self.batch_size)
+
+        elapsed = time.perf_counter() - start
+        self.last_batch_stats = {
+            'chunks': len(texts),
+            'cached': cached_count,
+            'seconds': elapsed,
+            'chunks_per_second': len(texts) / elapsed if elapsed > 0 else 0.0
+        }
+
+        return embeddings
@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+
+class IngestionJobController:
+    """
+    Persistent queue of ingestion jobs (SQLite) processed by a pool of background worker threads.
+
+    `pipeline_factory(params)` builds the IngestionPipelineController of a job, so requests only
+    enqueue work and return a job id. Queued jobs survive a restart; jobs that were running when
+    the process stopped are marked "interrupted" instead of being re-run, since their chunks may
+    already be partially indexed.
+    """
+
+    def __init__(self, path, pipeline_factory, workers=1, poll_seconds=0.5):
+        self.path = path
+        self.pipeline_factory = pipeline_factory
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                params TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+        """)
+        self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._connection.execute(
+            "UPDATE jobs SET status = 'interrupted', error = 'Process stopped while the job was running', finished_at = ? "
+            "WHERE status = 'running'", (time.time(),)
+        )
+        self._connection.commit()
+
+        # job id -> (pipeline, started perf_counter) of the running jobs, for live progress
+        self._running = {}
+        # Running jobs whose cancellation was requested
+        self._cancelled = set()
+        self._stop = threading.Event()
+        self._threads = []
+
+    # === WORKERS ===
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"ingestion-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        with self._lock:
+            running = [pipeline for pipeline, _ in self._running.values()]
+        for pipeline in running:
+            pipeline.cancel()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _claim_next_job(self):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT id, params FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+
+            self._connection.execute(
+                "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), row[0])
+            )
+            self._connection.commit()
+            return row[0], json.loads(row[1])
+
+    def _finish_job(self, job_id, status, result=None, error=None):
+        with self._lock:
+            self._running.pop(job_id, None)
+            self._cancelled.discard(job_id)
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+            )
+            self._connection.commit()
+
+    def _worker(self):
+        while not self._stop.is_set():
+            job = self._claim_next_job()
+            if job is None:
+                self._stop.wait(self.poll_seconds)
+                continue
+
+            job_id, params = job
+            try:
+                pipeline = self.pipeline_factory(params)
+                with self._lock:
+                    self._running[job_id] = (pipeline, time.perf_counter())
+
+                # The job may have been cancelled while the pipeline was being built
+                if self._cancel_requested(job_id) or self._stop.is_set():
+                    pipeline.cancel()
+
+                result = pipeline.run(start_page=params.get("start_page", 0), end_page=params.get("end_page"))
+
+                if not result['cancelled']:
+                    status = 'completed'
+                elif self._stop.is_set() and not self._cancel_requested(job_id):
+                    status = 'interrupted'
+                else:
+                    status = 'cancelled'
+                self._finish_job(job_id, status, result=result)
+
+            except Exception as e:
+                print(f"Error when trying to run the ingestion job {job_id}: {e}")
+                self._finish_job(job_id, 'failed', error=str(e))
+
+    # === JOBS ===
+    def submit(self, params):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO jobs (id, status, params, created_at) VALUES (?, 'queued', ?, ?)",
+                (job_id, json.dumps(params), time.time())
+            )
+            self._connection.commit()
+        return job_id
+
+    def _cancel_requested(self, job_id):
+        with self._lock:
+            return job_id in self._cancelled
+
+    def cancel(self, job_id):
+        # Queued jobs are cancelled right away, running ones stop after their current batch
+        with self._lock:
+            row = self._connection.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+
+            if row[0] == 'queued':
+                self._connection.execute(
+                    "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ?", (time.time(), job_id)
+                )
+                self._connection.commit()
+                return 'cancelled'
+
+            if row[0] == 'running':
+                self._cancelled.add(job_id)
+                running = self._running.get(job_id)
+                if running is not None:
+                    running[0].cancel()
+                return 'cancelling'
+
+            return row[0]
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT id, status, params, result, error, created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+            running = self._running.get(job_id)
+
+        if row is None:
+            return None
+
+        job = {
+            'job_id': row[0],
+            'status': row[1],
+            'params': json.loads(row[2]),
+            'error': row[4],
+            'created_at': row[5],
+            'started_at': row[6],
+            'finished_at': row[7]
+        }
+
+        if row[3] is not None:
+            result = json.loads(row[3])
+            job.update({
+                'chunks': result['chunks'],
+                'seconds': result['seconds'],
+                'chunks_per_second': result['chunks_per_second'],
+                'stages': result['stages']
+            })
+
+        elif running is not None:
+            # Live progress of a running job
+            pipeline, started = running
+            elapsed = time.perf_counter() - started
+            stages = {stage: dict(stats) for stage, stats in pipeline.stats.items()}
+            stored = pipeline.stored_chunks
+            job.update({
+                'chunks': stored,
+                'seconds': elapsed,
+                'chunks_per_second': stored / elapsed if elapsed > 0 else 0.0,
+                'stages': stages
+            })
+
+        return job
+
+    def list_jobs(self, limit=50):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self.get(row[0]) for row in rows]
@@ -0,0 +1,352 @@
+import time
+import queue
+import threading
+
+from controllers.document_processing_controller import make_chunk_id, document_id_prefix, default_document_id, check_document_id
+
+# Marks the end of a stage's output
+_END = object()
+
+
+class IngestionPipelineController:
+    """
+    Streaming PDF ingestion: pages -> chunks -> contexts -> embeddings -> vector store / lexical index.
+
+    Every stage runs in its own thread and hands batches of chunks to the next one through a
+    bounded queue, so memory stays constant whatever the size of the PDF and the first batches
+    are already searchable while the rest of the document is being processed.
+
+    Chunk ids are derived from `document_id`, the chunk position and its text, so chunks already
+    stored by a previous run are skipped before they reach the LLM. With `replace`, chunks of the
+    document that this run did not produce (the PDF changed) are deleted once it completes, so it
+    only applies to whole documents.
+
+    With a `chunk_store`, the chunk texts, contexts and page spans are written there and the vector
+    store and lexical indexes only keep the ids.
+    """
+
+    def __init__(self, reading, llm_admin, embedding_admin, vector_admin=None, lexical_admins=(),
+                 context_mode="main_idea", llm_concurrency=4, batch_size=32, commit_size=256, queue_size=4,
+                 on_stored=None, document_id=None, replace=False, metrics=None, chunk_store=None):
+        self.reading = reading
+        self.llm_admin = llm_admin
+        self.embedding_admin = embedding_admin
+        # PineconeController or LocalVectorController
+        self.vector_admin = vector_admin
+        # Controllers with add_chunks (TFIDFController, BM25Controller)
+        self.lexical_admins = list(lexical_admins)
+        # Optional ChunkStoreController (scoped to the collection being written)
+        self.chunk_store = chunk_store
+
+        self.context_mode = context_mode
+        self.llm_concurrency = llm_concurrency
+        self.batch_size = batch_size
+        # Chunks buffered before they are written as one lexical index segment
+        self.commit_size = commit_size
+        self.queue_size = queue_size
+        # Called after every write to the vector store or the lexical indexes (e.g. to invalidate cached results)
+        self.on_stored = on_stored
+        # Defaults to the PDF file name and a digest of its path (see default_document_id)
+        self.document_id = check_document_id(document_id) if document_id else default_document_id(reading.pdf_path)
+        self.replace = replace
+        # Optional MetricsController, every stage call is observed in rag_ingestion_stage_duration_seconds
+        self.metrics = metrics
+        self._seen_ids = set()
+
+        self.stats = {
+            stage: {'items': 0, 'seconds': 0.0}
+            for stage in ('extract', 'chunk', 'skip', 'contextualize', 'embed', 'chunk_store', 'upsert', 'lexical', 'delete')
+        }
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._error = None
+
+    def cancel(self):
+        self._stop.set()
+
+    @property
+    def cancelled(self):
+        return self._stop.is_set()
+
+    @property
+    def stored_chunks(self):
+        # Chunks already searchable: upserted to the vector store, or committed to the lexical indexes without one
+        stage = 'upsert' if self.vector_admin is not None else 'lexical'
+        return self.stats[stage]['items']
+
+    def _record(self, stage, items, seconds):
+        with self._stats_lock:
+            self.stats[stage]['items'] += items
+            self.stats[stage]['seconds'] += seconds
+        if self.metrics is not None:
+            self.metrics.observe(
+                'rag_ingestion_stage_duration_seconds', seconds,
+                help_text="Duration of one call of an ingestion stage (a page, a chunk or a batch)", stage=stage
+            )
+
+    def _put(self, output_queue, item):
+        # Blocks while the next stage is busy (back pressure), but gives up once the pipeline stops
+        while not self._stop.is_set():
+            try:
+                output_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, input_queue):
+        while not self._stop.is_set():
+            try:
+                return input_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    # === STAGES ===
+    def _iter_timed_pages(self, start_page, end_page):
+        pages = self.reading.iter_pages(start_page=start_page, end_page=end_page)
+        while True:
+            start = time.perf_counter()
+            page = next(pages, None)
+            if page is None:
+                return
+            self._record('extract', 1, time.perf_counter() - start)
+            yield page
+
+    def _read_stage(self, start_page, end_page, output_queue):
+        # Pages -> batches of chunks. The main idea (or document prefix) only needs the first
+        # 12000 characters, which are read before chunking starts.
+        try:
+            pages = self._iter_timed_pages(start_page, end_page)
+
+            head_pages, head_length = [], 0
+            for page in pages:
+                head_pages.append(page)
+                head_length += len(page[1]) + 2
+                if head_length >= 12000:
+                    break
+
+            document_prefix = "\n\n".join(page_text for _, page_text in head_pages)
+
+            def all_pages():
+                yield from head_pages
+                yield from pages
+
+            batch, batch_ids, batch_pages = [], [], []
+            # Chunks starting on each page so far: a chunk's position is its first page and its rank on it,
+            # so ingestions of overlapping page ranges give the same chunk the same id
+            page_chunk_counts = {}
+            chunk_start, extract_before = time.perf_counter(), self.stats['extract']['seconds']
+            for chunk, first_page, last_page in self.reading.iter_page_chunks(all_pages()):
+                # Time spent reading the PDF while chunking is already counted by the extract stage
+                extract_spent = self.stats['extract']['seconds'] - extract_before
+                self._record('chunk', 1, time.perf_counter() - chunk_start - extract_spent)
+                if self._stop.is_set():
+                    return
+
+                chunk_offset = page_chunk_counts.get(first_page, 0)
+                page_chunk_counts[first_page] = chunk_offset + 1
+                chunk_id = make_chunk_id(self.document_id, f"{first_page}.{chunk_offset}", chunk)
+                self._seen_ids.add(chunk_id)
+                batch.append(chunk)
+                batch_ids.append(chunk_id)
+                batch_pages.append((first_page, last_page))
+                if len(batch) >= self.batch_size:
+                    if not self._put(output_queue, (document_prefix, batch_ids, batch, batch_pages)):
+                        return
+                    batch, batch_ids, batch_pages = [], [], []
+                chunk_start, extract_before = time.perf_counter(), self.stats['extract']['seconds']
+
+            if batch:
+                self._put(output_queue, (document_prefix, batch_ids, batch, batch_pages))
+
+        except Exception as e:
+            self._fail(e)
+
+        finally:
+            self._put(output_queue, _END)
+
+    def _document_context(self, document_prefix):
+        start = time.perf_counter()
+        if self.context_mode == "document":
+            document_context = {'main_idea': None, 'document': document_prefix}
+        else:
+            document_context = {'main_idea': self.llm_admin.generate_main_text_idea(text=document_prefix), 'document': None}
+        self._record('contextualize', 0, time.perf_counter() - start)
+        return document_context
+
+    def _context_stage(self, input_queue, output_queue):
+        document_context = None
+        try:
+            while True:
+                item = self._get(input_queue)
+                if item is _END:
+                    break
+
+                document_prefix, chunk_ids, chunks, pages = item
+                chunk_ids, chunks, pages = self._skip_stored(chunk_ids, chunks, pages)
+                if not chunks:
+                    continue
+
+                # Only generated once a chunk actually needs a context (not when re-ingesting an unchanged PDF)
+                if document_context is None:
+                    document_context = self._document_context(document_prefix)
+
+                start = time.perf_counter()
+                contexts = self.llm_admin.generate_chunk_contexts(
+                    main_idea=document_context['main_idea'],
+                    chunks=chunks,
+                    max_workers=self.llm_concurrency,
+                    document=document_context['document']
+                )
+                self._record('contextualize', len(chunks), time.perf_counter() - start)
+
+                if not self._put(output_queue, (chunk_ids, chunks, pages, contexts)):
+                    break
+
+        except Exception as e:
+            self._fail(e)
+
+        finally:
+            self._put(output_queue, _END)
+
+    def _skip_stored(self, chunk_ids, chunks, pages):
+        # Chunks already in every store were ingested by a previous run with the same text
+        start = time.perf_counter()
+        stored = set(chunk_ids)
+        for admin in self._stores():
+            stored &= admin.existing_ids(chunk_ids)
+            if not stored:
+                break
+        self._record('skip', len(stored), time.perf_counter() - start)
+
+        kept = [position for position, chunk_id in enumerate(chunk_ids) if chunk_id not in stored]
+        return [chunk_ids[position] for position in kept], [chunks[position] for position in kept], [pages[position] for position in kept]
+
+    def _stores(self):
+        stores = [self.vector_admin] if self.vector_admin is not None else []
+        return stores + self.lexical_admins + ([self.chunk_store] if self.chunk_store is not None else [])
+
+    def _embedding_stage(self, input_queue, output_queue):
+        try:
+            while True:
+                item = self._get(input_queue)
+                if item is _END:
+                    break
+
+                chunk_ids, chunks, pages, contexts = item
+                start = time.perf_counter()
+                embeddings = self.embedding_admin.generate_embeddings_batch(contexts, batch_size=self.batch_size)
+                self._record('embed', len(contexts), time.perf_counter() - start)
+
+                if not self._put(output_queue, (chunk_ids, chunks, pages, contexts, embeddings)):
+                    break
+
+        except Exception as e:
+            self._fail(e)
+
+        finally:
+            self._put(output_queue, _END)
+
+    def _store_stage(self, input_queue):
+        pending_chunks, pending_ids = [], []
+        try:
+            while True:
+                item = self._get(input_queue)
+                if item is _END:
+                    break
+
+                chunk_ids, chunks, pages, contexts, embeddings = item
+                # Texts first, so an id found by a retriever always has its text
+                if self.chunk_store is not None:
+                    start = time.perf_counter()
+                    self.chunk_store.put_chunks(chunk_ids, chunks, contexts, source=self.reading.pdf_path, page_spans=pages)
+                    self._record('chunk_store', len(chunk_ids), time.perf_counter() - start)
+
+                if self.vector_admin is not None:
+                    start = time.perf_counter()
+                    self.vector_admin.start_ingestion_process_vectors(
+                        chunks=contexts, embeddings=embeddings, chunk_ids=chunk_ids, store_text=self.chunk_store is None
+                    )
+                    self._record('upsert', len(contexts), time.perf_counter() - start)
+                    self._notify_stored()
+
+                pending_chunks.extend(contexts)
+                pending_ids.extend(chunk_ids)
+                if len(pending_chunks) >= self.commit_size:
+                    self._commit_lexical(pending_chunks, pending_ids)
+                    pending_chunks, pending_ids = [], []
+
+            # Whatever was upserted is also indexed lexically, even when the pipeline stops early
+            if pending_chunks:
+                self._commit_lexical(pending_chunks, pending_ids)
+
+        except Exception as e:
+            self._fail(e)
+
+    def _commit_lexical(self, chunks, chunk_ids):
+        start = time.perf_counter()
+        for lexical_admin in self.lexical_admins:
+            lexical_admin.add_chunks(chunks, chunk_ids, store_text=self.chunk_store is None)
+        self._record('lexical', len(chunks), time.perf_counter() - start)
+        self._notify_stored()
+
+    def _delete_stale(self):
+        # Chunks of a previous version of the document that this run did not produce
+        start = time.perf_counter()
+        deleted = 0
+        for admin in self._stores():
+            stale = [chunk_id for chunk_id in admin.ids_with_prefix(document_id_prefix(self.document_id)) if chunk_id not in self._seen_ids]
+            if stale:
+                admin.delete_ids(stale)
+                deleted = max(deleted, len(stale))
+        self._record('delete', deleted, time.perf_counter() - start)
+        if deleted:
+            self._notify_stored()
+
+    def _notify_stored(self):
+        if self.on_stored is not None:
+            self.on_stored()
+
+    # === RUN ===
+    def run(self, start_page=0, end_page=None):
+        if self.replace and (start_page or end_page is not None):
+            # Chunks of the other pages would all look stale
+            raise ValueError("replace needs the whole document, not a page range")
+
+        start = time.perf_counter()
+        chunk_queue = queue.Queue(maxsize=self.queue_size)
+        context_queue = queue.Queue(maxsize=self.queue_size)
+        embedding_queue = queue.Queue(maxsize=self.queue_size)
+
+        threads = [
+            threading.Thread(target=self._read_stage, args=(start_page, end_page, chunk_queue), daemon=True),
+            threading.Thread(target=self._context_stage, args=(chunk_queue, context_queue), daemon=True),
+            threading.Thread(target=self._embedding_stage, args=(context_queue, embedding_queue), daemon=True),
+            threading.Thread(target=self._store_stage, args=(embedding_queue,), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+        if self.replace and not self.cancelled:
+            self._delete_stale()
+
+        elapsed = time.perf_counter() - start
+        stored = self.stored_chunks
+        return {
+            'chunks': stored,
+            'seconds': elapsed,
+            'chunks_per_second': stored / elapsed if elapsed > 0 else 0.0,
+            'cancelled': self.cancelled and self._error is None,
+            'stages': self.stats
+        }
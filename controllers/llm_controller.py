@@ -1,4 +1,8 @@
+import time
+import random
+import threading
 import ollama
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 DOCUMENT_CONTEXT_PROMPT = """
 Analyze the text and extract the main idea
@@ -22,6 +26,22 @@ Please give a short succinct context to situate this chunk within the overall do
 Answer only in ENGLISH with the succinct context and nothing else.
 """
 
+# Document first and chunk last: every request of a document shares the same prefix,
+# so Ollama only evaluates it once and reuses its KV cache for the following chunks
+CHUNK_CONTEXT_DOCUMENT_PROMPT = """
+<document>
+{doc_content}
+</document>
+
+Here is the chunk we want to situate within the whole document
+<chunk>
+{chunk_content}
+</chunk>
+
+Please give a short succinct context to situate this chunk within the overall document for the purposes of improving search retrieval of the chunk.
+Answer only in ENGLISH with the succinct context and nothing else.
+"""
+
 LLM_ASSISTANT_PROMPT = """
 You are a helpful AI assistant who will answer the user's question. Based on the context given. 
 <context>
@@ -34,43 +54,151 @@ You are a helpful AI assistant who will answer the user's question. Based on the
 """
 
 class LLMController:
-    def __init__(self, model_name="dolphin-mistral"):
+    def __init__(self, model_name="dolphin-mistral", host=None, cache=None, keep_alive="30m", num_ctx=8192):
         self.model_name = model_name
 
+        # Keeps the model (and its prompt cache) loaded between requests; num_ctx must fit the
+        # truncated document plus a chunk when contextualizing with the document prefix
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+
+        # Prompt tokens actually evaluated by Ollama (cached prefixes are not counted)
+        self.usage = {'requests': 0, 'prompt_eval_count': 0, 'eval_count': 0, 'total_duration_ns': 0}
+        self._usage_lock = threading.Lock()
+
+        # host=None uses OLLAMA_HOST (or the local default), so a stub server can be swapped in
+        self.client = ollama.Client(host=host)
+
+        # Optional ContentCacheController, main ideas and chunk contexts are reused across ingestions
+        self.cache = cache
+
     def truncate_text(self, text, max_size=12000):
         if len(text) > max_size:
             return text[:max_size]
         
         return text
 
-    def generate_main_text_idea(self, text):
-        truncated_text = self.truncate_text(text)
+    def record_usage(self, response):
+        with self._usage_lock:
+            self.usage['requests'] += 1
+            self.usage['prompt_eval_count'] += response.get('prompt_eval_count') or 0
+            self.usage['eval_count'] += response.get('eval_count') or 0
+            self.usage['total_duration_ns'] += response.get('total_duration') or 0
 
-        response = ollama.chat(
+    def cached_chat(self, namespace, key_parts, content, options=None):
+        key = self.cache.make_key(self.model_name, *key_parts) if self.cache else None
+        if key:
+            cached = self.cache.get(namespace, key)
+            if cached is not None:
+                return cached.decode('utf-8')
+
+        response = self.client.chat(
             model=self.model_name,
             messages=[
-                {"role": "user", "content": DOCUMENT_CONTEXT_PROMPT.format(doc_content=truncated_text)},
-            ]
+                {"role": "user", "content": content},
+            ],
+            options=options,
+            keep_alive=self.keep_alive
         )
+        self.record_usage(response)
+        answer = response['message']['content']
 
-        return response['message']['content']
+        if key:
+            self.cache.set(namespace, key, answer.encode('utf-8'))
+
+        return answer
+
+    def generate_main_text_idea(self, text):
+        truncated_text = self.truncate_text(text)
+
+        return self.cached_chat(
+            'main_idea',
+            (DOCUMENT_CONTEXT_PROMPT, truncated_text),
+            DOCUMENT_CONTEXT_PROMPT.format(doc_content=truncated_text)
+        )
     
-    def generate_chunk_context(self, main_idea, chunk):
-        response = ollama.chat(
-            model=self.model_name,
-            messages=[
-                {"role": "user", "content": CHUNK_CONTEXT_PROMPT.format(main_idea=main_idea, chunk_content=chunk)},
-            ]
+    def generate_chunk_context(self, main_idea, chunk, document=None):
+        # With `document`, the (truncated) document is sent as a stable prefix instead of the main idea
+        if document is not None:
+            truncated_document = self.truncate_text(document)
+            return self.cached_chat(
+                'chunk_context',
+                (CHUNK_CONTEXT_DOCUMENT_PROMPT, truncated_document, chunk),
+                CHUNK_CONTEXT_DOCUMENT_PROMPT.format(doc_content=truncated_document, chunk_content=chunk),
+                options={'num_ctx': self.num_ctx}
+            )
+
+        return self.cached_chat(
+            'chunk_context',
+            (CHUNK_CONTEXT_PROMPT, main_idea, chunk),
+            CHUNK_CONTEXT_PROMPT.format(main_idea=main_idea, chunk_content=chunk)
         )
 
-        return response['message']['content']
+    def generate_chunk_context_with_retry(self, main_idea, chunk, max_retries=3, backoff_seconds=1.0, document=None):
+        for attempt in range(max_retries + 1):
+            try:
+                return self.generate_chunk_context(main_idea=main_idea, chunk=chunk, document=document)
+            except Exception as e:
+                if attempt == max_retries:
+                    raise
+
+                # Exponential backoff with jitter so parallel workers don't retry in lockstep
+                delay = backoff_seconds * (2 ** attempt) * (0.5 + random.random())
+                print(f"Chunk context failed ({e}), retrying in {delay:.1f}s ({attempt + 1}/{max_retries})")
+                time.sleep(delay)
+
+    def generate_chunk_contexts(self, main_idea, chunks, max_workers=4, max_retries=3, backoff_seconds=1.0, progress_callback=None, document=None):
+        # Contextualizes the chunks with at most `max_workers` concurrent requests, results keep the chunk order.
+        # Each Ollama slot keeps its own prompt cache, so in document mode the prefix is evaluated once per worker.
+        contexts = [None] * len(chunks)
+
+        executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        try:
+            futures = {
+                executor.submit(self.generate_chunk_context_with_retry, main_idea, chunk, max_retries, backoff_seconds, document): position
+                for position, chunk in enumerate(chunks)
+            }
+
+            for completed, future in enumerate(as_completed(futures), start=1):
+                contexts[futures[future]] = future.result()
+                if progress_callback:
+                    progress_callback(completed, len(chunks))
+        finally:
+            # On failure, chunks that haven't started are dropped instead of waited for
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        return contexts
     
     def chat_llm(self, context, message):
-        response = ollama.chat(
+        response = self.client.chat(
             model=self.model_name,
             messages=[
                 {"role": "user", "content": LLM_ASSISTANT_PROMPT.format(context=context, question=message)},
-            ]
+            ],
+            keep_alive=self.keep_alive
         )
+        self.record_usage(response)
+
+        return response['message']['content']
+
+    def stream_chat_llm(self, context, message, stats=None):
+        # Yields the answer piece by piece as Ollama generates it. The final counters of Ollama
+        # (eval_count, eval_duration, ...) are copied into `stats` when given.
+        response = None
+        for response in self.client.chat(
+            model=self.model_name,
+            messages=[
+                {"role": "user", "content": LLM_ASSISTANT_PROMPT.format(context=context, question=message)},
+            ],
+            keep_alive=self.keep_alive,
+            stream=True
+        ):
+            content = response['message']['content']
+            if content:
+                yield content
 
-        return response['message']['content']
\ No newline at end of file
+        if response is not None:
+            self.record_usage(response)
+            if stats is not None:
+                for key in ('prompt_eval_count', 'eval_count', 'eval_duration', 'total_duration'):
+                    stats[key] = response.get(key)
\ No newline at end of file
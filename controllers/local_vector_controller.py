@@ -0,0 +1,498 @@
+import os
+import json
+import threading
+
+import numpy as np
+from scipy import sparse
+
+from controllers.segment_index_controller import top_k_positions
+from controllers.embedding_controller import truncate_embeddings
+from controllers.document_processing_controller import stored_chunk_ids
+
+# Storage precisions of the vectors scanned by the queries: dtype and file name
+PRECISIONS = {'float32': (np.float32, 'scan.f32'), 'float16': (np.float16, 'scan.f16'), 'int8': (np.int8, 'scan.i8')}
+
+
+def quantize_vectors(vectors, precision):
+    # Returns (stored vectors, per-vector scales); int8 is symmetric scalar quantization with one
+    # float32 scale per vector (its largest component maps to 127)
+    if precision == 'int8':
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return vectors.astype(PRECISIONS[precision][0]), None
+
+
+def assign_to_centroids(vectors, centroids, batch_size=16384):
+    # Nearest centroid (inner product, vectors and centroids are normalized) of every vector
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch_size):
+        batch = np.asarray(vectors[start:start + batch_size], dtype=np.float32)
+        assignments[start:start + batch_size] = np.argmax(batch @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(vectors, n_clusters, n_iter=10, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = np.array(vectors[np.sort(rng.choice(len(vectors), n_clusters, replace=False))], dtype=np.float32)
+
+    for _ in range(n_iter):
+        assignments = assign_to_centroids(vectors, centroids)
+        # One-hot (cluster x vector) product sums the vectors of every cluster in one pass
+        membership = sparse.csr_matrix(
+            (np.ones(len(vectors), dtype=np.float32), (assignments, np.arange(len(vectors)))),
+            shape=(n_clusters, len(vectors))
+        )
+        sums = np.asarray(membership @ vectors, dtype=np.float32)
+        norms = np.linalg.norm(sums, axis=1)
+
+        # Empty clusters keep their previous centroid
+        filled = norms > 0
+        centroids[filled] = sums[filled] / norms[filled, None]
+
+    return centroids
+
+
+class LocalVectorController:
+    """
+    Local alternative to PineconeController (cosine similarity, same query results format).
+
+    Normalized float32 vectors are appended to a raw file that is memory-mapped for queries,
+    their ids and metadata to a JSON lines file. Once the collection reaches `train_min`
+    vectors an IVF-flat index is trained (spherical k-means, about 4 * sqrt(n) lists) and
+    queries only scan the `nprobe` lists closest to the query; the lists are retrained every
+    time the collection doubles. Smaller collections are searched exhaustively.
+
+    Storing an id that already exists replaces its vector; replaced and deleted vectors are
+    recorded by position in deleted.i64 and skipped by queries.
+
+    The vectors scanned by queries can be stored compressed: `precision` float16 or int8 (per-vector
+    scales in scales.f32) and `dimension` keeps only the leading components (Matryoshka truncation).
+    The full precision vectors stay on disk: the best `rescore * top_k` candidates are rescored with
+    them, so only those rows are read. An index is converted when it is opened with other settings.
+    """
+
+    index_suffix = '.vectors'
+
+    def __init__(self, index_name, nprobe=16, train_min=4096, precision='float32', dimension=None, rescore=4):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown vector precision '{precision}', expected one of {', '.join(PRECISIONS)}")
+
+        self.index_name = index_name
+        self.index_dir = os.path.splitext(index_name)[0] + self.index_suffix
+        self.nprobe = nprobe
+        self.train_min = train_min
+        self.precision = precision
+        self.dimension = dimension
+        # Candidates rescored at full precision per result (0 keeps the compressed scores)
+        self.rescore = rescore
+
+        self._index_data = None
+        self._index_version = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        # id -> position of the live vectors, kept up to date by the writes of this process
+        self._positions = None
+        self._positions_state = None
+        self._positions_lock = threading.Lock()
+
+    # === STORAGE HELPERS ===
+    def _path(self, *parts):
+        return os.path.join(self.index_dir, *parts)
+
+    def _write_array(self, path, array):
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, array)
+        os.replace(path + '.tmp', path)
+
+    def _read_meta(self):
+        if not os.path.exists(self._path('meta.json')):
+            return {
+                'version': 0, 'dim': None, 'n_vectors': 0, 'n_trained': 0, 'n_lists': 0, 'metadata_bytes': 0, 'ids_bytes': 0,
+                'n_deleted': 0, 'precision': None, 'scan_dim': None
+            }
+
+        with open(self._path('meta.json')) as f:
+            meta = json.load(f)
+        # Indexes written before ids and deletes were tracked, or before compressed storage
+        meta.setdefault('ids_bytes', None)
+        meta.setdefault('n_deleted', 0)
+        meta.setdefault('precision', 'float32')
+        meta.setdefault('scan_dim', meta['dim'])
+        return meta
+
+    def _write_meta(self, meta):
+        # Appended files may run past the manifest, readers only look at the first n_vectors
+        meta['version'] += 1
+        with open(self._path('meta.json.tmp'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(self._path('meta.json.tmp'), self._path('meta.json'))
+
+    def _truncate(self, file_name, size):
+        # Drops whatever a failed write appended after the last manifest
+        path = self._path(file_name)
+        if os.path.exists(path) and os.path.getsize(path) != size:
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+
+    def index_exists(self):
+        return os.path.exists(self._path('meta.json'))
+
+    # === COMPRESSED STORAGE ===
+    def _scan_settings(self, dim):
+        return self.precision, min(self.dimension or dim, dim)
+
+    def _is_compressed(self, meta):
+        # float32 vectors of full dimension are scanned straight from vectors.f32
+        return meta['precision'] != 'float32' or meta['scan_dim'] != meta['dim']
+
+    def _scan_file(self, meta):
+        return PRECISIONS[meta['precision']][1] if self._is_compressed(meta) else None
+
+    def _append_scan(self, meta, vectors):
+        scan_file = self._scan_file(meta)
+        if scan_file is None:
+            return
+        scan, scales = quantize_vectors(truncate_embeddings(vectors, meta['scan_dim']), meta['precision'])
+        with open(self._path(scan_file), 'ab') as f:
+            f.write(scan.tobytes())
+        if scales is not None:
+            with open(self._path('scales.f32'), 'ab') as f:
+                f.write(scales.tobytes())
+
+    def _truncate_scan(self, meta):
+        scan_file = self._scan_file(meta)
+        if scan_file is not None:
+            itemsize = np.dtype(PRECISIONS[meta['precision']][0]).itemsize
+            self._truncate(scan_file, meta['n_vectors'] * meta['scan_dim'] * itemsize)
+        if meta['precision'] == 'int8':
+            self._truncate('scales.f32', meta['n_vectors'] * 4)
+
+    def _convert_scan(self, meta, batch_size=65536):
+        # Call with the write lock held: rewrites the scanned vectors from vectors.f32 with this controller's settings
+        meta['precision'], meta['scan_dim'] = self._scan_settings(meta['dim'])
+        scan_file = self._scan_file(meta)
+        for file_name in ('scan.f32', 'scan.f16', 'scan.i8', 'scales.f32'):
+            if os.path.exists(self._path(file_name)):
+                os.remove(self._path(file_name))
+        if scan_file is not None:
+            all_vectors = np.memmap(self._path('vectors.f32'), dtype=np.float32, mode='r', shape=(meta['n_vectors'], meta['dim']))
+            for start in range(0, meta['n_vectors'], batch_size):
+                self._append_scan(meta, np.asarray(all_vectors[start:start + batch_size]))
+        self._write_meta(meta)
+
+    def storage_stats(self):
+        # Bytes scanned by the queries (resident in memory once warm) and of the full precision vectors
+        meta = self._read_meta()
+        scan_file = self._scan_file(meta) if meta['dim'] else None
+        scan_bytes = meta['n_vectors'] * (meta['dim'] or 0) * 4
+        if scan_file is not None:
+            scan_bytes = meta['n_vectors'] * meta['scan_dim'] * np.dtype(PRECISIONS[meta['precision']][0]).itemsize
+            scan_bytes += meta['n_vectors'] * 4 if meta['precision'] == 'int8' else 0
+        return {
+            'vectors': meta['n_vectors'],
+            'dim': meta['dim'],
+            'precision': meta['precision'],
+            'scan_dim': meta['scan_dim'],
+            'scan_bytes': scan_bytes,
+            'full_bytes': meta['n_vectors'] * (meta['dim'] or 0) * 4
+        }
+
+    # === WRITE PATH ===
+    def store_embeddings(self, embeddings, chunks, chunk_metadata=None, chunk_ids=None, store_text=True):
+        # Without store_text the text stays in the chunk store and the metadata records only hold the ids
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if not len(embeddings):
+            return
+
+        chunk_ids = stored_chunk_ids(chunks, chunk_ids)
+
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        vectors = embeddings / np.where(norms > 0, norms, 1)
+
+        records = []
+        for i, chunk in enumerate(chunks):
+            metadata = {'text': chunk} if store_text else {}
+            if chunk_metadata:
+                metadata.update(chunk_metadata[i])
+            records.append((json.dumps({'id': chunk_ids[i], 'metadata': metadata}) + "\n").encode('utf-8'))
+
+        with self._write_lock:
+            os.makedirs(self.index_dir, exist_ok=True)
+            meta = self._read_meta()
+            if meta['dim'] is None:
+                meta['dim'] = vectors.shape[1]
+                meta['precision'], meta['scan_dim'] = self._scan_settings(meta['dim'])
+            elif meta['dim'] != vectors.shape[1]:
+                raise ValueError(f"Embeddings of dimension {vectors.shape[1]} can't be added to {self.index_dir} (dimension {meta['dim']})")
+
+            self._truncate('vectors.f32', meta['n_vectors'] * meta['dim'] * 4)
+            self._truncate_scan(meta)
+            if (meta['precision'], meta['scan_dim']) != self._scan_settings(meta['dim']):
+                self._convert_scan(meta)
+            self._truncate('assignments.i32', meta['n_vectors'] * 4 if meta['n_lists'] else 0)
+            self._truncate('metadata_offsets.i64', meta['n_vectors'] * 8)
+            self._truncate('metadata.jsonl', meta['metadata_bytes'])
+            if meta['ids_bytes'] is None:
+                self._write_ids_from_metadata(meta)
+            self._truncate('ids.txt', meta['ids_bytes'])
+
+            # Ids stored again replace their previous vector
+            positions = self._live_positions(meta)
+            replaced = sorted({positions[chunk_id] for chunk_id in chunk_ids if chunk_id in positions})
+
+            lengths = np.fromiter((len(record) for record in records), dtype=np.int64, count=len(records))
+            offsets = meta['metadata_bytes'] + np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+            with open(self._path('vectors.f32'), 'ab') as f:
+                f.write(vectors.tobytes())
+            self._append_scan(meta, vectors)
+            with open(self._path('metadata.jsonl'), 'ab') as f:
+                f.write(b''.join(records))
+            with open(self._path('metadata_offsets.i64'), 'ab') as f:
+                f.write(offsets.astype(np.int64).tobytes())
+            encoded_ids = ''.join(f"{chunk_id}\n" for chunk_id in chunk_ids).encode('utf-8')
+            with open(self._path('ids.txt'), 'ab') as f:
+                f.write(encoded_ids)
+            meta['ids_bytes'] += len(encoded_ids)
+            self._append_deleted(meta, replaced)
+
+            # New vectors go to the nearest existing list, the lists are retrained once the collection doubles
+            if meta['n_lists']:
+                centroids = np.load(self._path('centroids.npy'))
+                with open(self._path('assignments.i32'), 'ab') as f:
+                    f.write(assign_to_centroids(vectors, centroids).tobytes())
+
+            meta['n_vectors'] += len(vectors)
+            meta['metadata_bytes'] += int(lengths.sum())
+
+            if meta['n_vectors'] >= self.train_min and meta['n_vectors'] >= 2 * meta['n_trained']:
+                self._train(meta)
+
+            self._write_meta(meta)
+
+            with self._positions_lock:
+                for chunk_id, position in zip(chunk_ids, range(meta['n_vectors'] - len(chunk_ids), meta['n_vectors'])):
+                    positions[chunk_id] = position
+                self._positions_state = (meta['ids_bytes'], meta['n_deleted'])
+
+    def _read_meta_with_ids(self):
+        # Call with the write lock held
+        meta = self._read_meta()
+        if meta['ids_bytes'] is None:
+            self._write_ids_from_metadata(meta)
+            self._write_meta(meta)
+        return meta
+
+    def _write_ids_from_metadata(self, meta):
+        with open(self._path('metadata.jsonl'), 'rb') as f:
+            ids = [json.loads(line)['id'] for line in f.read(meta['metadata_bytes']).splitlines()]
+        encoded_ids = ''.join(f"{chunk_id}\n" for chunk_id in ids).encode('utf-8')
+        with open(self._path('ids.txt'), 'wb') as f:
+            f.write(encoded_ids)
+        meta['ids_bytes'] = len(encoded_ids)
+
+    def _live_positions(self, meta):
+        # Rebuilt from ids.txt and deleted.i64 only when another process changed them
+        with self._positions_lock:
+            if self._positions_state != (meta['ids_bytes'], meta['n_deleted']):
+                ids = []
+                if meta['ids_bytes']:
+                    with open(self._path('ids.txt'), 'rb') as f:
+                        ids = f.read(meta['ids_bytes']).decode('utf-8').split('\n')[:meta['n_vectors']]
+                deleted = set()
+                if meta['n_deleted']:
+                    deleted = set(np.fromfile(self._path('deleted.i64'), dtype=np.int64, count=meta['n_deleted']).tolist())
+                self._positions = {chunk_id: idx for idx, chunk_id in enumerate(ids) if idx not in deleted}
+                self._positions_state = (meta['ids_bytes'], meta['n_deleted'])
+            return self._positions
+
+    def _append_deleted(self, meta, positions):
+        if not len(positions):
+            return
+        with open(self._path('deleted.i64'), 'r+b' if os.path.exists(self._path('deleted.i64')) else 'wb') as f:
+            f.seek(meta['n_deleted'] * 8)
+            f.write(np.asarray(positions, dtype=np.int64).tobytes())
+            f.truncate()
+        meta['n_deleted'] += len(positions)
+
+    def delete_ids(self, chunk_ids):
+        # Returns the number of vectors deleted
+        if not self.index_exists():
+            return 0
+
+        with self._write_lock:
+            meta = self._read_meta_with_ids()
+            positions = self._live_positions(meta)
+            deleted = sorted({positions[chunk_id] for chunk_id in chunk_ids if chunk_id in positions})
+            if deleted:
+                self._append_deleted(meta, deleted)
+                self._write_meta(meta)
+                with self._positions_lock:
+                    for chunk_id in chunk_ids:
+                        positions.pop(chunk_id, None)
+                    self._positions_state = (meta['ids_bytes'], meta['n_deleted'])
+
+        return len(deleted)
+
+    def _train(self, meta):
+        all_vectors = np.memmap(self._path('vectors.f32'), dtype=np.float32, mode='r', shape=(meta['n_vectors'], meta['dim']))
+        n_lists = int(min(4 * np.sqrt(meta['n_vectors']), meta['n_vectors'] // 39))
+
+        # k-means on a sample (about 256 vectors per list), then every vector is assigned
+        rng = np.random.default_rng(meta['n_vectors'])
+        sample_size = min(meta['n_vectors'], n_lists * 256)
+        sample = np.asarray(all_vectors[np.sort(rng.choice(meta['n_vectors'], sample_size, replace=False))])
+        centroids = spherical_kmeans(sample, n_lists)
+
+        assignments = assign_to_centroids(all_vectors, centroids)
+        self._write_array(self._path('centroids.npy'), centroids)
+        with open(self._path('assignments.i32.tmp'), 'wb') as f:
+            f.write(assignments.tobytes())
+        os.replace(self._path('assignments.i32.tmp'), self._path('assignments.i32'))
+
+        meta['n_lists'] = n_lists
+        meta['n_trained'] = meta['n_vectors']
+
+    def start_ingestion_process_vectors(self, chunks, embeddings, chunk_metadata=None, chunk_ids=None, store_text=True):
+        self.store_embeddings(embeddings, chunks, chunk_metadata, chunk_ids, store_text)
+
+    # === READ PATH ===
+    def load_index(self):
+        meta = self._read_meta()
+        if meta['dim'] and (meta['precision'], meta['scan_dim']) != self._scan_settings(meta['dim']):
+            with self._write_lock:
+                meta = self._read_meta()
+                if (meta['precision'], meta['scan_dim']) != self._scan_settings(meta['dim']):
+                    self._truncate_scan(meta)
+                    self._convert_scan(meta)
+
+        version = os.stat(self._path('meta.json')).st_mtime_ns
+
+        with self._lock:
+            if self._index_data is None or self._index_version != version:
+                meta = self._read_meta()
+                n_vectors, dim = meta['n_vectors'], meta['dim']
+
+                index_data = {
+                    'meta': meta,
+                    'vectors': np.memmap(self._path('vectors.f32'), dtype=np.float32, mode='r', shape=(n_vectors, dim)),
+                    'scan': None,
+                    'scales': None,
+                    'metadata_offsets': np.memmap(self._path('metadata_offsets.i64'), dtype=np.int64, mode='r', shape=(n_vectors,)),
+                    'centroids': None,
+                    'deleted': np.unique(np.fromfile(self._path('deleted.i64'), dtype=np.int64, count=meta['n_deleted']))
+                    if meta['n_deleted'] else np.zeros(0, dtype=np.int64)
+                }
+
+                scan_file = self._scan_file(meta) if n_vectors else None
+                if scan_file is not None:
+                    index_data['scan'] = np.memmap(
+                        self._path(scan_file), dtype=PRECISIONS[meta['precision']][0], mode='r', shape=(n_vectors, meta['scan_dim'])
+                    )
+                    if meta['precision'] == 'int8':
+                        index_data['scales'] = np.fromfile(self._path('scales.f32'), dtype=np.float32, count=n_vectors)
+
+                if meta['n_lists']:
+                    assignments = np.fromfile(self._path('assignments.i32'), dtype=np.int32, count=n_vectors)
+                    # Inverted lists: vector ids sorted by list, list_indptr[l]:list_indptr[l + 1] is list l
+                    index_data['centroids'] = np.load(self._path('centroids.npy'))
+                    index_data['list_ids'] = np.argsort(assignments, kind='stable').astype(np.int64)
+                    index_data['list_indptr'] = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=meta['n_lists']))])
+
+                self._index_data = index_data
+                self._index_version = version
+
+            return self._index_data
+
+    def existing_ids(self, chunk_ids):
+        if not self.index_exists():
+            return set()
+        with self._write_lock:
+            positions = self._live_positions(self._read_meta_with_ids())
+            with self._positions_lock:
+                return {chunk_id for chunk_id in chunk_ids if chunk_id in positions}
+
+    def ids_with_prefix(self, prefix):
+        if not self.index_exists():
+            return []
+        with self._write_lock:
+            positions = self._live_positions(self._read_meta_with_ids())
+            with self._positions_lock:
+                return [chunk_id for chunk_id in positions if chunk_id.startswith(prefix)]
+
+    def get_record(self, index_data, idx):
+        start = int(index_data['metadata_offsets'][idx])
+        end = int(index_data['metadata_offsets'][idx + 1]) if idx + 1 < len(index_data['metadata_offsets']) else index_data['meta']['metadata_bytes']
+        with open(self._path('metadata.jsonl'), 'rb') as f:
+            f.seek(start)
+            return json.loads(f.read(end - start))
+
+    def _scan_scores(self, index_data, scan, query, candidate_ids=None, block_size=4096):
+        # Compressed vectors are widened to float32 one cache-sized block at a time
+        n = len(scan) if candidate_ids is None else len(candidate_ids)
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, block_size):
+            rows = slice(start, start + block_size) if candidate_ids is None else candidate_ids[start:start + block_size]
+            scores[start:start + block_size] = np.asarray(scan[rows], dtype=np.float32) @ query
+        if index_data['scales'] is not None and scan is index_data['scan']:
+            scores *= index_data['scales'] if candidate_ids is None else index_data['scales'][candidate_ids]
+        return scores
+
+    def search(self, query_embedding, top_k=5, index_data=None, nprobe=None, exact=False):
+        # Returns [(vector idx, cosine similarity)]; exact scans every vector at full precision
+        index_data = index_data or self.load_index()
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        query_norm = np.linalg.norm(query)
+        if not index_data['meta']['n_vectors'] or query_norm == 0:
+            return []
+        query = query / query_norm
+
+        compressed = index_data['scan'] is not None and not exact
+        scan = index_data['scan'] if compressed else index_data['vectors']
+        scan_query = truncate_embeddings(query, index_data['meta']['scan_dim']) if compressed else query
+
+        if exact or index_data['centroids'] is None:
+            candidate_ids = None
+            scores = self._scan_scores(index_data, scan, scan_query)
+        else:
+            nprobe = min(nprobe or self.nprobe, len(index_data['centroids']))
+            probed_lists = top_k_positions(index_data['centroids'] @ query, nprobe)
+            list_ids, list_indptr = index_data['list_ids'], index_data['list_indptr']
+            candidate_ids = np.sort(np.concatenate([list_ids[list_indptr[l]:list_indptr[l + 1]] for l in probed_lists]))
+            scores = self._scan_scores(index_data, scan, scan_query, candidate_ids)
+
+        deleted = index_data['deleted']
+        if len(deleted) and candidate_ids is None:
+            scores[deleted] = -np.inf
+        elif len(deleted):
+            scores[np.isin(candidate_ids, deleted)] = -np.inf
+
+        if compressed and self.rescore:
+            # Best candidates of the compressed scores, rescored with their full precision rows
+            top_positions = top_k_positions(scores, top_k * self.rescore)
+            top_positions = top_positions[np.isfinite(scores[top_positions])]
+            # Sorted, the rows are read from vectors.f32 in file order
+            candidate_ids = np.sort(top_positions if candidate_ids is None else candidate_ids[top_positions])
+            scores = np.asarray(index_data['vectors'][candidate_ids], dtype=np.float32) @ query
+
+        top_positions = top_k_positions(scores, top_k)
+        ids = top_positions if candidate_ids is None else candidate_ids[top_positions]
+        return [(int(idx), float(scores[position])) for idx, position in zip(ids, top_positions) if np.isfinite(scores[position])]
+
+    def load_and_query_vectors(self, query_embedding, top_k=5):
+        # Same shape as a Pinecone query response with include_metadata=True
+        if not self.index_exists():
+            return {'matches': []}
+
+        index_data = self.load_index()
+        matches = []
+        for idx, score in self.search(query_embedding, top_k, index_data=index_data):
+            record = self.get_record(index_data, idx)
+            matches.append({'id': record['id'], 'score': score, 'metadata': record['metadata']})
+
+        return {'matches': matches}
+
+    def warm(self):
+        if self.index_exists():
+            self.load_index()
@@ -0,0 +1,108 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Seconds, from cache hits (sub-millisecond) to LLM answers and ingestion batches
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Per-request timing breakdown ({stage: milliseconds}) collected by the spans of the current request.
+# Copied into the request threads by ControllerRegistry.run_blocking, the dict itself is shared.
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class MetricsController:
+    """
+    In-process histograms and counters rendered in the Prometheus text format (GET /metrics).
+
+    `span(stage)` times a block of code: the duration is added to the rag_stage_duration_seconds
+    histogram and, when the current request asked for it (`collect_timings`), to its per-request
+    breakdown.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # name -> (help, {labels: [bucket counts..., sum, count]})
+        self._histograms = {}
+        # name -> (help, {labels: value})
+        self._counters = {}
+
+    def observe(self, name, seconds, help_text="", **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            _, series = self._histograms.setdefault(name, (help_text, {}))
+            values = series.get(key)
+            if values is None:
+                values = series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    values[i] += 1
+            values[-2] += seconds
+            values[-1] += 1
+
+    def increment(self, name, value=1, help_text="", **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            _, series = self._counters.setdefault(name, (help_text, {}))
+            series[key] = series.get(key, 0) + value
+
+    @contextmanager
+    def span(self, stage, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe('rag_stage_duration_seconds', elapsed, help_text="Duration of the retrieval and chat stages", stage=stage, **labels)
+            timings = _request_timings.get()
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0.0) + elapsed * 1000
+
+    @contextmanager
+    def collect_timings(self):
+        # Yields the {stage: milliseconds} dict filled by the spans run while it is open
+        timings = {}
+        token = _request_timings.set(timings)
+        try:
+            yield timings
+        finally:
+            _request_timings.reset(token)
+
+    def render(self, extra_counters=()):
+        # extra_counters: (name, help, {labels...}, value) read at scrape time (e.g. cache statistics)
+        lines = []
+        with self._lock:
+            for name, (help_text, series) in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {help_text or name}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, values in sorted(series.items()):
+                    for bound, count in zip(self.buckets, values):
+                        lines.append(f"{name}_bucket{_format_labels(key + (('le', repr(float(bound))),))} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {values[-1]}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {values[-2]!r}")
+                    lines.append(f"{name}_count{_format_labels(key)} {values[-1]}")
+
+            counters = {name: (help_text, dict(series)) for name, (help_text, series) in self._counters.items()}
+
+        for name, help_text, labels, value in extra_counters:
+            _, series = counters.setdefault(name, (help_text, {}))
+            series[tuple(sorted(labels.items()))] = value
+
+        for name, (help_text, series) in sorted(counters.items()):
+            lines.append(f"# HELP {name} {help_text or name}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(key)} {value}")
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,133 @@
+import re
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+
+
+def normalize_query(query):
+    # "What is  TF-IDF?" and "what is tf-idf" share the same exact-match entry
+    return re.sub(r"\s+", " ", str(query)).strip().rstrip("?!.").strip().lower()
+
+
+class QueryCacheController:
+    """
+    In-memory cache of hybrid retrieval results with two tiers: exact match on the normalized
+    query, then near-duplicates whose query embedding has a cosine similarity above
+    `similarity_threshold`. Entries are scoped by endpoint, index names and top_k, expire after
+    `ttl_seconds`, are evicted LRU beyond `max_entries` and are dropped when an ingestion writes
+    to one of their indexes.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=600, similarity_threshold=0.97):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+
+        # (scope, normalized query) -> entry, oldest access first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Incremented by every invalidation, so results computed before it are not stored
+        self.generation = 0
+        self._stats = {'exact_hits': 0, 'similar_hits': 0, 'misses': 0, 'invalidated': 0, 'evicted': 0}
+
+    def _expired(self, entry, now):
+        return now - entry['created'] > self.ttl_seconds
+
+    def get(self, scope, query):
+        key = (scope, normalize_query(query))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry, now):
+                if entry is not None:
+                    del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats['exact_hits'] += 1
+            return entry['value']
+
+    def record_miss(self):
+        # Miss of a lookup without the near-duplicate tier (get_similar counts its own)
+        with self._lock:
+            self._stats['misses'] += 1
+
+    def get_similar(self, scope, query_embedding):
+        # Counts a miss when nothing is close enough, so call it after get()
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query_embedding)
+        now = time.time()
+
+        with self._lock:
+            candidates = [
+                (key, entry) for key, entry in self._entries.items()
+                if key[0] == scope and entry['embedding'] is not None and not self._expired(entry, now)
+                and len(entry['embedding']) == len(query_embedding)
+            ]
+            if not candidates or query_norm == 0:
+                self._stats['misses'] += 1
+                return None
+
+            embeddings = np.stack([entry['embedding'] for _, entry in candidates])
+            similarities = embeddings @ (query_embedding / query_norm)
+            best = int(np.argmax(similarities))
+
+            if similarities[best] < self.similarity_threshold:
+                self._stats['misses'] += 1
+                return None
+
+            key, entry = candidates[best]
+            self._entries.move_to_end(key)
+            self._stats['similar_hits'] += 1
+            return entry['value']
+
+    def set(self, scope, query, value, index_names=(), query_embedding=None, generation=None):
+        embedding = None
+        if query_embedding is not None:
+            embedding = np.asarray(query_embedding, dtype=np.float32)
+            norm = np.linalg.norm(embedding)
+            embedding = embedding / norm if norm > 0 else None
+
+        with self._lock:
+            # An ingestion wrote to the indexes while this result was being computed
+            if generation is not None and generation != self.generation:
+                return
+
+            key = (scope, normalize_query(query))
+            self._entries[key] = {
+                'value': value,
+                'embedding': embedding,
+                'index_names': {name for name in index_names if name},
+                'created': time.time()
+            }
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evicted'] += 1
+
+    def invalidate(self, index_names):
+        index_names = {name for name in index_names if name}
+        with self._lock:
+            self.generation += 1
+            stale = [key for key, entry in self._entries.items() if entry['index_names'] & index_names]
+            for key in stale:
+                del self._entries[key]
+            self._stats['invalidated'] += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['exact_hits'] + self._stats['similar_hits'] + self._stats['misses']
+            hits = self._stats['exact_hits'] + self._stats['similar_hits']
+            return {
+                **self._stats,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hit_rate': hits / lookups if lookups else 0.0
+            }
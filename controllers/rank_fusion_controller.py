@@ -1,75 +1,159 @@
-from collections import defaultdict
-from typing import List, Dict, Any
+import heapq
+import numpy as np
+from typing import List, Dict, Any, Optional
+
+from controllers.segment_index_controller import top_k_positions
 
 class RankFusionController:
-    def __init__(self, k: float = 60.0):
+    """
+    Fuses any number of ranked lists (e.g. Pinecone, TF-IDF, BM25) into one.
+
+    Items are matched by `key` ("id", or "text" for indexes whose retrievers don't share chunk ids)
+    and scored with numpy over a (lists x unique items) matrix:
+    - "rrf": sum of weight / (k + rank), ranks starting at 1
+    - "combsum": sum of weight * min-max normalized score
+    - "combmnz": combsum multiplied by the number of lists that retrieved the item
+    - "zscore": sum of weight * z-score normalized score
+    An item missing from a list counts as that list's worst score (0 after min-max normalization).
+    """
+
+    methods = ("rrf", "combsum", "combmnz", "zscore")
+
+    def __init__(self, k: float = 60.0, method: str = "rrf", key: str = "id"):
+        if method not in self.methods:
+            raise ValueError(f"Unknown fusion method {method!r}, expected one of {', '.join(self.methods)}")
         self.k = k
+        self.method = method
+        self.key = key
+
+    def _item_key(self, item):
+        # Chunk ids are only unique inside a collection
+        value = item.get(self.key)
+        if value is None:
+            value = item['text']
+        return (item.get('namespace'), value)
 
-    def reciprocal_rank_fusion(self, rankings: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]: 
-        fusion_scores = {}
+    def fuse(self, rankings: List[List[Dict[str, Any]]], weights: Optional[List[float]] = None,
+             top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        weights = np.ones(len(rankings)) if weights is None else np.asarray(weights, dtype=np.float64)
+        if len(weights) != len(rankings):
+            raise ValueError(f"Got {len(weights)} weights for {len(rankings)} ranked lists")
 
+        # Column of every unique item, first occurrence kept as its representative
+        columns, items = {}, []
+        list_columns = []
         for rank_list in rankings:
+            positions = np.empty(len(rank_list), dtype=np.int64)
             for position, item in enumerate(rank_list):
-                item_text = item['text']
-
-                # RRF formula: 1 / (k + r) where r is the rank position
-                score = 1.0 / (self.k + position)
-
-                if item_text in fusion_scores:
-                    fusion_scores[item_text]['rrf_score'] += score
-                    # Keep track of original scores and metadata
-                    fusion_scores[item_text]['sources'].append({
-                        'score': item.get('score', 0.0),
-                        'metadata': {'text': item.get('text', '')}
-                    })
-                else:
-                    fusion_scores[item_text] = {
-                        'rrf_score': score,
-                        'sources': [{
-                            'score': item.get('score', 0.0),
-                            'metadata': {'text': item.get('text', '')}
-                        }]
-                    }
-
-        # Create final ranked list
-        ranked_results = []
-
-        for item_text, data in fusion_scores.items():
-            combined_metadata = defaultdict(list)
-            for source in data['sources']:
-                for key, value in source['metadata'].items():
-                    combined_metadata[key].append(value)
-            
-            ranked_results.append({
-                'text': item_text,
-                'rrf_score': data['rrf_score'],
-                'original_scores': [source['score'] for source in data['sources']],
-                'metadata': combined_metadata
-            })
-        
-        ranked_results.sort(key=lambda x: x['rrf_score'], reverse=True)
-        return ranked_results
-    
+                key = self._item_key(item)
+                column = columns.get(key)
+                if column is None:
+                    column = columns[key] = len(items)
+                    items.append(item)
+                positions[position] = column
+            list_columns.append(positions)
+
+        if not items:
+            return []
+
+        n_lists, n_items = len(rankings), len(items)
+        present = np.zeros((n_lists, n_items), dtype=bool)
+        raw_scores = np.full((n_lists, n_items), np.nan)
+        scores = np.zeros((n_lists, n_items), dtype=np.float64)
+        for row, (rank_list, positions) in enumerate(zip(rankings, list_columns)):
+            if not len(positions):
+                continue
+            list_scores = np.fromiter((item.get('score', 0.0) for item in rank_list), dtype=np.float64, count=len(rank_list))
+            # An item listed twice keeps its best rank
+            unique_columns, first_positions = np.unique(positions, return_index=True)
+            present[row, unique_columns] = True
+            raw_scores[row, unique_columns] = list_scores[first_positions]
+
+            if self.method == "rrf":
+                scores[row, unique_columns] = 1.0 / (self.k + first_positions + 1)
+            else:
+                normalized = self._normalize(list_scores)
+                if self.method == "zscore":
+                    scores[row] = normalized.min()
+                scores[row, unique_columns] = normalized[first_positions]
+
+        fused = weights @ scores
+        if self.method == "combmnz":
+            fused = fused * present.sum(axis=0)
+
+        results = []
+        for column in top_k_positions(fused, min(top_k or n_items, n_items)):
+            item = items[column]
+            result = {
+                'id': item.get('id'),
+                'text': item['text'],
+                'fusion_score': float(fused[column]),
+                'original_scores': raw_scores[present[:, column], column].tolist()
+            }
+            if item.get('namespace') is not None:
+                result['namespace'] = item['namespace']
+            results.append(result)
+        return results
+
+    def _normalize(self, scores):
+        if not len(scores):
+            return scores
+        if self.method == "zscore":
+            std = scores.std()
+            return (scores - scores.mean()) / std if std > 0 else np.zeros_like(scores)
+        low, high = scores.min(), scores.max()
+        return (scores - low) / (high - low) if high > low else np.ones_like(scores)
+
+    def reciprocal_rank_fusion(self, rankings: List[List[Dict[str, Any]]], weights: Optional[List[float]] = None,
+                               top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        results = RankFusionController(k=self.k, method="rrf", key=self.key).fuse(rankings, weights, top_k)
+        for result in results:
+            result['rrf_score'] = result['fusion_score']
+        return results
+
+
+def merge_collection_results(result_lists: List[List[Dict]], top_k: int, method: str = "rrf", k: float = 60.0) -> List[Dict]:
+    """Merges the results of one retriever over several collections (namespaces / shards)"""
+    if len(result_lists) == 1:
+        return result_lists[0][:top_k]
+
+    if method == "score":
+        # Only comparable when the collections score the same way (e.g. cosine similarity)
+        merged = [item for results in result_lists for item in results]
+        return heapq.nlargest(top_k, merged, key=lambda item: item['score'])
+
+    if method == "rrf":
+        ranked = [(1.0 / (k + rank), item) for results in result_lists for rank, item in enumerate(results, start=1)]
+        return [item for _, item in heapq.nlargest(top_k, ranked, key=lambda pair: pair[0])]
+
+    raise ValueError(f"Unknown merge method {method!r}, expected 'rrf' or 'score'")
+
+
+def _with_namespace(formatted: Dict, result: Dict) -> Dict:
+    # Results of a fan-out over collections keep the collection they come from
+    if result.get('namespace') is not None:
+        formatted['namespace'] = result['namespace']
+    return formatted
 
 def format_pinecone_results(pinecone_results: List[Dict]) -> List[Dict]:
     """Format Pinecone results to standard format"""
     return [
-        {
+        _with_namespace({
             'id': result['id'],
             'score': result['score'],
-            'text': result['metadata']['text']
-        }
+            # Vectors stored without text (chunk store) have no metadata
+            'text': (result.get('metadata') or {}).get('text')
+        }, result)
         for result in pinecone_results
     ]
 
 def format_tfidf_results(tfidf_results: List[tuple]) -> List[Dict]:
     """Format TF-IDF results to standard format"""
     return [
-        {
+        _with_namespace({
             'id': result['id'],
             'score': result['score'],
             'text': result['text']
-        }
+        }, result)
         for result in tfidf_results
     ]
-        
\ No newline at end of file
@@ -0,0 +1,274 @@
+import os
+import re
+import time
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from controllers.llm_controller import LLMController
+from controllers.embedding_controller import EmbedingController
+from controllers.custom_rerank_controller import CustomRerankController
+from controllers.local_vector_controller import LocalVectorController
+from controllers.metrics_controller import MetricsController
+from controllers.chunk_store_controller import chunk_index_refs
+from controllers.document_processing_controller import PineconeController, TFIDFController, BM25Controller
+
+
+def namespace_index_name(index_name, namespace):
+    # Local shard of a collection: "data/tfidf.pkl" + "acme" -> "data/tfidf.namespaces/acme/tfidf.pkl".
+    # The namespace is a directory of its own, the index controllers strip the extension of the file
+    # name with splitext and would cut "a.b" down to "a" for index names without one
+    if not namespace:
+        return index_name
+    if not re.fullmatch(r"[A-Za-z0-9_-][A-Za-z0-9_.-]*", namespace):
+        raise ValueError(f"Invalid namespace {namespace!r}: only letters, digits, '_', '-' and '.' are allowed")
+    root = os.path.splitext(index_name)[0]
+    return os.path.join(root + ".namespaces", namespace, os.path.basename(index_name))
+
+
+class ControllerRegistry:
+    """Process-wide cache of controllers so requests share network clients, indexes and models."""
+
+    def __init__(self, pinecone_api_key=None, embedding_batch_size=32, llm_concurrency=4, content_cache=None,
+                 llm_keep_alive="30m", llm_num_ctx=8192, request_threads=32, query_cache=None,
+                 vector_store="pinecone", local_vector_dir=".vectors", local_vector_nprobe=16,
+                 pinecone_upsert_batch_size=100, pinecone_upsert_threads=4,
+                 rerank_candidates=50, rerank_batch_size=32, rerank_max_chars=2048, rerank_cache_size=10000,
+                 metrics=None, chunk_store=None, vector_dimension=None, local_vector_precision="float32", local_vector_rescore=4,
+                 batch_max_queries=256, batch_max_concurrency=64):
+        self.pinecone_api_key = pinecone_api_key
+        self.pinecone_upsert_batch_size = pinecone_upsert_batch_size
+        self.pinecone_upsert_threads = pinecone_upsert_threads
+        # Fused candidates scored by the reranker before the top_k are kept (see routes/chat_routes.py)
+        self.rerank_candidates = rerank_candidates
+        self.rerank_batch_size = rerank_batch_size
+        self.rerank_max_chars = rerank_max_chars
+        self.rerank_cache_size = rerank_cache_size
+        # Questions accepted by one /retrieve/batch request, and the concurrency it may ask for
+        self.batch_max_queries = batch_max_queries
+        self.batch_max_concurrency = batch_max_concurrency
+        # Backend of get_vector_store: "pinecone" or "local" (LocalVectorController under local_vector_dir)
+        self.vector_store = vector_store
+        self.local_vector_dir = local_vector_dir
+        self.local_vector_nprobe = local_vector_nprobe
+        # Stored embeddings: leading dimensions kept (None = all, see truncate_embeddings), precision of
+        # the local vectors scanned by queries and candidates per result rescored at full precision
+        self.vector_dimension = vector_dimension
+        self.local_vector_precision = local_vector_precision
+        self.local_vector_rescore = local_vector_rescore
+        self.llm_keep_alive = llm_keep_alive
+        self.llm_num_ctx = llm_num_ctx
+        self.content_cache = content_cache
+        # Optional QueryCacheController shared by the retrieval routes and invalidated by ingestion
+        self.query_cache = query_cache
+        # Stage timings of the routes and ingestion pipelines, exposed by GET /metrics
+        self.metrics = metrics or MetricsController()
+        # Optional ChunkStoreController: chunk texts written by ingestion and read for the final results
+        self.chunk_store = chunk_store
+        self.embedding_batch_size = embedding_batch_size
+        self.llm_concurrency = llm_concurrency
+        self._controllers = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+        # Blocking work of the request handlers (Ollama, Pinecone, index queries) runs here so the
+        # event loop keeps serving other requests
+        self.request_threads = request_threads
+        self.executor = ThreadPoolExecutor(max_workers=request_threads, thread_name_prefix="request")
+
+    def _record(self, kind, hit, load_time=0.0):
+        with self._lock:
+            stats = self._stats.setdefault(kind, {'hits': 0, 'misses': 0, 'load_time_seconds': 0.0, 'loaded': 0})
+            if hit:
+                stats['hits'] += 1
+            else:
+                stats['misses'] += 1
+                stats['load_time_seconds'] += load_time
+                stats['loaded'] += 1
+
+    def _get_or_create(self, kind, key, factory):
+        cache_key = (kind, key)
+        controller = self._controllers.get(cache_key)
+        if controller is not None:
+            self._record(kind, hit=True)
+            return controller
+
+        # One lock per key so a slow load (e.g. the reranker model) doesn't block unrelated lookups
+        with self._lock:
+            key_lock = self._key_locks.setdefault(cache_key, threading.Lock())
+
+        with key_lock:
+            controller = self._controllers.get(cache_key)
+            if controller is not None:
+                self._record(kind, hit=True)
+                return controller
+
+            start = time.perf_counter()
+            controller = factory()
+            self._controllers[cache_key] = controller
+            self._record(kind, hit=False, load_time=time.perf_counter() - start)
+
+        return controller
+
+    def get_embedding(self, model_name):
+        return self._get_or_create(
+            'embedding', model_name,
+            lambda: EmbedingController(model_name=model_name, batch_size=self.embedding_batch_size, cache=self.content_cache)
+        )
+
+    def get_llm(self, model_name):
+        return self._get_or_create(
+            'llm', model_name,
+            lambda: LLMController(
+                model_name=model_name,
+                cache=self.content_cache,
+                keep_alive=self.llm_keep_alive,
+                num_ctx=self.llm_num_ctx
+            )
+        )
+
+    def get_pinecone(self, index_name):
+        return self._get_or_create(
+            'pinecone', index_name,
+            lambda: PineconeController(
+                pinecone_api_key=self.pinecone_api_key, index_name=index_name,
+                upsert_batch_size=self.pinecone_upsert_batch_size, upsert_threads=self.pinecone_upsert_threads,
+                dimension=self.vector_dimension or 768
+            )
+        )
+
+    def get_pinecone_namespace(self, index_name, namespace):
+        return self._get_or_create(
+            'pinecone_namespace', (index_name, namespace),
+            lambda: self.get_pinecone(index_name).with_namespace(namespace)
+        )
+
+    def get_local_vectors(self, index_name, namespace=None):
+        shard_name = namespace_index_name(index_name, namespace)
+        return self._get_or_create(
+            'local_vectors', shard_name,
+            lambda: LocalVectorController(
+                os.path.join(self.local_vector_dir, shard_name), nprobe=self.local_vector_nprobe,
+                precision=self.local_vector_precision, dimension=self.vector_dimension, rescore=self.local_vector_rescore
+            )
+        )
+
+    def get_vector_store(self, index_name, namespace=None):
+        # Collections are Pinecone namespaces of one index, or shard directories of the local index
+        if self.vector_store == "local":
+            return self.get_local_vectors(index_name, namespace)
+        if namespace:
+            return self.get_pinecone_namespace(index_name, namespace)
+        return self.get_pinecone(index_name)
+
+    def get_tfidf(self, index_name, namespace=None):
+        shard_name = namespace_index_name(index_name, namespace)
+        return self._get_or_create('tfidf', shard_name, lambda: TFIDFController(shard_name))
+
+    def get_bm25(self, index_name, namespace=None):
+        shard_name = namespace_index_name(index_name, namespace)
+        return self._get_or_create('bm25', shard_name, lambda: BM25Controller(shard_name))
+
+    def get_chunk_store(self, namespace=None, pinecone_index_name=None, tfidf_index_name=None, bm25_index_name=None):
+        # Scoped to the collection and to the indexes written or deleted from, which keep their chunks referenced
+        if self.chunk_store is None:
+            return None
+        return self.chunk_store.with_namespace(namespace).with_indexes(
+            chunk_index_refs(self.vector_store, pinecone_index_name, tfidf_index_name, bm25_index_name)
+        )
+
+    def get_reranker(self, model_name='flashrank', language_code='en'):
+        return self._get_or_create(
+            'reranker', (model_name, language_code),
+            lambda: CustomRerankController(
+                model_name=model_name, language_code=language_code, batch_size=self.rerank_batch_size,
+                max_chars=self.rerank_max_chars, cache_size=self.rerank_cache_size
+            )
+        )
+
+    async def run_blocking(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # The request's context (e.g. its timing breakdown) follows the call into the thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, functools.partial(context.run, func, *args, **kwargs))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def evict(self, kind, key):
+        with self._lock:
+            return self._controllers.pop((kind, key), None) is not None
+
+    def warm(self, pinecone_index_names=(), tfidf_index_names=(), bm25_index_names=(), embedding_models=(), llm_models=(), reranker_models=()):
+        for index_name in pinecone_index_names:
+            vector_admin = self.get_vector_store(index_name)
+            if isinstance(vector_admin, LocalVectorController):
+                vector_admin.warm()
+
+        for index_name in tfidf_index_names:
+            self.get_tfidf(index_name).warm()
+
+        for index_name in bm25_index_names:
+            self.get_bm25(index_name).warm()
+
+        for model_name in embedding_models:
+            self.get_embedding(model_name)
+
+        for model_name in llm_models:
+            self.get_llm(model_name)
+
+        for model_name, language_code in reranker_models:
+            self.get_reranker(model_name, language_code)
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'controllers': [{'kind': kind, 'key': key} for kind, key in self._controllers],
+                'counters': {kind: dict(stats) for kind, stats in self._stats.items()}
+            }
+            rerankers = [(key, controller) for (kind, key), controller in self._controllers.items() if kind == 'reranker']
+
+        if rerankers:
+            stats['rerankers'] = [{'key': key, **reranker.stats()} for key, reranker in rerankers]
+
+        if self.content_cache:
+            stats['content_cache'] = self.content_cache.stats()
+
+        if self.query_cache:
+            stats['query_cache'] = self.query_cache.stats()
+
+        if self.chunk_store:
+            stats['chunk_store'] = self.chunk_store.stats()
+
+        return stats
+
+    def metric_counters(self):
+        # Cache and controller counters in the (name, help, labels, value) form of MetricsController.render
+        stats = self.stats()
+        counters = []
+        for kind, values in stats['counters'].items():
+            counters.append(('rag_controller_cache_hits_total', "Controller registry lookups served from memory", {'kind': kind}, values['hits']))
+            counters.append(('rag_controller_cache_misses_total', "Controller registry lookups that loaded a controller", {'kind': kind}, values['misses']))
+
+        for reranker in stats.get('rerankers', []):
+            model_name, language_code = reranker['key']
+            labels = {'model': model_name, 'lang': language_code}
+            counters.append(('rag_rerank_scores_total', "Chunks scored by the reranker", labels, reranker['scored']))
+            counters.append(('rag_rerank_cache_hits_total', "Reranker scores served from the score cache", labels, reranker['cache_hits']))
+
+        if 'content_cache' in stats:
+            for namespace, values in stats['content_cache']['namespaces'].items():
+                counters.append(('rag_content_cache_hits_total', "Chunk contexts and embeddings read from the content cache", {'namespace': namespace}, values['hits']))
+                counters.append(('rag_content_cache_misses_total', "Chunk contexts and embeddings missing from the content cache", {'namespace': namespace}, values['misses']))
+
+        if 'query_cache' in stats:
+            query_stats = stats['query_cache']
+            for result in ('exact_hits', 'similar_hits', 'misses'):
+                counters.append(('rag_query_cache_lookups_total', "Query cache lookups by result", {'result': result}, query_stats[result]))
+            counters.append(('rag_query_cache_invalidated_total', "Query cache entries dropped by ingestion", {}, query_stats['invalidated']))
+            counters.append(('rag_query_cache_evicted_total', "Query cache entries evicted", {}, query_stats['evicted']))
+
+        return counters
@@ -0,0 +1,728 @@
+import os
+import json
+import mmap
+import shutil
+import bisect
+import threading
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+
+class SegmentIndexController:
+    """
+    Append-only lexical index made of segments.
+
+    Every ingestion writes a new segment holding the raw term counts of its chunks (keyed by
+    global term ids) and the chunk texts. The vocabulary only grows (terms.txt) and global
+    document frequencies are kept as counters (df.npy), so term weights are applied at query
+    time and adding a document costs O(that document). Once there are `merge_threshold`
+    segments a background thread compacts them into one.
+
+    Chunks can carry an id (see make_chunk_id): deleting ids appends their global positions to the
+    tombstone file and queries skip them. Merges drop the deleted chunks (and their share of the
+    document frequencies and lengths) and renumber the positions after them.
+
+    Subclasses decide how a segment is weighted (`_write_segment_weights`) and how a query is scored:
+    the weight of every query term (`_query_term_weights`) times the `postings_values` of its
+    postings, summed per chunk and scaled by `_scale_scores`.
+    """
+
+    index_suffix = '.index'
+    merge_threshold = 8
+    # Share of deleted chunks after which a merge is scheduled to drop them
+    compact_ratio = 0.2
+    # Per-posting values multiplied by the query term weights
+    postings_values = 'post_tf'
+
+    def __init__(self, index_name, merge_threshold=None):
+        self.index_name = index_name
+        self.index_dir = os.path.splitext(index_name)[0] + self.index_suffix
+        if merge_threshold is not None:
+            self.merge_threshold = merge_threshold
+
+        # Same tokenization as sklearn's TfidfVectorizer defaults
+        self.analyzer = CountVectorizer().build_analyzer()
+
+        self._vocabulary = None
+        self._terms_offset = 0
+        self._index_data = None
+        self._index_version = None
+        self._open_segments = {}
+        self._merge_thread = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.RLock()
+
+    # === STORAGE HELPERS ===
+    def _path(self, *parts):
+        return os.path.join(self.index_dir, *parts)
+
+    def _write_array(self, path, array):
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, array)
+        os.replace(path + '.tmp', path)
+
+    def _read_meta(self):
+        if not os.path.exists(self._path('meta.json')):
+            return {'version': 0, 'segments': [], 'n_chunks': 0, 'n_terms': 0, 'total_length': 0, 'next_segment': 1, 'n_deleted': 0}
+
+        with open(self._path('meta.json')) as f:
+            return json.load(f)
+
+    def _write_meta(self, meta):
+        # The manifest is always written last so readers never see a half written segment
+        meta['version'] += 1
+        with open(self._path('meta.json.tmp'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(self._path('meta.json.tmp'), self._path('meta.json'))
+
+    def _deleted_path(self, meta):
+        # Tombstone file of the manifest (a merge writes a new one for the positions it renumbers)
+        return self._path(meta.get('deleted_file', 'deleted.i64'))
+
+    def _read_deleted(self, meta):
+        if not meta.get('n_deleted'):
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.fromfile(self._deleted_path(meta), dtype=np.int64, count=meta['n_deleted']))
+
+    def index_exists(self):
+        return os.path.exists(self._path('meta.json')) or self._legacy_chunks_available()
+
+    # === LEGACY FORMATS ===
+    def _legacy_chunks_available(self):
+        return False
+
+    def _legacy_chunks(self):
+        return None
+
+    def _migrate_legacy_index(self):
+        if os.path.exists(self._path('meta.json')) and 'segments' in self._read_meta():
+            return
+
+        if not self._legacy_chunks_available():
+            return
+
+        with self._write_lock:
+            if os.path.exists(self._path('meta.json')) and 'segments' in self._read_meta():
+                return
+
+            chunks = self._legacy_chunks()
+            print(f"Migrating index {self.index_name} to {self.index_dir}")
+            self._add_segment(chunks)
+
+    # === VOCABULARY AND STATISTICS ===
+    def load_vocabulary(self):
+        # terms.txt is append-only (one term per line, line number = term id), so only the new tail is read
+        with self._lock:
+            if self._vocabulary is None:
+                self._vocabulary = {}
+                self._terms_offset = 0
+
+            terms_path = self._path('terms.txt')
+            if os.path.exists(terms_path) and os.path.getsize(terms_path) > self._terms_offset:
+                with open(terms_path, 'rb') as f:
+                    f.seek(self._terms_offset)
+                    for line in f:
+                        self._vocabulary[line.decode('utf-8').rstrip('\n')] = len(self._vocabulary)
+                    self._terms_offset = f.tell()
+
+            return self._vocabulary
+
+    def collection_stats(self, index_data):
+        n_chunks = index_data['n_chunks']
+        return {
+            'n_chunks': n_chunks,
+            'df': index_data['df'],
+            'avg_length': index_data['total_length'] / n_chunks if n_chunks else 0.0
+        }
+
+    def query_terms(self, query, vocabulary):
+        counts = Counter(term for term in self.analyzer(query) if term in vocabulary)
+        term_ids = np.fromiter((vocabulary[term] for term in counts), dtype=np.int64, count=len(counts))
+        term_counts = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        return term_ids, term_counts
+
+    # === WRITE PATH ===
+    def _tokenize_chunks(self, chunks):
+        try:
+            count_vectorizer = CountVectorizer()
+            local_counts = count_vectorizer.fit_transform(chunks)
+            local_terms = count_vectorizer.get_feature_names_out()
+        except ValueError:
+            # Only stop words / empty chunks
+            local_counts = sparse.csr_matrix((len(chunks), 0), dtype=np.int64)
+            local_terms = []
+
+        return local_counts, local_terms
+
+    def _count_terms(self, chunks, vocabulary, local_counts=None, local_terms=None):
+        if local_counts is None:
+            local_counts, local_terms = self._tokenize_chunks(chunks)
+
+        # File and in-memory vocabulary are extended together so a concurrent reload can't assign ids twice
+        with self._lock:
+            new_terms = [term for term in local_terms if term not in vocabulary]
+            if new_terms:
+                with open(self._path('terms.txt'), 'ab') as f:
+                    f.write(''.join(f"{term}\n" for term in new_terms).encode('utf-8'))
+                    self._terms_offset = f.tell()
+                for term in new_terms:
+                    vocabulary[term] = len(vocabulary)
+
+        global_ids = np.fromiter((vocabulary[term] for term in local_terms), dtype=np.int32, count=len(local_terms))
+        counts = sparse.csr_matrix(
+            (local_counts.data.astype(np.float32), global_ids[local_counts.indices], local_counts.indptr),
+            shape=(len(chunks), len(vocabulary))
+        )
+        counts.sort_indices()
+        return counts
+
+    def _write_segment(self, segment_name, counts, chunks_path_or_texts, stats, chunk_ids=None):
+        segment_dir = self._path('segments', segment_name)
+        os.makedirs(segment_dir, exist_ok=True)
+
+        # One id per line, empty for chunks indexed without one
+        with open(os.path.join(segment_dir, 'ids.txt'), 'w', encoding='utf-8') as f:
+            f.write(''.join(f"{chunk_id or ''}\n" for chunk_id in (chunk_ids or [None] * counts.shape[0])))
+
+        if isinstance(chunks_path_or_texts, list):
+            encoded_chunks = [chunk.encode('utf-8') for chunk in chunks_path_or_texts]
+            lengths = np.fromiter((len(chunk) for chunk in encoded_chunks), dtype=np.int64, count=len(encoded_chunks))
+            with open(os.path.join(segment_dir, 'chunks.bin'), 'wb') as f:
+                f.write(b''.join(encoded_chunks))
+            offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        else:
+            # Chunks of other segments (merge): ([(source file, start byte, end byte), ...], offsets)
+            byte_ranges, offsets = chunks_path_or_texts
+            with open(os.path.join(segment_dir, 'chunks.bin'), 'wb') as out_file:
+                for source_file, start, end in byte_ranges:
+                    with open(source_file, 'rb') as in_file:
+                        in_file.seek(start)
+                        remaining = end - start
+                        while remaining:
+                            block = in_file.read(min(remaining, 1 << 20))
+                            out_file.write(block)
+                            remaining -= len(block)
+
+        self._write_array(os.path.join(segment_dir, 'offsets.npy'), offsets)
+        # scipy copies mixed index dtypes, keep indices and indptr on the same one so the mmap is reused
+        index_dtype = np.int32 if counts.nnz < np.iinfo(np.int32).max else np.int64
+        self._write_array(os.path.join(segment_dir, 'tf_data.npy'), counts.data.astype(np.float32))
+        self._write_array(os.path.join(segment_dir, 'tf_indices.npy'), counts.indices.astype(index_dtype))
+        self._write_array(os.path.join(segment_dir, 'tf_indptr.npy'), counts.indptr.astype(index_dtype))
+
+        # Inverted index (CSC transpose of the counts) so queries only touch the postings of their terms
+        postings = self._write_postings(segment_dir, counts)
+
+        doc_lengths = np.asarray(counts.sum(axis=1)).ravel().astype(np.float32)
+        self._write_array(os.path.join(segment_dir, 'doc_lengths.npy'), doc_lengths)
+        self._write_segment_weights(segment_dir, counts, postings, doc_lengths, stats)
+
+        return float(doc_lengths.sum())
+
+    def _write_postings(self, segment_dir, counts):
+        postings = counts.tocsc()
+        postings.sort_indices()
+        self._write_array(os.path.join(segment_dir, 'post_indptr.npy'), postings.indptr.astype(np.int64))
+        self._write_array(os.path.join(segment_dir, 'post_docs.npy'), postings.indices.astype(np.int32))
+        self._write_array(os.path.join(segment_dir, 'post_tf.npy'), postings.data.astype(np.float32))
+        return postings
+
+    def _add_segment(self, chunks, local_counts=None, local_terms=None, chunk_ids=None, store_text=True, replaced_ids=None):
+        # replaced_ids: previous chunks deleted by the same manifest commit as the new segment
+        with self._write_lock:
+            os.makedirs(self._path('segments'), exist_ok=True)
+            meta = self._read_meta()
+            if replaced_ids is not None:
+                self._append_tombstones(meta, replaced_ids)
+            vocabulary = self.load_vocabulary()
+
+            counts = self._count_terms(chunks, vocabulary, local_counts, local_terms)
+
+            # Global document frequencies (each row holds a term at most once)
+            df = self._load_df(len(vocabulary))
+            df += np.bincount(counts.indices, minlength=len(vocabulary))
+
+            total_length = meta['total_length'] + float(counts.sum())
+            n_chunks = meta['n_chunks'] + len(chunks)
+            stats = {'n_chunks': n_chunks, 'df': df, 'avg_length': total_length / n_chunks if n_chunks else 0.0}
+
+            segment_name = f"seg_{meta['next_segment']:06d}"
+            # Chunks whose text is in the chunk store are written empty (get_chunk returns '')
+            self._write_segment(segment_name, counts, chunks if store_text else [''] * len(chunks), stats, chunk_ids)
+            self._write_array(self._path('df.npy'), df)
+
+            meta['segments'].append({'name': segment_name, 'n_chunks': len(chunks), 'n_terms': len(vocabulary)})
+            meta['next_segment'] += 1
+            meta['n_chunks'] = n_chunks
+            meta['n_terms'] = len(vocabulary)
+            meta['total_length'] = total_length
+            self._write_meta(meta)
+
+        if len(meta['segments']) >= self.merge_threshold or (meta.get('n_deleted') and meta['n_deleted'] >= self.compact_ratio * meta['n_chunks']):
+            self.schedule_merge()
+
+    def _load_df(self, n_terms):
+        df = np.zeros(n_terms, dtype=np.int64)
+        if os.path.exists(self._path('df.npy')):
+            stored_df = np.load(self._path('df.npy'))
+            df[:len(stored_df)] = stored_df
+        return df
+
+    def add_chunks(self, chunks, chunk_ids=None, store_text=True):
+        if not chunks:
+            return
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        self._migrate_legacy_index()
+        # Ids added again replace their previous chunk, in the same manifest commit so no reader
+        # (or crash) sees the old chunks deleted without the new ones
+        self._add_segment(chunks, chunk_ids=chunk_ids, store_text=store_text, replaced_ids=chunk_ids)
+
+    def _append_tombstones(self, meta, chunk_ids):
+        # Marks the stored chunks of `chunk_ids` deleted in `meta` (written by the caller), returns how many
+        if not self.index_exists():
+            return 0
+
+        positions = self.chunk_positions(self.load_index())
+        deleted = np.array(sorted({positions[chunk_id] for chunk_id in chunk_ids if chunk_id in positions}), dtype=np.int64)
+        if not len(deleted):
+            return 0
+
+        deleted_path = self._deleted_path(meta)
+        with open(deleted_path, 'r+b' if os.path.exists(deleted_path) else 'wb') as f:
+            # Whatever a failed write appended after the manifest is overwritten
+            f.seek(meta.get('n_deleted', 0) * 8)
+            f.write(deleted.tobytes())
+            f.truncate()
+        meta['n_deleted'] = meta.get('n_deleted', 0) + len(deleted)
+        return len(deleted)
+
+    def delete_ids(self, chunk_ids):
+        # Returns the number of chunks deleted
+        if not self.index_exists():
+            return 0
+
+        with self._write_lock:
+            meta = self._read_meta()
+            deleted = self._append_tombstones(meta, chunk_ids)
+            if deleted:
+                self._write_meta(meta)
+
+        if deleted and meta['n_deleted'] >= self.compact_ratio * meta['n_chunks']:
+            self.schedule_merge()
+        return deleted
+
+    def add_counted_chunks(self, chunks, local_counts, local_terms):
+        # Same as add_chunks for chunks already tokenized elsewhere (CSR counts over `local_terms`)
+        if not chunks:
+            return
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        self._migrate_legacy_index()
+        self._add_segment(chunks, local_counts, local_terms)
+
+    # === BACKGROUND MERGE ===
+    def schedule_merge(self):
+        with self._lock:
+            if self._merge_thread is not None and self._merge_thread.is_alive():
+                return
+            self._merge_thread = threading.Thread(target=self.merge_segments, daemon=True)
+            self._merge_thread.start()
+
+    def merge_segments(self):
+        # Reserve the merged segment name and snapshot what is merged, then build it without blocking ingestion
+        with self._write_lock:
+            meta = self._read_meta()
+            merged_infos = list(meta['segments'])
+            if not merged_infos or (len(merged_infos) < 2 and not meta.get('n_deleted')):
+                return
+
+            merged_name = f"seg_{meta['next_segment']:06d}"
+            meta['next_segment'] += 1
+            self._write_meta(meta)
+
+            index_data = self.load_index()
+            n_terms = meta['n_terms']
+
+        try:
+            segments = [self._open_segment(info) for info in merged_infos]
+            counts = sparse.vstack([
+                sparse.csr_matrix(
+                    (np.asarray(s['tf'].data), np.asarray(s['tf'].indices), np.asarray(s['tf'].indptr)),
+                    shape=(s['n_chunks'], n_terms)
+                )
+                for s in segments
+            ], format='csr')
+
+            # Deleted chunks are dropped, with their document frequencies and lengths
+            dropped = index_data['deleted'][index_data['deleted'] < counts.shape[0]]
+            kept = np.ones(counts.shape[0], dtype=bool)
+            kept[dropped] = False
+            dropped_counts = counts[dropped]
+            dropped_df = np.bincount(dropped_counts.indices, minlength=n_terms)
+            dropped_length = float(dropped_counts.sum())
+            counts = counts[kept]
+
+            stats = self.collection_stats(index_data)
+            n_chunks = stats['n_chunks'] - len(dropped)
+            df = np.asarray(stats['df'], dtype=np.int64) - dropped_df
+            stats = {
+                'n_chunks': n_chunks,
+                'df': df,
+                'avg_length': (index_data['total_length'] - dropped_length) / n_chunks if n_chunks else 0.0
+            }
+
+            # Byte ranges of the kept chunk texts, consecutive chunks of a segment copied at once
+            ranges, lengths, chunk_ids, base = [], [], [], 0
+            for info, s in zip(merged_infos, segments):
+                segment_kept = np.flatnonzero(kept[base:base + s['n_chunks']])
+                base += s['n_chunks']
+                offsets = np.asarray(s['offsets'])
+                lengths.append(offsets[segment_kept + 1] - offsets[segment_kept])
+                chunk_ids.extend(s['ids'][idx] for idx in segment_kept)
+                chunk_file = self._path('segments', info['name'], 'chunks.bin')
+                for run in np.split(segment_kept, np.flatnonzero(np.diff(segment_kept) != 1) + 1):
+                    if len(run):
+                        ranges.append((chunk_file, int(offsets[run[0]]), int(offsets[run[-1] + 1])))
+            offsets = np.concatenate([[0], np.cumsum(np.concatenate(lengths))]).astype(np.int64)
+
+            self._write_segment(merged_name, counts, (ranges, offsets), stats, chunk_ids)
+
+        except Exception as e:
+            print(f"Error when trying to merge the segments of {self.index_dir}: {e}")
+            shutil.rmtree(self._path('segments', merged_name), ignore_errors=True)
+            return
+
+        with self._write_lock:
+            meta = self._read_meta()
+            merged_names = [info['name'] for info in merged_infos]
+            current_names = [info['name'] for info in meta['segments']]
+
+            if current_names[:len(merged_names)] != merged_names:
+                shutil.rmtree(self._path('segments', merged_name), ignore_errors=True)
+                return
+
+            # Tombstones (including those written during the merge) of the chunks that are left, renumbered
+            # in a new file so readers of the previous manifest keep their positions
+            deleted = self._read_deleted(meta)
+            deleted = deleted[~np.isin(deleted, dropped)]
+            deleted = deleted - np.searchsorted(dropped, deleted)
+            previous_deleted_path = self._deleted_path(meta)
+            meta['deleted_file'] = f"deleted_{merged_name}.i64"
+            with open(self._deleted_path(meta), 'wb') as f:
+                f.write(deleted.astype(np.int64).tobytes())
+            meta['n_deleted'] = len(deleted)
+
+            current_df = self._load_df(meta['n_terms'])
+            current_df[:n_terms] -= dropped_df
+            self._write_array(self._path('df.npy'), current_df)
+
+            merged_info = {'name': merged_name, 'n_chunks': counts.shape[0], 'n_terms': n_terms}
+            meta['segments'] = [merged_info] + meta['segments'][len(merged_names):]
+            meta['n_chunks'] -= len(dropped)
+            meta['total_length'] -= dropped_length
+            self._write_meta(meta)
+
+        # Readers still mapping the old files keep them alive until they reload
+        for name in merged_names:
+            shutil.rmtree(self._path('segments', name), ignore_errors=True)
+        if previous_deleted_path != self._deleted_path(meta) and os.path.exists(previous_deleted_path):
+            os.remove(previous_deleted_path)
+
+        print(f"Merged {len(merged_names)} segments of {self.index_dir} into {merged_name}, {len(dropped)} deleted chunks dropped")
+
+    # === READ PATH ===
+    def _open_segment(self, info):
+        segment = self._open_segments.get(info['name'])
+        if segment is not None:
+            return segment
+
+        segment_dir = self._path('segments', info['name'])
+        tf = sparse.csr_matrix(
+            (
+                np.load(os.path.join(segment_dir, 'tf_data.npy'), mmap_mode='r'),
+                np.load(os.path.join(segment_dir, 'tf_indices.npy'), mmap_mode='r'),
+                np.load(os.path.join(segment_dir, 'tf_indptr.npy'), mmap_mode='r')
+            ),
+            shape=(info['n_chunks'], info['n_terms']),
+            copy=False
+        )
+
+        with open(os.path.join(segment_dir, 'chunks.bin'), 'rb') as f:
+            chunks = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+
+        # Segments written before chunk ids existed have none
+        ids_path = os.path.join(segment_dir, 'ids.txt')
+        if os.path.exists(ids_path):
+            with open(ids_path, encoding='utf-8') as f:
+                ids = [line.rstrip('\n') or None for line in f]
+        else:
+            ids = [None] * info['n_chunks']
+
+        # Segments written before the inverted index existed get their postings built once
+        if not os.path.exists(os.path.join(segment_dir, 'post_indptr.npy')):
+            self._write_postings(segment_dir, tf)
+
+        segment = {
+            'name': info['name'],
+            'n_chunks': info['n_chunks'],
+            'tf': tf,
+            'post_indptr': np.load(os.path.join(segment_dir, 'post_indptr.npy'), mmap_mode='r'),
+            'post_docs': np.load(os.path.join(segment_dir, 'post_docs.npy'), mmap_mode='r'),
+            'post_tf': np.load(os.path.join(segment_dir, 'post_tf.npy'), mmap_mode='r'),
+            'doc_lengths': np.load(os.path.join(segment_dir, 'doc_lengths.npy'), mmap_mode='r'),
+            'offsets': np.load(os.path.join(segment_dir, 'offsets.npy'), mmap_mode='r'),
+            'chunks': chunks,
+            'ids': ids
+        }
+        segment.update(self._open_segment_weights(segment_dir))
+        self._open_segments[info['name']] = segment
+        return segment
+
+    def load_index(self):
+        self._migrate_legacy_index()
+        version = os.stat(self._path('meta.json')).st_mtime_ns
+
+        with self._lock:
+            if self._index_data is None or self._index_version != version:
+                meta = self._read_meta()
+
+                segments, bases, base = [], [], 0
+                for info in meta['segments']:
+                    segments.append(self._open_segment(info))
+                    bases.append(base)
+                    base += info['n_chunks']
+
+                # Drop segments that were merged away
+                live_names = {info['name'] for info in meta['segments']}
+                for name in list(self._open_segments):
+                    if name not in live_names:
+                        del self._open_segments[name]
+
+                self._index_data = {
+                    'version': meta['version'],
+                    'segments': segments,
+                    'bases': bases,
+                    'n_chunks': meta['n_chunks'],
+                    'total_length': meta['total_length'],
+                    'df': np.load(self._path('df.npy'), mmap_mode='r') if meta['n_terms'] else np.zeros(0, dtype=np.int64),
+                    # Sorted global positions of deleted chunks
+                    'deleted': self._read_deleted(meta)
+                }
+                self._index_version = version
+
+            return self._index_data
+
+    def get_chunk(self, index_data, idx):
+        position = bisect.bisect_right(index_data['bases'], idx) - 1
+        segment = index_data['segments'][position]
+        local_idx = idx - index_data['bases'][position]
+        start, end = segment['offsets'][local_idx], segment['offsets'][local_idx + 1]
+        return segment['chunks'][start:end].decode('utf-8')
+
+    def get_chunk_id(self, index_data, idx):
+        position = bisect.bisect_right(index_data['bases'], idx) - 1
+        return index_data['segments'][position]['ids'][idx - index_data['bases'][position]]
+
+    def chunk_positions(self, index_data):
+        # id -> global position of the live chunks, built once per index version
+        positions = index_data.get('chunk_positions')
+        if positions is None:
+            positions = {}
+            for segment, base in zip(index_data['segments'], index_data['bases']):
+                for local_idx, chunk_id in enumerate(segment['ids']):
+                    if chunk_id is not None:
+                        positions[chunk_id] = base + local_idx
+            deleted = set(index_data['deleted'].tolist())
+            if deleted:
+                positions = {chunk_id: idx for chunk_id, idx in positions.items() if idx not in deleted}
+            index_data['chunk_positions'] = positions
+        return positions
+
+    def existing_ids(self, chunk_ids):
+        if not self.index_exists():
+            return set()
+        positions = self.chunk_positions(self.load_index())
+        return {chunk_id for chunk_id in chunk_ids if chunk_id in positions}
+
+    def ids_with_prefix(self, prefix):
+        if not self.index_exists():
+            return []
+        return [chunk_id for chunk_id in self.chunk_positions(self.load_index()) if chunk_id.startswith(prefix)]
+
+    def accumulate_postings(self, segment, term_ids, term_weights, values_key='post_tf'):
+        # Sums term_weight * posting value per chunk, reading only the posting lists of the query terms
+        post_indptr = segment['post_indptr']
+        in_segment = term_ids < len(post_indptr) - 1
+        term_ids, term_weights = term_ids[in_segment], term_weights[in_segment]
+
+        docs, contributions = [], []
+        for term_id, term_weight in zip(term_ids, term_weights):
+            start, end = post_indptr[term_id], post_indptr[term_id + 1]
+            if start == end:
+                continue
+            docs.append(segment['post_docs'][start:end])
+            contributions.append(segment[values_key][start:end] * np.float32(term_weight))
+
+        if not docs:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        if len(docs) == 1:
+            return np.asarray(docs[0], dtype=np.int64), np.asarray(contributions[0], dtype=np.float32)
+
+        docs = np.concatenate(docs)
+        contributions = np.concatenate(contributions)
+
+        # Long posting lists (frequent terms) are cheaper to sum into a dense per-segment array
+        if len(docs) * 8 > segment['n_chunks']:
+            scores = np.bincount(docs, weights=contributions, minlength=segment['n_chunks'])
+            doc_ids = np.flatnonzero(scores)
+            return doc_ids, scores[doc_ids].astype(np.float32)
+
+        doc_ids, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=contributions, minlength=len(doc_ids))
+        return doc_ids, scores.astype(np.float32)
+
+    def postings_matrix(self, segment):
+        # (terms x chunks) CSR view of the segment's postings, float32 values, built once per segment
+        matrix = segment.get('postings_matrix')
+        if matrix is None:
+            post_indptr = segment['post_indptr']
+            matrix = segment['postings_matrix'] = sparse.csr_matrix(
+                (np.asarray(segment[self.postings_values], dtype=np.float32), segment['post_docs'], post_indptr),
+                shape=(len(post_indptr) - 1, segment['n_chunks']),
+                copy=False
+            )
+        return matrix
+
+    def search(self, query: str, top_k: int = 5, index_data=None):
+        index_data = index_data or self.load_index()
+        vocabulary = self.load_vocabulary()
+        term_ids, term_counts = self.query_terms(query, vocabulary)
+        stats = self.collection_stats(index_data)
+
+        # Terms added by an ingestion that isn't committed to the manifest yet, and terms whose
+        # chunks were all dropped by a merge (df 0), aren't part of the collection
+        known = term_ids < len(stats['df'])
+        term_ids, term_counts = term_ids[known], term_counts[known]
+        known = np.asarray(stats['df'])[term_ids] > 0
+        term_ids, term_counts = term_ids[known], term_counts[known]
+
+        if not index_data['segments'] or not len(term_ids):
+            return []
+
+        deleted = index_data['deleted']
+        candidate_ids, candidate_scores = [], []
+        for segment, base in zip(index_data['segments'], index_data['bases']):
+            doc_ids, scores = self._score_segment(segment, term_ids, term_counts, stats)
+            if len(deleted):
+                live = ~np.isin(doc_ids + base, deleted)
+                doc_ids, scores = doc_ids[live], scores[live]
+            candidate_ids.append(doc_ids + base)
+            candidate_scores.append(scores)
+
+        candidate_ids = np.concatenate(candidate_ids)
+        candidate_scores = np.concatenate(candidate_scores)
+
+        top_positions = top_k_positions(candidate_scores, top_k)
+        return [(int(candidate_ids[position]), float(candidate_scores[position])) for position in top_positions]
+
+    def search_batch(self, queries, top_k: int = 5, index_data=None):
+        # search() of many queries: their term weights form one sparse (queries x terms) matrix that is
+        # multiplied by the (terms x chunks) postings of every segment
+        index_data = index_data or self.load_index()
+        vocabulary = self.load_vocabulary()
+        stats = self.collection_stats(index_data)
+        n_terms = len(stats['df'])
+
+        rows, columns, weights = [], [], []
+        for row, query in enumerate(queries):
+            term_ids, term_counts = self.query_terms(query, vocabulary)
+            # Terms not committed to the manifest yet or left without chunks by a merge, as in search()
+            known = term_ids < n_terms
+            term_ids, term_counts = term_ids[known], term_counts[known]
+            known = np.asarray(stats['df'])[term_ids] > 0
+            term_ids, term_counts = term_ids[known], term_counts[known]
+            if len(term_ids):
+                rows.append(np.full(len(term_ids), row))
+                columns.append(term_ids)
+                weights.append(self._query_term_weights(term_ids, term_counts, stats))
+
+        if not index_data['segments'] or not rows:
+            return [[] for _ in queries]
+
+        query_matrix = sparse.csr_matrix(
+            (np.concatenate(weights).astype(np.float32), (np.concatenate(rows), np.concatenate(columns))),
+            shape=(len(queries), n_terms)
+        )
+
+        blocks = []
+        for segment in index_data['segments']:
+            postings = self.postings_matrix(segment)
+            block = (query_matrix[:, :postings.shape[0]] @ postings).tocsr()
+            block.data = np.asarray(self._scale_scores(segment, block.indices, block.data), dtype=np.float32)
+            blocks.append(block)
+        # Global positions are the segments' chunks side by side
+        scores = sparse.hstack(blocks, format='csr')
+
+        deleted = index_data['deleted']
+        results = []
+        for row in range(len(queries)):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            doc_ids, row_scores = scores.indices[start:end], scores.data[start:end]
+            if len(deleted):
+                live = ~np.isin(doc_ids, deleted)
+                doc_ids, row_scores = doc_ids[live], row_scores[live]
+            top_positions = top_k_positions(row_scores, top_k)
+            results.append([(int(doc_ids[position]), float(row_scores[position])) for position in top_positions])
+        return results
+
+    def format_results(self, index_data, top_results):
+        return [
+            {
+                'id': self.get_chunk_id(index_data, idx) or f'chunk_{idx}',
+                'score': score,
+                # None for chunks whose text is in the chunk store
+                'text': self.get_chunk(index_data, idx) or None
+            }
+            for idx, score in top_results
+        ]
+
+    def warm(self):
+        if self.index_exists():
+            self.load_index()
+            self.load_vocabulary()
+
+    # === WEIGHTING (implemented by subclasses) ===
+    def _write_segment_weights(self, segment_dir, counts, postings, doc_lengths, stats):
+        pass
+
+    def _open_segment_weights(self, segment_dir):
+        return {}
+
+    def _query_term_weights(self, term_ids, term_counts, stats):
+        raise NotImplementedError
+
+    def _scale_scores(self, segment, doc_ids, scores):
+        return scores
+
+    def _score_segment(self, segment, term_ids, term_counts, stats):
+        # Returns (local chunk ids, scores) of the chunks matching at least one query term
+        term_weights = self._query_term_weights(term_ids, term_counts, stats)
+        if not np.any(term_weights):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        doc_ids, scores = self.accumulate_postings(segment, term_ids, term_weights, values_key=self.postings_values)
+        return doc_ids, self._scale_scores(segment, doc_ids, scores)
+
+
+def top_k_positions(scores, top_k):
+    # O(n) selection of the k best scores, only those k get sorted
+    if len(scores) > top_k:
+        positions = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        positions = np.arange(len(scores))
+
+    return positions[np.argsort(-scores[positions], kind='stable')]
@@ -1,9 +1,14 @@
 import os
 from dotenv import load_dotenv
 from controllers.llm_controller import LLMController
+from controllers.cache_controller import ContentCacheController
+from controllers.chunk_store_controller import ChunkStoreController, chunk_index_refs
 from controllers.embedding_controller import EmbedingController
 from controllers.document_reading_controller import DocumentExtractionController
-from controllers.document_processing_controller import PineconeController, TFIDFController
+from controllers.ingestion_pipeline_controller import IngestionPipelineController
+from controllers.local_vector_controller import LocalVectorController
+from controllers.document_processing_controller import PineconeController, TFIDFController, BM25Controller
+from controllers.registry_controller import namespace_index_name
 
 load_dotenv('./.env')
 
@@ -13,61 +18,92 @@ START_PAGE = int(os.getenv("START_PAGE"))
 END_PAGE = int(os.getenv("END_PAGE"))
 
 TFIDF_INDEX_NAME = os.getenv("TFIDF_INDEX_NAME")
+BM25_INDEX_NAME = os.getenv("BM25_INDEX_NAME")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
 
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pinecone")
+LOCAL_VECTOR_DIR = os.getenv("LOCAL_VECTOR_DIR", ".vectors")
+EMBEDDING_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION") or 0) or None
+LOCAL_VECTOR_PRECISION = os.getenv("LOCAL_VECTOR_PRECISION", "float32")
+
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL_NAME")
 LLM_MODEL = os.getenv("LLM_MODEL_NAME")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+CONTEXT_MODE = os.getenv("CONTEXT_MODE", "main_idea")
+LLM_KEEP_ALIVE = os.getenv("LLM_KEEP_ALIVE", "30m")
+LLM_NUM_CTX = int(os.getenv("LLM_NUM_CTX", "8192"))
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", "1"))
+# Chunks are stored under this document id (defaults to the PDF file name and a digest of its path),
+# REPLACE_DOCUMENT drops those no longer produced (whole documents only)
+DOCUMENT_ID = os.getenv("DOCUMENT_ID")
+REPLACE_DOCUMENT = os.getenv("REPLACE_DOCUMENT", "false").lower() == "true"
+# Collection to ingest into: Pinecone namespace / local shard (empty for the default one)
+NAMESPACE = os.getenv("NAMESPACE") or None
+
+CONTENT_CACHE_PATH = os.getenv("CONTENT_CACHE_PATH", ".cache/content_cache.sqlite")
+CONTENT_CACHE_MAX_MB = int(os.getenv("CONTENT_CACHE_MAX_MB", "1024"))
+
+# Same chunk store as the API (empty path keeps the texts in the vector store and lexical indexes)
+CHUNK_STORE_PATH = os.getenv("CHUNK_STORE_PATH", ".cache/chunk_store.sqlite")
 
 
 def main_ingestion_process():
     try: 
         # === DECLARE ALL THE OBJECTS ===
-        reading = DocumentExtractionController(pdf_path=PDF_PATH)
-        embedding_admin = EmbedingController(model_name=EMBEDDING_MODEL)
-        llm_admin = LLMController(model_name=LLM_MODEL)
-        pinecone_admin = PineconeController(pinecone_api_key=PINECONE_API_KEY, index_name=PINECONE_INDEX_NAME)
-        tfidf_admin = TFIDFController(TFIDF_INDEX_NAME)
+        content_cache = ContentCacheController(CONTENT_CACHE_PATH, max_bytes=CONTENT_CACHE_MAX_MB * 1024 * 1024) if CONTENT_CACHE_PATH else None
+        chunk_store = ChunkStoreController(CHUNK_STORE_PATH).with_namespace(NAMESPACE).with_indexes(
+            chunk_index_refs(VECTOR_STORE, PINECONE_INDEX_NAME, TFIDF_INDEX_NAME, BM25_INDEX_NAME)
+        ) if CHUNK_STORE_PATH else None
+        reading = DocumentExtractionController(pdf_path=PDF_PATH, workers=PDF_EXTRACTION_WORKERS)
+        embedding_admin = EmbedingController(model_name=EMBEDDING_MODEL, batch_size=EMBEDDING_BATCH_SIZE, cache=content_cache)
+        llm_admin = LLMController(model_name=LLM_MODEL, cache=content_cache, keep_alive=LLM_KEEP_ALIVE, num_ctx=LLM_NUM_CTX)
+        if VECTOR_STORE == "local":
+            vector_admin = LocalVectorController(
+                os.path.join(LOCAL_VECTOR_DIR, namespace_index_name(PINECONE_INDEX_NAME, NAMESPACE)),
+                precision=LOCAL_VECTOR_PRECISION, dimension=EMBEDDING_DIMENSION
+            )
+        else:
+            vector_admin = PineconeController(
+                pinecone_api_key=PINECONE_API_KEY, index_name=PINECONE_INDEX_NAME, dimension=EMBEDDING_DIMENSION or 768
+            ).with_namespace(NAMESPACE)
+        tfidf_admin = TFIDFController(namespace_index_name(TFIDF_INDEX_NAME, NAMESPACE))
+
+        lexical_admins = [tfidf_admin]
+        if BM25_INDEX_NAME:
+            lexical_admins.append(BM25Controller(namespace_index_name(BM25_INDEX_NAME, NAMESPACE)))
 
-        # Extracting Text from the PDF doc
         print(f"Starting extraction from {PDF_PATH}")
         print(f"Page range: {START_PAGE} to {END_PAGE}")
 
-        text_extracted = reading.extract_text_from_pdf(start_page=START_PAGE, end_page=END_PAGE)
-        print(f"Extracted text length: {len(text_extracted)} characters")
-
-        # Generate chunks
-        original_chunks = reading.generate_chunks(text=text_extracted)
-        print(f"Number of original chunks: {len(original_chunks)}")
-
-        # Generate main idea
-        text_main_idea = llm_admin.generate_main_text_idea(text=text_extracted)
-
-        # Give context to chunks
-        count = 0
-        contextualized_chunks = []
-        for original_chunk in original_chunks:
-            contextualized_chunk = llm_admin.generate_chunk_context(main_idea=text_main_idea, chunk=original_chunk)
-            contextualized_chunks.append(contextualized_chunk)
-
-            count += 1
-            print(f"Contextualized chunk {count}/{len(original_chunks)}")
-
-        # For Pinecone Storing
-        # 1. Generate embeddings
-        print("\nStarting with the embeddings now...")
-        embeddings = []
-        for chunk in contextualized_chunks:
-            embedding = embedding_admin.generate_embeddings(chunk)
-            embeddings.append(embedding)
-
-        # 2. Store embeddings in Pinecone
-        print("Storing embeddings in Pinecone...")
-        pinecone_admin.start_ingestion_process_pinecone(chunks=contextualized_chunks, embeddings=embeddings)
-
-
-        # For TF-IDF Storing
-        print("\nStoring data in the TF-IDF index...")
-        tfidf_admin.start_ingestion_process_tfidf(chunks=contextualized_chunks)
+        # Pages stream through extraction -> chunking -> context -> embeddings -> vector store / lexical indexes
+        pipeline = IngestionPipelineController(
+            reading=reading,
+            llm_admin=llm_admin,
+            embedding_admin=embedding_admin,
+            vector_admin=vector_admin,
+            lexical_admins=lexical_admins,
+            chunk_store=chunk_store,
+            context_mode=CONTEXT_MODE,
+            llm_concurrency=LLM_CONCURRENCY,
+            batch_size=EMBEDDING_BATCH_SIZE,
+            document_id=DOCUMENT_ID,
+            replace=REPLACE_DOCUMENT
+        )
+        pipeline_stats = pipeline.run(start_page=START_PAGE, end_page=END_PAGE)
+
+        print(f"\nIngested {pipeline_stats['chunks']} chunks in {pipeline_stats['seconds']:.1f}s ({pipeline_stats['chunks_per_second']:.1f} chunks/sec)")
+        for stage, stats in pipeline_stats['stages'].items():
+            print(f"  {stage}: {stats['items']} items in {stats['seconds']:.1f}s")
+
+        slowest_pages = sorted(reading.page_timings, key=lambda timing: timing[1], reverse=True)[:5]
+        print("Slowest pages: " + ", ".join(f"{page_num + 1} ({seconds:.2f}s)" for page_num, seconds in slowest_pages))
+
+        if chunk_store:
+            print(f"Chunk store: {chunk_store.stats()['chunks']} chunks")
+
+        if content_cache:
+            print(f"Content cache: {content_cache.stats()['namespaces']}")
 
         print("\nIngestion Process Completed")
 
@@ -1,7 +1,9 @@
 import os
 from dotenv import load_dotenv
 from controllers.embedding_controller import EmbedingController
-from controllers.document_processing_controller import TFIDFController, PineconeController
+from controllers.local_vector_controller import LocalVectorController
+from controllers.chunk_store_controller import ChunkStoreController
+from controllers.document_processing_controller import TFIDFController, BM25Controller, PineconeController
 
 
 load_dotenv('./.env')
@@ -9,22 +11,68 @@ load_dotenv('./.env')
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 
 TFIDF_INDEX_NAME = os.getenv("TFIDF_INDEX_NAME")
+BM25_INDEX_NAME = os.getenv("BM25_INDEX_NAME")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
 
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pinecone")
+LOCAL_VECTOR_DIR = os.getenv("LOCAL_VECTOR_DIR", ".vectors")
+EMBEDDING_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION") or 0) or None
+LOCAL_VECTOR_PRECISION = os.getenv("LOCAL_VECTOR_PRECISION", "float32")
+
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL_NAME")
 
+# Same chunk store as the ingestion: indexes written with it only keep ids, their texts are read there
+CHUNK_STORE_PATH = os.getenv("CHUNK_STORE_PATH", ".cache/chunk_store.sqlite")
+
 tfidf = TFIDFController(TFIDF_INDEX_NAME)
-pinecone_admin = PineconeController(pinecone_api_key=PINECONE_API_KEY, index_name=PINECONE_INDEX_NAME)
+bm25 = BM25Controller(BM25_INDEX_NAME or TFIDF_INDEX_NAME)
+if VECTOR_STORE == "local":
+    vector_admin = LocalVectorController(
+        os.path.join(LOCAL_VECTOR_DIR, PINECONE_INDEX_NAME), precision=LOCAL_VECTOR_PRECISION, dimension=EMBEDDING_DIMENSION
+    )
+else:
+    vector_admin = PineconeController(pinecone_api_key=PINECONE_API_KEY, index_name=PINECONE_INDEX_NAME, dimension=EMBEDDING_DIMENSION or 768)
 embedding_admin = EmbedingController(model_name=EMBEDDING_MODEL)
+chunk_store = ChunkStoreController(CHUNK_STORE_PATH) if CHUNK_STORE_PATH else None
+
+def chunk_records(chunk_ids: list) -> list:
+    # Chunk store records of the ids, None when not found (or without a chunk store)
+    if chunk_store is None or not chunk_ids:
+        return [None] * len(chunk_ids)
+    records = chunk_store.get_records([(None, chunk_id) for chunk_id in chunk_ids])
+    return [records.get((None, chunk_id)) for chunk_id in chunk_ids]
+
+def fill_texts(results: list):
+    # TF-IDF / BM25 results of chunks ingested with the chunk store have no text
+    missing = [item for item in results if item.get('text') is None]
+    for item, record in zip(missing, chunk_records([item['id'] for item in missing])):
+        if record is not None:
+            item['text'] = record['context']
+            item['source'] = record['source']
+            item['pages'] = [record['start_page'], record['end_page']]
+    return results
+
+def fill_match_texts(response):
+    # Same for the metadata of the vector store matches
+    matches = [{'id': match['id'], 'score': match['score'], 'metadata': dict(match.get('metadata') or {})} for match in response['matches']]
+    missing = [match for match in matches if 'text' not in match['metadata']]
+    for match, record in zip(missing, chunk_records([match['id'] for match in missing])):
+        if record is not None:
+            match['metadata'].update(text=record['context'], source=record['source'])
+    return matches
 
 def extract_from_pinecone(query: str, top_k: int = 5):
     query_embedding = embedding_admin.generate_embeddings(query) 
-    results = pinecone_admin.load_and_query_pinecone(query_embedding, top_k)
-    return results
+    results = vector_admin.load_and_query_vectors(query_embedding, top_k)
+    return fill_match_texts(results)
 
 def extract_from_tfidf(query: str, top_k: int = 5):
     results = tfidf.load_and_query_tfidf(query, top_k)
-    return results
+    return fill_texts(results)
+
+def extract_from_bm25(query: str, top_k: int = 5):
+    results = bm25.load_and_query_bm25(query, top_k)
+    return fill_texts(results)
 
 if __name__ == "__main__":
     query = """What ancient civilizations does the document talk about emphasizing their early practices of medicine?"""
@@ -33,6 +81,11 @@ if __name__ == "__main__":
     results_tfidf = extract_from_tfidf(query)
     print(results_tfidf)
 
+    if bm25.index_exists():
+        print("\n\nBM25")
+        results_bm25 = extract_from_bm25(query)
+        print(results_bm25)
+
     print("\n\nPinecone (Vectorized DB)")
     results_pinecone = extract_from_pinecone(query)
     print(results_pinecone)
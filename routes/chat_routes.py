@@ -1,69 +1,170 @@
 import sys, os
+import json
+import time
 from dotenv import load_dotenv
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
 
-from controllers.llm_controller import LLMController
-from controllers.embedding_controller import EmbedingController
-from controllers.custom_rerank_controller import CustomRerankController
-from controllers.document_processing_controller import PineconeController, TFIDFController
-from controllers.rank_fusion_controller import RankFusionController, format_pinecone_results, format_tfidf_results
+from routes.context_routes import retrieve_hybrid, cached_retrieval, fuse_ranked_lists, request_fusion_key, fill_chunk_texts, with_timings
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
 
-PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL_NAME")
 LLM_MODEL = os.getenv("LLM_MODEL_NAME")
 
 router = APIRouter()
 
+# Marks the end of the Ollama stream when it is pulled from the request threads
+_END = object()
+
+
+async def retrieve_reranked_context(registry, data: dict) -> list:
+    # Reranked chunks ({'id', 'text', 'fusion_score', 'rerank_score', ...}), best first
+    query = data.get("query")
+    top_k = data.get("top_k", 5)
+    # The reranker sees more candidates than it returns, otherwise it can only reorder the fused top_k
+    candidates = max(data.get("rerank_candidates") or registry.rerank_candidates, top_k)
+
+    async def rerank(query_embedding):
+        # Every retriever (Pinecone, TF-IDF, BM25) is queried concurrently
+        ranked_lists = await retrieve_hybrid(registry, data, candidates, query_embedding=query_embedding)
+
+        fusion_key = request_fusion_key(data, ranked_lists)
+        if fusion_key == "text":
+            await fill_chunk_texts(registry, [item for results in ranked_lists.values() for item in results])
+
+        # Rank fusion
+        with registry.metrics.span("fusion"):
+            fused_results = fuse_ranked_lists(data, ranked_lists, candidates, fusion_key)
+
+        # Texts of the fused candidates only, the reranker needs them
+        await fill_chunk_texts(registry, fused_results)
+
+        # Reranking
+        reranker = await registry.run_blocking(registry.get_reranker, model_name='flashrank', language_code='en')
+        with registry.metrics.span("rerank"):
+            return await registry.run_blocking(reranker.rerank, query, fused_results, top_k)
+
+    # Repeated or near-identical questions reuse the reranked context of the previous ones
+    return await cached_retrieval(registry, "chat", data, rerank)
+
+
 @router.post("/chat")
-async def chat(data: dict):
+async def chat(data: dict, request: Request):
     """
     query: str
     pinecone_index_name: str
     tfidf_index_name: str
+    bm25_index_name: str (optional)
+    lexical_retriever: str ("tfidf" or "bm25", default "tfidf")
     top_k: int
+    rerank_candidates: int (optional, fused chunks scored by the reranker, default RERANK_CANDIDATES)
+    namespace / namespaces / merge / retrievers / fusion_method / fusion_weights / fusion_key: same as /rank-fusion
+    include_sources: bool (default false, return the reranked chunks with their scores)
+    include_timings: bool (optional, milliseconds spent in every stage of this request)
     """
     query = data.get("query")
-    pinecone_index_name = data.get("pinecone_index_name")
-    tfidf_index_name = data.get("tfidf_index_name")
-    top_k = data.get("top_k", 5)
+    include_sources = data.get("include_sources", False)
+    registry = request.app.state.registry
 
-    try: 
-        # Extracting data from Pinecone
-        embedding_admin = EmbedingController(model_name=EMBEDDING_MODEL)
-        pinecone_admin = PineconeController(pinecone_api_key=PINECONE_API_KEY, index_name=pinecone_index_name)
+    try:
+        start = time.perf_counter()
+        with registry.metrics.collect_timings() as timings:
+            reranked_results = await retrieve_reranked_context(registry, data)
 
-        query_embedding = embedding_admin.generate_embeddings(query) 
-        pinecone_results = pinecone_admin.load_and_query_pinecone(query_embedding, top_k)
-        formatted_pinecone_results = format_pinecone_results(pinecone_results['matches'])
+            # Calling the LLM Assistant
+            llm_admin = registry.get_llm(LLM_MODEL)
+            formatted_reranked_results = "\n".join(result['text'] for result in reranked_results)
+            with registry.metrics.span("llm"):
+                assistant_response = await registry.run_blocking(llm_admin.chat_llm, context=formatted_reranked_results, message=query)
 
-        # Extracting data from TF-IDF Index
-        tfidf = TFIDFController(tfidf_index_name)
-        tfidf_results = tfidf.load_and_query_tfidf(query, top_k)
-        formatted_tfidf_results = format_tfidf_results(tfidf_results)
+        response = {"answer": assistant_response}
+        if include_sources:
+            response["sources"] = reranked_results
+        return with_timings(data, response, timings, start)
 
-        # Rank fusion
-        rank_fusion = RankFusionController()
-        fused_results = rank_fusion.reciprocal_rank_fusion([
-            formatted_pinecone_results,
-            formatted_tfidf_results
-        ])
+    except Exception as e:
+        print(f"Error when trying to make the chat: {e}")
+        return {"error": f"Error when trying to make the chat: {e}"}
 
-        # Reranking
-        reranker = CustomRerankController(model_name='flashrank', language_code='en')
-        reranked_results = reranker.rerank(query, fused_results[:top_k])
 
-        # Calling the LLM Assistant
-        llm_admin = LLMController(model_name=LLM_MODEL)
-        formatted_reranked_results = "\n".join(reranked_results)
-        assistant_response = llm_admin.chat_llm(context=formatted_reranked_results, message=query)
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-        return {"answer": assistant_response}
 
-    except Exception as e:
-        print(f"Error when trying to make the chat: {e}")
-        return {"error": f"Error when trying to make the chat: {e}"}
+@router.post("/chat-stream")
+async def chat_stream(data: dict, request: Request):
+    """
+    Same as /chat, but the answer is sent as Server-Sent Events while Ollama generates it:
+    "sources" (reranked chunks with their scores, unless include_sources is false), one "token" per piece of the
+    answer, then "done" with time to first token and tokens/sec ("error" if something fails).
+
+    query: str
+    pinecone_index_name: str
+    tfidf_index_name: str
+    bm25_index_name: str (optional)
+    lexical_retriever: str ("tfidf" or "bm25", default "tfidf")
+    top_k: int
+    rerank_candidates: int (optional)
+    namespace / namespaces / merge / retrievers / fusion_method / fusion_weights / fusion_key: same as /rank-fusion
+    include_sources: bool (default true)
+    include_timings: bool (optional, per-stage milliseconds in the "done" event)
+    """
+    query = data.get("query")
+    include_sources = data.get("include_sources", True)
+    registry = request.app.state.registry
+
+    async def events():
+        start = time.perf_counter()
+        timings = {}
+        try:
+            with registry.metrics.collect_timings() as timings:
+                reranked_results = await retrieve_reranked_context(registry, data)
+            if include_sources:
+                yield sse_event("sources", {"sources": reranked_results})
+
+            llm_admin = registry.get_llm(LLM_MODEL)
+            llm_stats = {}
+            tokens = llm_admin.stream_chat_llm(context="\n".join(result['text'] for result in reranked_results), message=query, stats=llm_stats)
+
+            first_token_at = None
+            n_pieces = 0
+            generation_start = time.perf_counter()
+            while True:
+                # Each piece is pulled on the request threads, the Ollama stream is blocking
+                piece = await registry.run_blocking(next, tokens, _END)
+                if piece is _END:
+                    break
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    registry.metrics.observe(
+                        'rag_llm_time_to_first_token_seconds', first_token_at - generation_start,
+                        help_text="Time from the LLM call to its first streamed token"
+                    )
+                n_pieces += 1
+                yield sse_event("token", {"content": piece})
+
+            end = time.perf_counter()
+            n_tokens = llm_stats.get('eval_count') or n_pieces
+            if llm_stats.get('eval_duration'):
+                tokens_per_second = n_tokens / (llm_stats['eval_duration'] / 1e9)
+            else:
+                tokens_per_second = n_tokens / (end - generation_start) if end > generation_start else 0.0
+
+            registry.metrics.observe('rag_stage_duration_seconds', end - generation_start, help_text="Duration of the retrieval and chat stages", stage="llm")
+            timings["llm"] = (end - generation_start) * 1000
+
+            yield sse_event("done", with_timings(data, {
+                "time_to_first_token_ms": (first_token_at - start) * 1000 if first_token_at else None,
+                "total_ms": (end - start) * 1000,
+                "tokens": n_tokens,
+                "tokens_per_second": tokens_per_second
+            }, timings, start))
+
+        except Exception as e:
+            print(f"Error when trying to make the chat: {e}")
+            yield sse_event("error", {"error": f"Error when trying to make the chat: {e}"})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
@@ -1,17 +1,18 @@
 import os, sys
-from typing import List, Dict
+import time
+import asyncio
+from typing import List, Dict, Optional
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
-from controllers.embedding_controller import EmbedingController
-from controllers.document_processing_controller import PineconeController, TFIDFController
-from controllers.rank_fusion_controller import RankFusionController, format_pinecone_results, format_tfidf_results
+from controllers.rank_fusion_controller import RankFusionController, format_pinecone_results, format_tfidf_results, merge_collection_results
+from controllers.document_processing_controller import is_chunk_id
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
 
-PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL_NAME")
 
 router = APIRouter()
@@ -20,34 +21,321 @@ class PineconeResult(BaseModel):
     id: str
     score: float
     metadata: Dict[str, str]
+    namespace: Optional[str] = None
 
 class QueryPineconeResponse(BaseModel):
     results: List[PineconeResult]
+    timings: Optional[Dict[str, float]] = None
+
+
+def with_timings(data: dict, response: dict, timings: dict, start: float) -> dict:
+    # Per-request breakdown ({stage: milliseconds}) when the request sets include_timings.
+    # A copy, the response may be a cached value.
+    if not data.get("include_timings"):
+        return response
+    return {**response, "timings": {**timings, "total": (time.perf_counter() - start) * 1000}}
+
+
+def request_namespaces(data: dict) -> list:
+    # "namespaces" fans the query out to several collections, "namespace" targets one (None is the default collection)
+    namespaces = data.get("namespaces") or [data.get("namespace")]
+    return list(dict.fromkeys(namespaces))
+
+
+# === BLOCKING RETRIEVAL (run on the registry's request threads) ===
+def embed_query(registry, query):
+    embedding_admin = registry.get_embedding(EMBEDDING_MODEL)
+    with registry.metrics.span("embed"):
+        return embedding_admin.generate_embeddings(query)
+
+
+def query_pinecone_index(registry, query, pinecone_index_name, top_k, query_embedding=None, namespace=None):
+    # Pinecone, or the local vector index when VECTOR_STORE=local
+    vector_admin = registry.get_vector_store(pinecone_index_name, namespace)
+
+    if query_embedding is None:
+        query_embedding = embed_query(registry, query)
+    with registry.metrics.span("vector_query", store=registry.vector_store):
+        return vector_admin.load_and_query_vectors(query_embedding, top_k)
+
+
+def query_lexical_index(registry, query, lexical_retriever, tfidf_index_name, bm25_index_name, top_k, namespace=None):
+    if lexical_retriever == "bm25":
+        lexical_admin = registry.get_bm25(bm25_index_name, namespace)
+        with registry.metrics.span("bm25_query"):
+            return lexical_admin.load_and_query_bm25(query, top_k)
+
+    lexical_admin = registry.get_tfidf(tfidf_index_name, namespace)
+    with registry.metrics.span("tfidf_query"):
+        return lexical_admin.load_and_query_tfidf(query, top_k)
+
+
+def embed_queries(registry, queries):
+    # One batched embedding call (cached vectors reused) for the queries of /retrieve/batch
+    embedding_admin = registry.get_embedding(EMBEDDING_MODEL)
+    with registry.metrics.span("embed_batch"):
+        return embedding_admin.generate_embeddings_batch(queries)
+
+
+def query_lexical_index_batch(registry, queries, lexical_retriever, tfidf_index_name, bm25_index_name, top_k, namespace=None):
+    if lexical_retriever == "bm25":
+        lexical_admin = registry.get_bm25(bm25_index_name, namespace)
+        with registry.metrics.span("bm25_query_batch"):
+            return lexical_admin.load_and_query_bm25_batch(queries, top_k)
+
+    lexical_admin = registry.get_tfidf(tfidf_index_name, namespace)
+    with registry.metrics.span("tfidf_query_batch"):
+        return lexical_admin.load_and_query_tfidf_batch(queries, top_k)
+
+
+# === FAN-OUT OVER COLLECTIONS ===
+async def query_vector_collections(registry, query, pinecone_index_name, top_k, namespaces=(None,), merge="rrf",
+                                   query_embedding=None) -> list:
+    # Pinecone-shaped matches of every namespace, queried concurrently and merged into one top_k
+    namespaces = list(namespaces)
+    if query_embedding is None and len(namespaces) > 1:
+        # Embedded once, not once per collection
+        query_embedding = await registry.run_blocking(embed_query, registry, query)
+
+    responses = await asyncio.gather(*(
+        registry.run_blocking(query_pinecone_index, registry, query, pinecone_index_name, top_k, query_embedding, namespace)
+        for namespace in namespaces
+    ))
+
+    result_lists = []
+    for namespace, response in zip(namespaces, responses):
+        # Vectors stored without text (chunk store) may have no metadata at all
+        matches = [{'id': match['id'], 'score': match['score'], 'metadata': match.get('metadata') or {}} for match in response['matches']]
+        if namespace is not None:
+            for match in matches:
+                match['namespace'] = namespace
+        result_lists.append(matches)
+    return merge_collection_results(result_lists, top_k, merge)
+
+
+async def query_lexical_collections(registry, query, lexical_retriever, tfidf_index_name, bm25_index_name, top_k,
+                                    namespaces=(None,), merge="rrf") -> list:
+    namespaces = list(namespaces)
+    result_lists = await asyncio.gather(*(
+        registry.run_blocking(query_lexical_index, registry, query, lexical_retriever, tfidf_index_name, bm25_index_name, top_k, namespace)
+        for namespace in namespaces
+    ))
+
+    for namespace, results in zip(namespaces, result_lists):
+        if namespace is not None:
+            for result in results:
+                result['namespace'] = namespace
+    return merge_collection_results(result_lists, top_k, merge)
+
+
+async def query_lexical_collections_batch(registry, queries, lexical_retriever, tfidf_index_name, bm25_index_name, top_k,
+                                          namespaces=(None,), merge="rrf") -> list:
+    # One batched query per collection, then the collections are merged query by query
+    namespaces = list(namespaces)
+    namespace_results = await asyncio.gather(*(
+        registry.run_blocking(query_lexical_index_batch, registry, queries, lexical_retriever, tfidf_index_name, bm25_index_name, top_k, namespace)
+        for namespace in namespaces
+    ))
+
+    for namespace, result_lists in zip(namespaces, namespace_results):
+        if namespace is not None:
+            for results in result_lists:
+                for result in results:
+                    result['namespace'] = namespace
+    return [
+        merge_collection_results([result_lists[position] for result_lists in namespace_results], top_k, merge)
+        for position in range(len(queries))
+    ]
+
+
+# === CHUNK TEXTS ===
+def read_chunk_records(registry, keys):
+    with registry.metrics.span("chunk_store"):
+        return registry.chunk_store.get_records(keys)
+
+
+async def chunk_records(registry, items) -> list:
+    # Chunk store records of the items ({'id', 'namespace'?}), read in one batch, None when not found
+    if registry.chunk_store is None or not items:
+        return [None] * len(items)
+    keys = [(item.get('namespace'), item['id']) for item in items]
+    records = await registry.run_blocking(read_chunk_records, registry, keys)
+    return [records.get(key) for key in keys]
+
+
+async def fill_chunk_texts(registry, results) -> list:
+    # Chunks ingested with a chunk store come out of the retrievers as ids only: their text
+    # (and source PDF / pages) is read here, once, for the results actually returned
+    missing = [item for item in results if item.get('text') is None]
+    for item, record in zip(missing, await chunk_records(registry, missing)):
+        if record is None:
+            item['text'] = ''
+            continue
+        item['text'] = record['context']
+        item['source'] = record['source']
+        item['pages'] = [record['start_page'], record['end_page']]
+    return results
+
+
+def request_retrievers(data: dict) -> list:
+    # Ranked lists fused by /rank-fusion and /chat: "pinecone" (the vector store), "tfidf" and/or "bm25"
+    retrievers = data.get("retrievers") or ["pinecone", data.get("lexical_retriever", "tfidf")]
+    unknown = set(retrievers) - {"pinecone", "tfidf", "bm25"}
+    if unknown:
+        raise ValueError(f"Unknown retrievers {sorted(unknown)}, expected 'pinecone', 'tfidf' or 'bm25'")
+    return list(dict.fromkeys(retrievers))
+
+
+async def retrieve_hybrid(registry, data: dict, top_k, query_embedding=None) -> dict:
+    # The Pinecone queries (embedding + network) and the lexical index queries run concurrently
+    query = data.get("query")
+    namespaces, merge = request_namespaces(data), data.get("merge", "rrf")
+    retrievers = request_retrievers(data)
+
+    queries = []
+    for retriever in retrievers:
+        if retriever == "pinecone":
+            queries.append(query_vector_collections(
+                registry, query, data.get("pinecone_index_name"), top_k, namespaces, merge, query_embedding
+            ))
+        else:
+            queries.append(query_lexical_collections(
+                registry, query, retriever, data.get("tfidf_index_name"), data.get("bm25_index_name"), top_k, namespaces, merge
+            ))
+    results = await asyncio.gather(*queries)
+
+    return {
+        retriever: format_pinecone_results(result) if retriever == "pinecone" else format_tfidf_results(result)
+        for retriever, result in zip(retrievers, results)
+    }
+
+
+async def retrieve_hybrid_batch(registry, data: dict, queries: list, top_k, query_embeddings, concurrency=16) -> list:
+    # retrieve_hybrid() of many queries: each lexical index is queried once for all of them, the
+    # vector store queries are sent concurrently (at most `concurrency` at once)
+    namespaces, merge = request_namespaces(data), data.get("merge", "rrf")
+    retrievers = request_retrievers(data)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def query_vectors(query, query_embedding):
+        async with semaphore:
+            return await query_vector_collections(
+                registry, query, data.get("pinecone_index_name"), top_k, namespaces, merge, query_embedding
+            )
+
+    batches = []
+    for retriever in retrievers:
+        if retriever == "pinecone":
+            batches.append(asyncio.gather(*(
+                query_vectors(query, query_embedding) for query, query_embedding in zip(queries, query_embeddings)
+            )))
+        else:
+            batches.append(query_lexical_collections_batch(
+                registry, queries, retriever, data.get("tfidf_index_name"), data.get("bm25_index_name"), top_k, namespaces, merge
+            ))
+    results = await asyncio.gather(*batches)
+
+    return [
+        {
+            retriever: format_pinecone_results(result[position]) if retriever == "pinecone" else format_tfidf_results(result[position])
+            for retriever, result in zip(retrievers, results)
+        }
+        for position in range(len(queries))
+    ]
+
+
+def request_fusion_key(data: dict, ranked_lists: dict) -> str:
+    # Requested fusion_key, otherwise "id" when every chunk has a deterministic id (shared by the vector
+    # store and the lexical indexes) and "text" as before when some come from an older index
+    if data.get("fusion_key"):
+        return data["fusion_key"]
+    ids = (item.get('id') for results in ranked_lists.values() for item in results)
+    return "id" if all(is_chunk_id(chunk_id) for chunk_id in ids) else "text"
+
+
+def fuse_ranked_lists(data: dict, ranked_lists: dict, top_k=None, key=None) -> list:
+    # fusion_weights: {"pinecone": 1.0, "tfidf": 0.5, ...}, retrievers left out weigh 1
+    fusion_weights = data.get("fusion_weights") or {}
+    rank_fusion = RankFusionController(method=data.get("fusion_method", "rrf"), key=key or request_fusion_key(data, ranked_lists))
+    return rank_fusion.fuse(
+        list(ranked_lists.values()),
+        weights=[fusion_weights.get(retriever, 1.0) for retriever in ranked_lists],
+        top_k=top_k
+    )
+
+
+async def cached_retrieval(registry, endpoint, data, compute):
+    """
+    Returns `await compute(query_embedding)` through the registry's query cache: exact match on
+    the normalized query first, then a near-duplicate query with a similar embedding when the
+    vector store is queried. The embedding computed for the lookup is handed to `compute` so the
+    query is only embedded once (None for lexical-only requests).
+    """
+    query = data.get("query")
+    query_cache = registry.query_cache
+    if query_cache is None:
+        return await compute(None)
+
+    retrievers = request_retrievers(data)
+    index_names = tuple(data.get(f"{retriever}_index_name") for retriever in retrievers)
+    scope = (
+        endpoint, *index_names, *retrievers, data.get("top_k", 5), tuple(request_namespaces(data)), data.get("merge", "rrf"),
+        data.get("fusion_method", "rrf"), tuple(sorted((data.get("fusion_weights") or {}).items())), data.get("fusion_key"),
+        data.get("rerank_candidates")
+    )
+
+    value = query_cache.get(scope, query)
+    if value is not None:
+        return value
+
+    # Lexical-only requests don't need the embedding, the near-duplicate tier would cost one per miss
+    query_embedding = None
+    if "pinecone" in retrievers:
+        query_embedding = await registry.run_blocking(embed_query, registry, query)
+        value = query_cache.get_similar(scope, query_embedding)
+        if value is not None:
+            return value
+    else:
+        query_cache.record_miss()
+
+    generation = query_cache.generation
+    value = await compute(query_embedding)
+    query_cache.set(scope, query, value, index_names=index_names, query_embedding=query_embedding, generation=generation)
+    return value
 
 
 # === EXTRACT CONTEXT FROM PINECONE INDEX ===
 @router.post("/context-pinecone")
-async def query_pinecone(data: dict):
+async def query_pinecone(data: dict, request: Request):
     """
     query: str
     pinecone_index_name: str
     top_k: int
+    namespace: str (optional)
+    namespaces: list[str] (optional, fan-out over several collections)
+    merge: str ("rrf" or "score", default "rrf")
+    include_timings: bool (optional, milliseconds spent in every stage of this request)
     """
     query = data.get("query")
     pinecone_index_name = data.get("pinecone_index_name")
     top_k = data.get("top_k")
 
-    try: 
-        embedding_admin = EmbedingController(model_name=EMBEDDING_MODEL)
-        pinecone_admin = PineconeController(pinecone_api_key=PINECONE_API_KEY, index_name=pinecone_index_name)
-
-        query_embedding = embedding_admin.generate_embeddings(query) 
-        results = pinecone_admin.load_and_query_pinecone(query_embedding, top_k)
+    registry = request.app.state.registry
 
-        matches = results.get('matches', [])
-        serialized_results = [PineconeResult(id=match['id'], score=match['score'], metadata=match['metadata']) for match in matches]
+    try: 
+        start = time.perf_counter()
+        with registry.metrics.collect_timings() as timings:
+            matches = await query_vector_collections(
+                registry, query, pinecone_index_name, top_k, request_namespaces(data), data.get("merge", "rrf")
+            )
+            missing = [match for match in matches if 'text' not in match['metadata']]
+            for match, record in zip(missing, await chunk_records(registry, missing)):
+                match['metadata'] = {**match['metadata'], 'text': record['context'] if record else ''}
+                if record and record['source']:
+                    match['metadata']['source'] = record['source']
+        serialized_results = [PineconeResult(**match) for match in matches]
 
-        return QueryPineconeResponse(results=serialized_results)
+        return QueryPineconeResponse(**with_timings(data, {"results": serialized_results}, timings, start))
 
     except Exception as e:
         return {"error": f"Error when trying to extract context from {pinecone_index_name}: {e}"}
@@ -55,68 +343,174 @@ async def query_pinecone(data: dict):
 
 # === EXTRACT CONTEXT FROM TF-IDF INDEX ===
 @router.post("/context-tfidf")
-async def query_tfidf(data: dict):
+async def query_tfidf(data: dict, request: Request):
     """
     query: str
     tfidf_index_name: str
     top_k: int
+    namespace / namespaces / merge / include_timings: same as /context-pinecone
     """
     query = data.get("query")
     tfidf_index_name = data.get("tfidf_index_name")
     top_k = data.get("top_k")
 
+    registry = request.app.state.registry
+
     try:
-        tfidf = TFIDFController(tfidf_index_name)
-        results = tfidf.load_and_query_tfidf(query, top_k)
+        start = time.perf_counter()
+        with registry.metrics.collect_timings() as timings:
+            results = await query_lexical_collections(
+                registry, query, "tfidf", tfidf_index_name, None, top_k, request_namespaces(data), data.get("merge", "rrf")
+            )
+            await fill_chunk_texts(registry, results)
 
-        return {"results": results}
+        return with_timings(data, {"results": results}, timings, start)
     
     except Exception as e:
         return {"error": f"Error when trying to extract context from {tfidf_index_name}: {e}"}
 
 
+# === EXTRACT CONTEXT FROM BM25 INDEX ===
+@router.post("/context-bm25")
+async def query_bm25(data: dict, request: Request):
+    """
+    query: str
+    bm25_index_name: str
+    top_k: int
+    namespace / namespaces / merge / include_timings: same as /context-pinecone
+    """
+    query = data.get("query")
+    bm25_index_name = data.get("bm25_index_name")
+    top_k = data.get("top_k")
+
+    registry = request.app.state.registry
+
+    try:
+        start = time.perf_counter()
+        with registry.metrics.collect_timings() as timings:
+            results = await query_lexical_collections(
+                registry, query, "bm25", None, bm25_index_name, top_k, request_namespaces(data), data.get("merge", "rrf")
+            )
+            await fill_chunk_texts(registry, results)
+
+        return with_timings(data, {"results": results}, timings, start)
+    
+    except Exception as e:
+        return {"error": f"Error when trying to extract context from {bm25_index_name}: {e}"}
+
+
 # === RANK FUSION HYBRID ===
 @router.post("/rank-fusion")
-async def query_hybrid(data: dict):
+async def query_hybrid(data: dict, request: Request):
     """
     query: str
     pinecone_index_name: str
     tfidf_index_name: str
+    bm25_index_name: str (optional)
+    lexical_retriever: str ("tfidf" or "bm25", default "tfidf")
+    retrievers: list[str] (optional, any of "pinecone", "tfidf", "bm25", default ["pinecone", lexical_retriever])
+    fusion_method: str ("rrf", "combsum", "combmnz" or "zscore", default "rrf")
+    fusion_weights: dict (optional, weight per retriever, default 1)
+    fusion_key: str ("id" or "text", default "id" when every retrieved chunk has a deterministic id, "text" otherwise)
     top_k: int
+    namespace / namespaces / merge / include_timings: same as /context-pinecone
     """
-    query = data.get("query")
-    pinecone_index_name = data.get("pinecone_index_name")
-    tfidf_index_name = data.get("tfidf_index_name")
     top_k = data.get("top_k", 5)
 
-    try: 
-        # Extracting data from Pinecone
-        embedding_admin = EmbedingController(model_name=EMBEDDING_MODEL)
-        pinecone_admin = PineconeController(pinecone_api_key=PINECONE_API_KEY, index_name=pinecone_index_name)
-
-        query_embedding = embedding_admin.generate_embeddings(query) 
-        pinecone_results = pinecone_admin.load_and_query_pinecone(query_embedding, top_k)
-        formatted_pinecone_results = format_pinecone_results(pinecone_results['matches'])
-
-        # Extracting data from TF-IDF Index
-        tfidf = TFIDFController(tfidf_index_name)
-        tfidf_results = tfidf.load_and_query_tfidf(query, top_k)
-        formatted_tfidf_results = format_tfidf_results(tfidf_results)
-
-        # Rank fusion
-        rank_fusion = RankFusionController()
-        fused_results = rank_fusion.reciprocal_rank_fusion([
-            formatted_pinecone_results,
-            formatted_tfidf_results
-        ])
+    registry = request.app.state.registry
 
+    async def fuse(query_embedding):
+        # Every retriever (Pinecone, TF-IDF, BM25) is queried concurrently
+        ranked_lists = await retrieve_hybrid(registry, data, top_k, query_embedding=query_embedding)
+        source_items = [item for results in ranked_lists.values() for item in results]
+        fusion_key = request_fusion_key(data, ranked_lists)
+        if fusion_key == "text":
+            # Matched by text, so the texts are needed before fusion
+            await fill_chunk_texts(registry, source_items)
+        with registry.metrics.span("fusion"):
+            fused_results = fuse_ranked_lists(data, ranked_lists, top_k, fusion_key)
+        await fill_chunk_texts(registry, fused_results + source_items)
         return {
-            "results": fused_results[:top_k],
-            "source_results": {
-                "pinecone": formatted_pinecone_results,
-                "tfidf": formatted_tfidf_results
-            }
+            "results": fused_results,
+            "source_results": ranked_lists
         }
 
+    try: 
+        start = time.perf_counter()
+        with registry.metrics.collect_timings() as timings:
+            response = await cached_retrieval(registry, "rank-fusion", data, fuse)
+        return with_timings(data, response, timings, start)
+
+    except Exception as e:
+        return {"error": f"Error when trying to Rerank: {e}"}
+
+
+# === BATCH RETRIEVAL ===
+@router.post("/retrieve/batch")
+async def retrieve_batch(data: dict, request: Request):
+    """
+    Fused (and reranked) chunks of many queries in one request.
+
+    queries: list[str] (at most BATCH_MAX_QUERIES, see api.py)
+    top_k: int (results per query)
+    pinecone_index_name / tfidf_index_name / bm25_index_name / lexical_retriever / retrievers / fusion_method /
+    fusion_weights / fusion_key / namespace / namespaces / merge: same as /rank-fusion
+    rerank: bool (default true, fused candidates reranked like the context of /chat)
+    rerank_candidates: int (optional, fused chunks scored per query, default RERANK_CANDIDATES)
+    concurrency: int (optional, vector store queries in flight, 1 to BATCH_MAX_CONCURRENCY, default 16)
+    include_timings: bool (optional, milliseconds per stage, summed over the queries)
+    """
+    queries = data.get("queries") or []
+    top_k = data.get("top_k", 5)
+    rerank = data.get("rerank", True)
+
+    registry = request.app.state.registry
+
+    try:
+        if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+            raise ValueError("queries must be a list of strings")
+        if len(queries) > registry.batch_max_queries:
+            return JSONResponse(
+                status_code=400, content={"error": f"Got {len(queries)} queries, at most {registry.batch_max_queries} are accepted"}
+            )
+        concurrency = data.get("concurrency", 16)
+        if isinstance(concurrency, bool) or not isinstance(concurrency, int) or not 1 <= concurrency <= registry.batch_max_concurrency:
+            return JSONResponse(
+                status_code=400,
+                content={"error": f"concurrency must be an integer between 1 and {registry.batch_max_concurrency}, got {concurrency!r}"}
+            )
+        # Reranking needs more candidates than it returns, like /chat
+        depth = max(data.get("rerank_candidates") or registry.rerank_candidates, top_k) if rerank else top_k
+
+        start = time.perf_counter()
+        with registry.metrics.collect_timings() as timings:
+            query_embeddings = [None] * len(queries)
+            if queries and "pinecone" in request_retrievers(data):
+                # Every query embedded by one batched call
+                query_embeddings = await registry.run_blocking(embed_queries, registry, queries)
+
+            ranked_lists = await retrieve_hybrid_batch(
+                registry, data, queries, depth, query_embeddings, concurrency
+            )
+            fusion_keys = [request_fusion_key(data, lists) for lists in ranked_lists]
+            await fill_chunk_texts(registry, [
+                item for lists, fusion_key in zip(ranked_lists, fusion_keys) if fusion_key == "text"
+                for results in lists.values() for item in results
+            ])
+
+            with registry.metrics.span("fusion"):
+                fused_results = [fuse_ranked_lists(data, lists, depth, fusion_key) for lists, fusion_key in zip(ranked_lists, fusion_keys)]
+
+            # One chunk store read for the fused results of every query
+            await fill_chunk_texts(registry, [item for results in fused_results for item in results])
+
+            if rerank and queries:
+                reranker = await registry.run_blocking(registry.get_reranker, model_name='flashrank', language_code='en')
+                with registry.metrics.span("rerank_batch"):
+                    fused_results = await registry.run_blocking(reranker.rerank_many, queries, fused_results, top_k)
+
+        response = {"results": [{"query": query, "results": results} for query, results in zip(queries, fused_results)]}
+        return with_timings(data, response, timings, start)
+
     except Exception as e:
-        return {"error": f"Error when trying to Rerank: {e}"}
\ No newline at end of file
+        return {"error": f"Error when trying to retrieve the batch: {e}"}
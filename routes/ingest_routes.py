@@ -1,75 +1,181 @@
 import os, sys
 from dotenv import load_dotenv
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
-from controllers.llm_controller import LLMController
-from controllers.embedding_controller import EmbedingController
 from controllers.document_reading_controller import DocumentExtractionController
-from controllers.document_processing_controller import PineconeController, TFIDFController
+from controllers.ingestion_pipeline_controller import IngestionPipelineController
+from controllers.document_processing_controller import document_id_prefix, check_document_id
+from controllers.registry_controller import namespace_index_name
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
 
-PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL_NAME")
 LLM_MODEL = os.getenv("LLM_MODEL_NAME")
+CONTEXT_MODE = os.getenv("CONTEXT_MODE", "main_idea")
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", "1"))
 
 router = APIRouter()
 
+
+def invalidate_query_cache(registry, params: dict):
+    # Cached retrieval results of the indexes being written are stale
+    if registry.query_cache is not None:
+        registry.query_cache.invalidate([
+            params.get("pinecone_index_name"), params.get("tfidf_index_name"), params.get("bm25_index_name")
+        ])
+
+
+def build_ingestion_pipeline(registry, params: dict) -> IngestionPipelineController:
+    # Used by the background ingestion workers (see IngestionJobController in api.py)
+    namespace = params.get("namespace")
+    tfidf_admin = registry.get_tfidf(params.get("tfidf_index_name"), namespace)
+
+    lexical_admins = [tfidf_admin]
+    if params.get("bm25_index_name"):
+        lexical_admins.append(registry.get_bm25(params.get("bm25_index_name"), namespace))
+
+    # Pages stream through extraction -> chunking -> context -> embeddings -> Pinecone / lexical
+    # indexes, so the first batches are searchable before the whole PDF has been read
+    return IngestionPipelineController(
+        reading=DocumentExtractionController(params.get("pdf_path"), workers=PDF_EXTRACTION_WORKERS),
+        llm_admin=registry.get_llm(LLM_MODEL),
+        embedding_admin=registry.get_embedding(EMBEDDING_MODEL),
+        vector_admin=registry.get_vector_store(params.get("pinecone_index_name"), namespace),
+        lexical_admins=lexical_admins,
+        context_mode=params.get("context_mode") or CONTEXT_MODE,
+        llm_concurrency=registry.llm_concurrency,
+        batch_size=registry.embedding_batch_size,
+        on_stored=lambda: invalidate_query_cache(registry, params),
+        document_id=params.get("document_id"),
+        replace=params.get("replace", False),
+        metrics=registry.metrics,
+        chunk_store=registry.get_chunk_store(
+            namespace, params.get("pinecone_index_name"), params.get("tfidf_index_name"), params.get("bm25_index_name")
+        )
+    )
+
+
 # === INGESTION PROCESS ===
 @router.post("/ingestion")
-async def ingestion(data: dict): 
+async def ingestion(data: dict, request: Request): 
     """
+    Queues the ingestion of a PDF and returns its job id right away.
+
     pdf_path: str
     pinecone_index_name: str
     tfidf_index_name: str
+    bm25_index_name: str (optional)
+    context_mode: str ("main_idea" or "document", optional)
+    document_id: str (optional, defaults to the PDF file name and a digest of its path)
+    replace: bool (optional, delete the chunks of a previous version of the document that are not produced again,
+                   whole documents only)
+    namespace: str (optional, collection to ingest into: Pinecone namespace / local index shard)
+
+    Chunks already stored with the same document id, position and text are skipped, so
+    re-ingesting a PDF never duplicates it.
     """
     pdf_path = data.get("pdf_path")
-    start_page = data.get("start_page", 0)
-    end_page = data.get("end_page", None)
-    pinecone_index_name = data.get("pinecone_index_name")
-    tfidf_index_name = data.get("tfidf_index_name")
-
-    try: 
-        # === DECLARE ALL THE OBJECTS ===
-        reading = DocumentExtractionController(pdf_path)
-        embedding_admin = EmbedingController(model_name=EMBEDDING_MODEL)
-        llm_admin = LLMController(model_name=LLM_MODEL)
-        pinecone_admin = PineconeController(pinecone_api_key=PINECONE_API_KEY, index_name=pinecone_index_name)
-        tfidf_admin = TFIDFController(tfidf_index_name)
-
-
-        # Extracting Text from the PDF doc
-        text_extracted = reading.extract_text_from_pdf(start_page=start_page, end_page=end_page)
 
-        # Generate chunks
-        original_chunks = reading.generate_chunks(text=text_extracted)
-        print(f"Number of original chunks: {len(original_chunks)}")
+    if not pdf_path or not os.path.isfile(pdf_path):
+        return {"error": f"Error when trying to open the file {pdf_path}: file not found"}
+
+    params = {
+        "pdf_path": pdf_path,
+        "start_page": data.get("start_page", 0),
+        "end_page": data.get("end_page", None),
+        "pinecone_index_name": data.get("pinecone_index_name"),
+        "tfidf_index_name": data.get("tfidf_index_name"),
+        "bm25_index_name": data.get("bm25_index_name"),
+        "context_mode": data.get("context_mode", CONTEXT_MODE),
+        "document_id": data.get("document_id"),
+        "replace": data.get("replace", False),
+        "namespace": data.get("namespace")
+    }
+
+    # The workers need both indexes, a job without them would only fail once dequeued
+    missing = [name for name in ("pinecone_index_name", "tfidf_index_name") if not params[name]]
+    if missing:
+        return JSONResponse(status_code=400, content={"error": f"Missing {', '.join(missing)}"})
+    if params["replace"] and (params["start_page"] or params["end_page"] is not None):
+        return JSONResponse(status_code=400, content={"error": "replace needs the whole document, not a page range"})
+    try:
+        # Rejects invalid namespaces and document ids before the job is queued
+        namespace_index_name(params["tfidf_index_name"], params["namespace"])
+        if params["document_id"]:
+            check_document_id(params["document_id"])
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    try:
+        job_id = request.app.state.ingestion_jobs.submit(params)
+        return {"message": "Ingestion job queued", "job_id": job_id, "status": "queued"}
 
-        # Generate main idea
-        text_main_idea = llm_admin.generate_main_text_idea(text=text_extracted)
+    except Exception as e:
+        return {"error": f"Error when trying to queue the ingestion of {pdf_path}: {e}"}
 
-        # Give context to chunks
-        contextualized_chunks = []
-        for original_chunk in original_chunks:
-            contextualized_chunk = llm_admin.generate_chunk_context(main_idea=text_main_idea, chunk=original_chunk)
-            contextualized_chunks.append(contextualized_chunk)
 
-        # For Pinecone Storing
-        # 1. Generate embeddings
-        embeddings = []
-        for chunk in contextualized_chunks:
-            embedding = embedding_admin.generate_embeddings(chunk)
-            embeddings.append(embedding)
+@router.delete("/documents/{document_id}")
+async def delete_document(document_id: str, request: Request, pinecone_index_name: str = None,
+                          tfidf_index_name: str = None, bm25_index_name: str = None, namespace: str = None):
+    """
+    Deletes every chunk of a document (ids prefixed with its document id) from the given indexes,
+    and from the chunk store once no other index holds them.
+    """
+    registry = request.app.state.registry
+    params = {"pinecone_index_name": pinecone_index_name, "tfidf_index_name": tfidf_index_name, "bm25_index_name": bm25_index_name}
+    try:
+        check_document_id(document_id)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    def delete():
+        deleted = {}
+        admins = [
+            (pinecone_index_name, registry.get_vector_store),
+            (tfidf_index_name, registry.get_tfidf),
+            (bm25_index_name, registry.get_bm25)
+        ]
+        for index_name, get_admin in admins:
+            if index_name:
+                admin = get_admin(index_name, namespace)
+                deleted[index_name] = admin.delete_ids(admin.ids_with_prefix(document_id_prefix(document_id)))
+
+        chunk_store = registry.get_chunk_store(namespace, pinecone_index_name, tfidf_index_name, bm25_index_name)
+        if chunk_store is not None and chunk_store.index_refs:
+            deleted['chunk_store'] = chunk_store.delete_ids(chunk_store.ids_with_prefix(document_id_prefix(document_id)))
+        return deleted
+
+    try:
+        deleted = await registry.run_blocking(delete)
+        invalidate_query_cache(registry, params)
+        return {"document_id": document_id, "deleted": deleted}
 
-        # 2. Store embeddings in Pinecone
-        pinecone_admin.start_ingestion_process_pinecone(chunks=contextualized_chunks, embeddings=embeddings)
+    except Exception as e:
+        return {"error": f"Error when trying to delete the document {document_id}: {e}"}
 
 
-        # For TF-IDF Storing
-        tfidf_admin.start_ingestion_process_tfidf(chunks=contextualized_chunks)
+@router.get("/ingestion")
+async def list_ingestion_jobs(request: Request, limit: int = 50):
+    return {"jobs": request.app.state.ingestion_jobs.list_jobs(limit=limit)}
 
-        return {"message": "Ingestion process completed"}
 
-    except Exception as e:
-        return {"error": f"Error when trying to open the file {pdf_path}: {e}"}
\ No newline at end of file
+@router.get("/ingestion/{job_id}")
+async def ingestion_status(job_id: str, request: Request):
+    """
+    Status of an ingestion job: queued, running, completed, cancelled, failed or interrupted,
+    with the chunks stored so far, throughput and per-stage progress.
+    """
+    job = request.app.state.ingestion_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Ingestion job {job_id} not found"})
+    return job
+
+
+@router.post("/ingestion/{job_id}/cancel")
+async def cancel_ingestion(job_id: str, request: Request):
+    status = request.app.state.ingestion_jobs.cancel(job_id)
+    if status is None:
+        return JSONResponse(status_code=404, content={"error": f"Ingestion job {job_id} not found"})
+    return {"job_id": job_id, "status": status}
@@ -0,0 +1,3 @@
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
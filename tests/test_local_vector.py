@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from controllers.local_vector_controller import LocalVectorController
+from controllers.document_processing_controller import stored_chunk_ids
+
+
+def clustered_vectors(n_vectors, dim, n_topics, seed=0):
+    # Topic clusters with noise, like the embeddings of a corpus about a few subjects
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    labels = rng.integers(0, n_topics, size=n_vectors)
+    return topics[labels] + 0.5 * rng.standard_normal((n_vectors, dim)).astype(np.float32)
+
+
+def recall(vectors, queries, top_k, index_data):
+    recalls = []
+    for query in queries:
+        expected = {idx for idx, _ in vectors.search(query, top_k, index_data=index_data, exact=True)}
+        found = {idx for idx, _ in vectors.search(query, top_k, index_data=index_data)}
+        recalls.append(len(found & expected) / len(expected))
+    return float(np.mean(recalls))
+
+
+@pytest.fixture(scope="module")
+def embeddings():
+    all_embeddings = clustered_vectors(3050, 64, 20)
+    return all_embeddings[:3000], all_embeddings[3000:]
+
+
+def store(vectors, embeddings):
+    for start in range(0, len(embeddings), 1000):
+        batch = embeddings[start:start + 1000]
+        vectors.store_embeddings(batch, [""] * len(batch), chunk_ids=[f"doc#0.{start + i}#x" for i in range(len(batch))], store_text=False)
+
+
+def test_ivf_recall_against_exact_search(tmp_path, embeddings):
+    corpus, queries = embeddings
+    vectors = LocalVectorController(str(tmp_path / "index"), train_min=1000, nprobe=8)
+    store(vectors, corpus)
+    index_data = vectors.load_index()
+    assert index_data['meta'].get('n_lists'), "IVF lists should be trained"
+
+    assert recall(vectors, queries, 10, index_data) >= 0.9
+
+
+@pytest.mark.parametrize("precision,dimension", [("float16", None), ("int8", None)])
+def test_compressed_recall_against_exact_search(tmp_path, embeddings, precision, dimension):
+    # Exhaustive scan of the compressed vectors, rescored at full precision
+    corpus, queries = embeddings
+    vectors = LocalVectorController(str(tmp_path / "index"), train_min=10**9, precision=precision, dimension=dimension, rescore=4)
+    store(vectors, corpus)
+
+    assert recall(vectors, queries, 10, vectors.load_index()) >= 0.95
+
+
+def test_exact_search_ranks_by_cosine(tmp_path, embeddings):
+    corpus, queries = embeddings
+    vectors = LocalVectorController(str(tmp_path / "index"), train_min=10**9)
+    store(vectors, corpus[:500])
+
+    normalized = corpus[:500] / np.linalg.norm(corpus[:500], axis=1, keepdims=True)
+    query = queries[0] / np.linalg.norm(queries[0])
+    expected = np.argsort(-(normalized @ query))[:10]
+    results = vectors.search(queries[0], 10, exact=True)
+    assert [idx for idx, _ in results] == expected.tolist()
+    assert [score for _, score in results] == pytest.approx((normalized @ query)[expected].tolist(), rel=1e-4)
+
+
+def test_delete_then_readd(tmp_path, embeddings):
+    corpus, _ = embeddings
+    vectors = LocalVectorController(str(tmp_path / "index"), train_min=10**9)
+    store(vectors, corpus[:100])
+    ids = [f"doc#0.{i}#x" for i in range(100)]
+
+    assert vectors.delete_ids(ids[:2]) == 2
+    assert vectors.existing_ids(ids) == set(ids[2:])
+    index_data = vectors.load_index()
+    assert ids[0] not in {vectors.get_record(index_data, idx)['id'] for idx, _ in vectors.search(corpus[0], 5, index_data=index_data)}
+
+    vectors.store_embeddings(corpus[:1], [""], chunk_ids=ids[:1], store_text=False)
+    index_data = vectors.load_index()
+    assert vectors.existing_ids(ids) == set(ids) - {ids[1]}
+    top_idx, top_score = vectors.search(corpus[0], 1, index_data=index_data)[0]
+    assert vectors.get_record(index_data, top_idx)['id'] == ids[0]
+    assert top_score == pytest.approx(1.0, abs=1e-4)
+
+
+def test_storing_without_ids_never_duplicates(tmp_path, embeddings):
+    corpus, _ = embeddings
+    vectors = LocalVectorController(str(tmp_path / "index"), train_min=10**9)
+    chunks = [f"chunk {i}" for i in range(10)]
+    vectors.store_embeddings(corpus[:10], chunks)
+    vectors.store_embeddings(corpus[:10], chunks)
+
+    # The second write replaced the first one: only 10 live vectors, each text once
+    index_data = vectors.load_index()
+    results = vectors.search(corpus[0], 20, index_data=index_data, exact=True)
+    assert sorted(vectors.get_record(index_data, idx)['id'] for idx, _ in results) == sorted(stored_chunk_ids(chunks))
@@ -0,0 +1,37 @@
+import os
+import pytest
+
+from controllers.registry_controller import namespace_index_name
+from controllers.local_vector_controller import LocalVectorController
+from controllers.document_processing_controller import TFIDFController, BM25Controller
+
+
+@pytest.mark.parametrize("index_name", ["my-index", "data/tfidf_index", "data/tfidf.pkl"])
+def test_dotted_namespaces_get_separate_shards(index_name):
+    names = [namespace_index_name(index_name, namespace) for namespace in ("a", "a.b", "a.c")]
+    for controller in (LocalVectorController, TFIDFController, BM25Controller):
+        directories = {controller(name).index_dir for name in names}
+        assert len(directories) == 3
+        assert os.path.splitext(index_name)[0] + controller.index_suffix not in directories
+
+
+def test_default_namespace_keeps_the_index_name():
+    assert namespace_index_name("data/tfidf.pkl", None) == "data/tfidf.pkl"
+
+
+@pytest.mark.parametrize("namespace", [".hidden", "a/b", "../a", "a b"])
+def test_invalid_namespaces_are_rejected(namespace):
+    with pytest.raises(ValueError):
+        namespace_index_name("data/tfidf.pkl", namespace)
+
+
+def test_dotted_namespaces_dont_share_chunks(tmp_path):
+    index_name = str(tmp_path / "tfidf_index")
+    first = TFIDFController(namespace_index_name(index_name, "a.b"))
+    second = TFIDFController(namespace_index_name(index_name, "a.c"))
+    first.add_chunks(["ancient medicine with herbs"], ["doc#0.0#x"])
+    second.add_chunks(["roman aqueducts carried water"], ["doc#0.0#y"])
+
+    assert first.existing_ids(["doc#0.0#x", "doc#0.0#y"]) == {"doc#0.0#x"}
+    assert second.existing_ids(["doc#0.0#x", "doc#0.0#y"]) == {"doc#0.0#y"}
+    assert not second.search("medicine herbs", 5)
@@ -0,0 +1,83 @@
+import pytest
+
+from controllers.rank_fusion_controller import RankFusionController, merge_collection_results
+from routes.context_routes import fuse_ranked_lists, request_fusion_key
+
+
+def ranked(*ids, prefix="doc#"):
+    # Ranked list of deterministic chunk ids (make_chunk_id format), scores decreasing
+    return [{'id': f"{prefix}{chunk}#0123456789abcdef", 'text': f"text {chunk}", 'score': 1.0 - 0.1 * rank} for rank, chunk in enumerate(ids)]
+
+
+def fused_ids(results):
+    return [result['id'].split('#')[1] for result in results]
+
+
+def test_rrf_scores_and_ordering():
+    results = RankFusionController(method="rrf").fuse([ranked("0.a", "0.b", "0.c"), ranked("0.c", "0.a", "0.d")])
+    assert fused_ids(results) == ["0.a", "0.c", "0.b", "0.d"]
+    assert results[0]['fusion_score'] == pytest.approx(1 / 61 + 1 / 62)
+    assert results[1]['fusion_score'] == pytest.approx(1 / 63 + 1 / 61)
+    assert results[2]['fusion_score'] == pytest.approx(1 / 62)
+    assert results[0]['original_scores'] == pytest.approx([1.0, 0.9])
+
+
+def test_weights_change_the_ordering():
+    rankings = [ranked("0.a", "0.b"), ranked("0.b", "0.a")]
+    assert fused_ids(RankFusionController().fuse(rankings, weights=[2.0, 1.0])) == ["0.a", "0.b"]
+    assert fused_ids(RankFusionController().fuse(rankings, weights=[1.0, 2.0])) == ["0.b", "0.a"]
+    with pytest.raises(ValueError):
+        RankFusionController().fuse(rankings, weights=[1.0])
+
+
+@pytest.mark.parametrize("method", ["combsum", "combmnz", "zscore"])
+def test_score_methods_reward_agreement(method):
+    results = RankFusionController(method=method).fuse([ranked("0.a", "0.b", "0.c"), ranked("0.b", "0.d", "0.e")], top_k=2)
+    assert fused_ids(results)[0] == "0.b"
+    assert len(results) == 2
+
+
+def test_duplicates_keep_their_best_rank():
+    rankings = [ranked("0.a", "0.b", "0.a")]
+    results = RankFusionController().fuse(rankings)
+    assert fused_ids(results) == ["0.a", "0.b"]
+    assert results[0]['fusion_score'] == pytest.approx(1 / 61)
+
+
+def test_text_key_matches_legacy_ids():
+    # Older indexes: sha256 ids in the vector store, chunk_{idx} in the lexical indexes
+    vector = [{'id': "f00d", 'text': "shared", 'score': 0.9}, {'id': "beef", 'text': "vector only", 'score': 0.8}]
+    lexical = [{'id': "chunk_3", 'text': "lexical only", 'score': 2.0}, {'id': "chunk_7", 'text': "shared", 'score': 1.5}]
+
+    by_text = RankFusionController(key="text").fuse([vector, lexical])
+    assert [result['text'] for result in by_text] == ["shared", "lexical only", "vector only"]
+    by_id = RankFusionController(key="id").fuse([vector, lexical])
+    assert len(by_id) == 4
+
+
+def test_namespaces_are_kept_apart():
+    first = [{**item, 'namespace': "a"} for item in ranked("0.a")]
+    second = [{**item, 'namespace': "b"} for item in ranked("0.a")]
+    results = RankFusionController().fuse([first, second])
+    assert [result['namespace'] for result in results] == ["a", "b"]
+
+
+def test_default_fusion_key_falls_back_to_text():
+    shared = {'pinecone': ranked("0.a", "0.b"), 'tfidf': ranked("0.b", "0.c")}
+    assert request_fusion_key({}, shared) == "id"
+    assert request_fusion_key({"fusion_key": "text"}, shared) == "text"
+
+    legacy = {
+        'pinecone': [{'id': "f00d", 'text': "shared", 'score': 0.9}],
+        'tfidf': [{'id': "chunk_3", 'text': "shared", 'score': 2.0}, {'id': "chunk_4", 'text': "other", 'score': 1.0}]
+    }
+    assert request_fusion_key({}, legacy) == "text"
+    results = fuse_ranked_lists({}, legacy)
+    assert [result['text'] for result in results] == ["shared", "other"]
+
+
+def test_merge_collection_results_interleaves_by_rank():
+    first = [{'id': "a1", 'score': 0.9}, {'id': "a2", 'score': 0.8}]
+    second = [{'id': "b1", 'score': 0.5}, {'id': "b2", 'score': 0.4}]
+    assert [item['id'] for item in merge_collection_results([first, second], 3, "rrf")] == ["a1", "b1", "a2"]
+    assert [item['id'] for item in merge_collection_results([first, second], 3, "score")] == ["a1", "a2", "b1"]
@@ -0,0 +1,155 @@
+import os
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
+
+from controllers.document_processing_controller import TFIDFController, BM25Controller
+
+CORPUS = [
+    "The ancient Egyptians practiced medicine with herbs and surgery",
+    "Greek physicians such as Hippocrates described diseases",
+    "Roman aqueducts carried water to the cities",
+    "Chinese medicine relied on herbs, acupuncture and balance",
+    "Surgery in ancient India was described by Sushruta",
+    "The Nile flooded every year and fed Egyptian farms",
+    "Herbs were traded along the silk road between China and Rome",
+    "Hippocrates taught that diseases have natural causes",
+]
+QUERIES = ["ancient medicine herbs", "Hippocrates diseases", "water cities Rome", "surgery"]
+
+
+def wait_for_merge(index):
+    # Deletions above compact_ratio schedule a background merge
+    if index._merge_thread is not None:
+        index._merge_thread.join()
+
+
+def sklearn_scores(corpus, query):
+    # Cosine similarity of the TF-IDF vectors, the scores TFIDFController reproduces
+    vectorizer = TfidfVectorizer()
+    matrix = vectorizer.fit_transform(corpus)
+    return (matrix @ vectorizer.transform([query]).T).toarray().ravel()
+
+
+def assert_matches_sklearn(index, corpus, top_k=5):
+    for query in QUERIES:
+        expected = sklearn_scores(corpus, query)
+        results = index.search(query, top_k)
+        assert results, query
+        for idx, score in results:
+            assert score == pytest.approx(expected[idx], rel=1e-4, abs=1e-6)
+        # Same top_k set as sklearn (ties may be ordered differently)
+        top_scores = sorted(expected[expected > 0], reverse=True)[:top_k]
+        assert sorted((score for _, score in results), reverse=True) == pytest.approx(top_scores, rel=1e-4)
+
+
+def test_tfidf_scores_match_sklearn(tmp_path):
+    index = TFIDFController(str(tmp_path / "index.pkl"))
+    index.add_chunks(CORPUS, [f"doc#0.{position}#x" for position in range(len(CORPUS))])
+    assert_matches_sklearn(index, CORPUS)
+
+
+def test_tfidf_scores_match_sklearn_after_merge(tmp_path):
+    # Segments written with the document frequencies of their time, the merge refreshes their norms
+    index = TFIDFController(str(tmp_path / "index.pkl"), merge_threshold=100)
+    for start in range(0, len(CORPUS), 3):
+        chunks = CORPUS[start:start + 3]
+        index.add_chunks(chunks, [f"doc#0.{position}#x" for position in range(start, start + len(chunks))])
+    assert len(index._read_meta()['segments']) == 3
+
+    index.merge_segments()
+    assert len(index._read_meta()['segments']) == 1
+    assert_matches_sklearn(index, CORPUS)
+    assert [index.get_chunk_id(index.load_index(), idx) for idx in range(len(CORPUS))] == [f"doc#0.{position}#x" for position in range(len(CORPUS))]
+
+
+@pytest.mark.parametrize("controller", [TFIDFController, BM25Controller])
+def test_delete_then_readd(tmp_path, controller):
+    index = controller(str(tmp_path / "index.pkl"), merge_threshold=100)
+    ids = [f"doc#0.{position}#x" for position in range(len(CORPUS))]
+    index.add_chunks(CORPUS, ids)
+
+    assert index.delete_ids([ids[1], ids[7]]) == 2
+    assert index.existing_ids(ids) == set(ids) - {ids[1], ids[7]}
+    found = {index.get_chunk_id(index.load_index(), idx) for idx, _ in index.search("Hippocrates diseases", 10)}
+    assert not found & {ids[1], ids[7]}
+
+    # Deleting again is a no-op, adding the id back makes it searchable with its new text
+    assert index.delete_ids([ids[1]]) == 0
+    index.add_chunks(["Hippocrates wrote about epidemics"], [ids[1]])
+    index_data = index.load_index()
+    results = index.search("epidemics", 10, index_data=index_data)
+    assert [index.get_chunk_id(index_data, idx) for idx, _ in results] == [ids[1]]
+    assert index.get_chunk(index_data, results[0][0]) == "Hippocrates wrote about epidemics"
+    assert index.existing_ids(ids) == set(ids) - {ids[7]}
+
+    # Survives a merge, deleted chunks stay deleted
+    wait_for_merge(index)
+    index.merge_segments()
+    index_data = index.load_index()
+    assert index.existing_ids(ids) == set(ids) - {ids[7]}
+    assert [index.get_chunk_id(index_data, idx) for idx, _ in index.search("epidemics", 10, index_data=index_data)] == [ids[1]]
+
+
+@pytest.mark.parametrize("controller", [TFIDFController, BM25Controller])
+def test_readding_ids_replaces_them_in_one_manifest_write(tmp_path, controller):
+    index = controller(str(tmp_path / "index.pkl"), merge_threshold=100)
+    # Half the chunks end up replaced, keep them from scheduling a compacting merge
+    index.compact_ratio = 1.0
+    ids = [f"doc#0.{position}#x" for position in range(3)]
+    index.add_chunks(CORPUS[:3], ids)
+    version = index._read_meta()['version']
+
+    index.add_chunks(CORPUS[3:6], ids)
+    meta = index._read_meta()
+    assert meta['version'] == version + 1
+    assert meta['n_deleted'] == 3
+    index_data = index.load_index()
+    assert sorted(index.chunk_positions(index_data).values()) == [3, 4, 5]
+
+
+
+@pytest.mark.parametrize("controller", [TFIDFController, BM25Controller])
+def test_merge_drops_deleted_chunks(tmp_path, controller):
+    index = controller(str(tmp_path / "index.pkl"), merge_threshold=100)
+    index.compact_ratio = 1.0
+    ids = [f"doc#0.{position}#x" for position in range(len(CORPUS))]
+    index.add_chunks(CORPUS[:4], ids[:4])
+    index.add_chunks(CORPUS[4:], ids[4:])
+    index.delete_ids([ids[0], ids[5]])
+    # Replaced during the merge: its tombstone is renumbered into the merged positions
+    index.add_chunks(["Hippocrates wrote about epidemics"], [ids[2]])
+
+    index.merge_segments()
+    meta = index._read_meta()
+    live = [chunk for position, chunk in enumerate(CORPUS) if position not in (0, 2, 5)] + ["Hippocrates wrote about epidemics"]
+    assert meta['n_chunks'] == len(live) and meta['n_deleted'] == 0
+    assert len(meta['segments']) == 1
+    assert not os.path.exists(index._path('deleted.i64'))
+
+    # Document frequencies and lengths are those of the live chunks only
+    vocabulary = index.load_vocabulary()
+    df = np.load(index._path('df.npy'))
+    for term, term_id in vocabulary.items():
+        assert df[term_id] == sum(term in CountVectorizer().build_analyzer()(chunk) for chunk in live), term
+    assert meta['total_length'] == sum(len(CountVectorizer().build_analyzer()(chunk)) for chunk in live)
+
+    index_data = index.load_index()
+    assert {index.get_chunk_id(index_data, idx): index.get_chunk(index_data, idx) for idx in range(len(live))} == {
+        chunk_id: chunk for chunk_id, chunk in zip(ids[1:2] + ids[3:5] + ids[6:] + ids[2:3], live)
+    }
+    assert index.existing_ids(ids) == set(ids) - {ids[0], ids[5]}
+    if controller is TFIDFController:
+        assert_matches_sklearn(index, live)
+
+
+def test_deletions_schedule_a_compacting_merge(tmp_path):
+    index = TFIDFController(str(tmp_path / "index.pkl"), merge_threshold=100)
+    ids = [f"doc#0.{position}#x" for position in range(len(CORPUS))]
+    index.add_chunks(CORPUS, ids)
+    index.delete_ids(ids[:2])
+    wait_for_merge(index)
+
+    meta = index._read_meta()
+    assert meta['n_chunks'] == len(CORPUS) - 2 and meta['n_deleted'] == 0
+    assert_matches_sklearn(index, CORPUS[2:])